@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark for the CDGo pipeline.
+
+Synthetic Aviv sample/buffer pairs are generated for each case and pushed
+through `cdgo.__main__.run`, with `wine` replaced by the fake CDPro in
+`fake_cdpro.py`. Stage timings are collected through the profiling hooks
+and written as JSON so results can be compared between releases.
+
+    PYTHONPATH=. python benchmarks/run.py -o bench.json
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+import cdgo
+from cdgo import __main__ as pipeline
+from cdgo import profiling
+
+import synthetic
+import fake_cdpro
+
+STAGES = ['read_aviv', 'conversion', 'input_writing', 'setup', 'execution',
+          'file_moves', 'parsing', 'plotting', 'csv_export']
+
+# name: (first wavelength, last wavelength, step)
+SIZES = {
+    'small': (260.0, 190.0, 1.0),
+    'medium': (260.0, 178.0, 0.5),
+    'large': (260.0, 178.0, 0.1),
+}
+
+log = logging.getLogger('benchmark')
+
+
+class StageTimer(object):
+    """Profiling hook accumulating top-level stage totals"""
+
+    def __init__(self):
+        self.times = dict((s, 0.0) for s in STAGES)
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __call__(self, event, record):
+        if event != 'end':
+            return
+        self.bytes_read += record['bytes_read']
+        self.bytes_written += record['bytes_written']
+        if record['parent'] is None:
+            self.times[record['stage']] = (
+                self.times.get(record['stage'], 0.0) + record['wall'])
+
+
+def process_sample(sample, buffer, cdpro_dir, ibases, algorithms,
+                   mol_weight=14300., residues=129, conc=0.5):
+    """Run one sample/buffer pair through the CDGo pipeline
+
+    :sample: Aviv sample file
+    :buffer: Aviv buffer file
+    :cdpro_dir: (fake) CDPro directory to execute in
+    :ibases: list of ibasis integers
+    :algorithms: list of algorithm names
+    :returns: CDPro output directory
+
+    """
+    argv = ['-C', cdpro_dir, '-i', os.path.basename(sample),
+            '--buffer', os.path.basename(buffer),
+            '--mol_weight', str(mol_weight),
+            '--number_residues', str(residues),
+            '--concentration', str(conc),
+            '--db_range', '{}-{}'.format(ibases[0], ibases[-1]),
+            # time the text parser, not the parse cache
+            '--parse_cache', 'off']
+    argv += ['--{}'.format(alg) for alg in algorithms]
+    result = pipeline.parser.parse_args(argv)
+
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(sample))
+    try:
+        return pipeline.run(result)
+    finally:
+        os.chdir(cwd)
+
+
+def run_case(workdir, size, count, ibases, algorithms, repeat):
+    """Benchmark a single size/count combination
+
+    :workdir: scratch directory
+    :size: key into SIZES
+    :count: number of sample files
+    :ibases: list of ibasis integers
+    :algorithms: list of algorithm names
+    :repeat: number of repetitions
+    :returns: dict of results
+
+    """
+    first, last, step = SIZES[size]
+    case_dir = os.path.join(workdir, '{}-{}'.format(size, count))
+    data_dir = os.path.join(case_dir, 'data')
+    cdpro_dir = os.path.join(case_dir, 'CDPro')
+    for d in (data_dir, cdpro_dir):
+        pipeline.make_dir(d)
+
+    pairs = []
+    for n in range(count):
+        sample = os.path.join(data_dir, 'sample{}.dat'.format(n))
+        buffer = os.path.join(data_dir, 'buffer{}.dat'.format(n))
+        synthetic.write_pair(sample, buffer, wl_start=first, wl_end=last,
+                             step=step, seed=2 * n)
+        pairs.append((sample, buffer))
+
+    runs = []
+    for r in range(repeat):
+        timer = profiling.add_hook(StageTimer())
+        start = time.time()
+        try:
+            for sample, buffer in pairs:
+                process_sample(sample, buffer, cdpro_dir, ibases, algorithms)
+        finally:
+            profiling.remove_hook(timer)
+        timer.times['total'] = time.time() - start
+        runs.append(timer.times)
+        log.info('%s x%d run %d: %.3f s', size, count, r + 1,
+                 timer.times['total'])
+
+    stages = {}
+    for stage in STAGES + ['total']:
+        values = sorted(run[stage] for run in runs)
+        stages[stage] = {
+            'min': values[0],
+            'median': values[len(values) // 2],
+            'mean': sum(values) / len(values),
+            'per_file': values[0] / count,
+        }
+    return {
+        'size': size,
+        'bytes_read': timer.bytes_read,
+        'bytes_written': timer.bytes_written,
+        'points': int(round((first - last) / step)) + 1,
+        'files': count,
+        'ibases': ibases,
+        'algorithms': algorithms,
+        'repeat': repeat,
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the CDGo pipeline against a fake CDPro.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'],
+                        choices=sorted(SIZES), help='Spectrum sizes')
+    parser.add_argument('--counts', nargs='+', type=int, default=[1, 4],
+                        help='Number of sample files per case')
+    parser.add_argument('--db_range', type=pipeline.parse_num_list,
+                        default='1-10', help='CDPro ibasis range')
+    parser.add_argument('--algorithms', nargs='+',
+                        default=['continll', 'cdsstr'],
+                        choices=['continll', 'cdsstr', 'selcon3'])
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='Fake CDPro runtime per fit (s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Repetitions per case')
+    parser.add_argument('-o', dest='output', default='bench_output.json',
+                        help='JSON results file')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the scratch directory')
+    args = parser.parse_args()
+
+    # keep per-fit INFO messages from best_fit out of the benchmark output
+    logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                        level=logging.WARNING)
+    log.setLevel(logging.INFO)
+
+    workdir = tempfile.mkdtemp(prefix='cdgo-bench-')
+    fake_cdpro.install(os.path.join(workdir, 'bin'))
+    os.environ['PATH'] = os.path.join(workdir, 'bin') + os.pathsep + \
+        os.environ['PATH']
+    os.environ['CDGO_FAKE_DELAY'] = str(args.delay)
+
+    cases = []
+    try:
+        for size in args.sizes:
+            for count in args.counts:
+                log.info('case %s x%d', size, count)
+                cases.append(run_case(workdir, size, count, args.db_range,
+                                      args.algorithms, args.repeat))
+    finally:
+        if args.keep:
+            log.info('scratch directory kept at %s', workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    report = {
+        'cdgo_version': cdgo.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'fake_delay': args.delay,
+        'cases': cases,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    log.info('results written to %s', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic Aviv CD data files for benchmarking CDGo.
+
+The generated files mimic the text export of an Aviv spectrometer closely
+enough for `read_aviv`: an 18 line header (line 1 holds the experiment
+type), a column header row, two-space delimited data and a `$ENDDATA`
+terminator followed by trailing instrument metadata.
+"""
+
+import os
+
+import numpy as np
+
+from fake_cdpro import REFSETS, SS_LABELS, DEFAULT_SS_LABELS
+
+HEADER_LINES = 18
+COLUMNS = ['X', 'CD_Signal', 'CD_Dynode', 'CD_Temp']
+
+# Basis spectra (mean residue ellipticity, deg cm2 dmol-1) for pure helix,
+# sheet and coil. Gaussian sums approximating the familiar band shapes.
+BANDS = {
+    'helix': [(192.0, 7.0, 70000.), (208.0, 6.0, -33000.),
+              (222.0, 9.0, -34000.)],
+    'sheet': [(196.0, 7.0, 30000.), (217.0, 8.0, -18000.)],
+    'coil': [(198.0, 6.0, -40000.), (220.0, 9.0, 3000.)],
+}
+
+
+def band_spectrum(wl, bands):
+    """Sum of gaussian bands evaluated over wl
+
+    :wl: numpy array of wavelengths (nm)
+    :bands: list of (centre, width, amplitude) tuples
+    :returns: numpy array
+
+    """
+    y = np.zeros_like(wl, dtype=float)
+    for centre, width, amp in bands:
+        y += amp * np.exp(-((wl - centre) / width) ** 2)
+    return y
+
+
+def mre_spectrum(wl, fractions):
+    """Mixture of basis spectra weighted by secondary structure fractions
+
+    :wl: numpy array of wavelengths (nm)
+    :fractions: dict with keys helix, sheet, coil
+    :returns: numpy array of mean residue ellipticity
+
+    """
+    y = np.zeros_like(wl, dtype=float)
+    for ss, frac in fractions.items():
+        y += frac * band_spectrum(wl, BANDS[ss])
+    return y
+
+
+def dynode(wl, cutoff=185.0):
+    """Dynode voltage profile that rises sharply at low wavelength
+
+    Points below roughly `cutoff` exceed the 600 V limit used by
+    `read_aviv`.
+
+    :wl: numpy array of wavelengths (nm)
+    :cutoff: wavelength at which the dynode crosses 600 V
+    :returns: numpy array of voltages
+
+    """
+    return 300.0 + 300.0 * np.exp((cutoff - wl) / 4.0)
+
+
+def aviv_text(wl_start=260.0, wl_end=178.0, step=0.5, signal=None,
+              dynode_cutoff=185.0, noise=0.2, temp=25.0, seed=0,
+              exp_type='Wavelength'):
+    """Build the text of an Aviv wavelength scan
+
+    :wl_start: first (longest) wavelength
+    :wl_end: last (shortest) wavelength
+    :step: wavelength increment (nm)
+    :signal: callable mapping wavelengths to millidegrees. Defaults to a
+             mixed helix/sheet protein
+    :dynode_cutoff: wavelength below which the dynode exceeds 600 V
+    :noise: standard deviation of gaussian noise added to the signal
+    :temp: cell temperature written to the CD_Temp column
+    :seed: random seed
+    :exp_type: experiment type written to the header
+    :returns: str
+
+    """
+    rng = np.random.RandomState(seed)
+    n = int(round((wl_start - wl_end) / step)) + 1
+    wl = wl_start - step * np.arange(n)
+    if signal is None:
+        mdeg = mre_spectrum(wl, {'helix': 0.4, 'sheet': 0.25,
+                                 'coil': 0.35}) / 1000.
+    else:
+        mdeg = signal(wl)
+    mdeg = mdeg + rng.normal(0, noise, n)
+    hv = dynode(wl, dynode_cutoff)
+
+    lines = [
+        'Aviv Biomedical Model 420 Circular Dichroism Spectrometer',
+        'Experiment Type: {}'.format(exp_type),
+        'Software Version: 3.30',
+        'Date: 2016-11-09 10:00:00',
+        'Operator: synthetic',
+        'Cell Pathlength (cm): 0.1',
+        'Wavelength Start (nm): {:.2f}'.format(wl_start),
+        'Wavelength End (nm): {:.2f}'.format(wl_end),
+        'Wavelength Step (nm): {:.2f}'.format(step),
+        'Averaging Time (s): 1.000',
+        'Settling Time (s): 0.333',
+        'Bandwidth (nm): 1.000',
+        'Temperature (C): {:.2f}'.format(temp),
+        'Scans: 1',
+        'Channels: {}'.format(len(COLUMNS) - 1),
+        'Comment: generated by benchmarks/synthetic.py',
+        '',
+        '$DATA',
+    ]
+    assert len(lines) == HEADER_LINES
+    lines.append('  '.join(COLUMNS))
+    for x, y, v in zip(wl, mdeg, hv):
+        lines.append('{:.2f}  {:.4f}  {:.2f}  {:.2f}'.format(x, y, v, temp))
+    lines.append('$ENDDATA')
+    lines.append('Instrument: Aviv 420')
+    lines.append('Status: OK')
+    return '\n'.join(lines) + '\n'
+
+
+def series_text(temps, wl_start=260.0, wl_end=178.0, step=0.5,
+                dynode_cutoff=185.0, noise=0.2, seed=0, blank=False):
+    """Build the text of an Aviv temperature melt, one scan per temperature
+
+    The helix fraction falls from 0.6 to 0 across the melt.
+
+    :temps: list of temperatures (C)
+    :blank: write a flat buffer baseline instead of a protein
+    :returns: str
+
+    """
+    rng = np.random.RandomState(seed)
+    n = int(round((wl_start - wl_end) / step)) + 1
+    wl = wl_start - step * np.arange(n)
+    hv = dynode(wl, dynode_cutoff)
+    lines = aviv_text(wl_start, wl_end, step,
+                      exp_type='Wavelength/Temperature').splitlines()
+    lines = lines[:HEADER_LINES - 1]
+    t0, t1 = min(temps), max(temps)
+    for temp in temps:
+        melted = (temp - t0) / float(t1 - t0) if t1 > t0 else 0.
+        if blank:
+            mdeg = np.full_like(wl, 0.05)
+        else:
+            helix = 0.6 * (1 - melted)
+            mdeg = mre_spectrum(wl, {'helix': helix, 'sheet': 0.15,
+                                     'coil': 0.85 - helix}) / 1000.
+        mdeg = mdeg + rng.normal(0, noise, n)
+        lines.append('Temperature (C): {:.2f}'.format(temp))
+        lines.append('$DATA')
+        lines.append('  '.join(COLUMNS))
+        for x, y, v in zip(wl, mdeg, hv):
+            lines.append('{:.2f}  {:.4f}  {:.2f}  {:.2f}'.format(
+                x, y, v, temp))
+        lines.append('$ENDDATA')
+    lines.append('Instrument: Aviv 420')
+    return '\n'.join(lines) + '\n'
+
+
+def buffer_text(**kwargs):
+    """Aviv scan of a blank buffer: noise about a flat baseline
+
+    :kwargs: passed to aviv_text
+    :returns: str
+
+    """
+    kwargs.setdefault('seed', 1)
+    return aviv_text(signal=lambda wl: np.full_like(wl, 0.05), **kwargs)
+
+
+def write_pair(sample, buffer, **kwargs):
+    """Write a matched sample and buffer file
+
+    :sample: output sample file name
+    :buffer: output buffer file name
+    :kwargs: passed to aviv_text for both files
+    :returns: None
+
+    """
+    seed = kwargs.pop('seed', 0)
+    with open(sample, 'w') as f:
+        f.write(aviv_text(seed=seed, **kwargs))
+    with open(buffer, 'w') as f:
+        f.write(buffer_text(seed=seed + 1, **kwargs))
+
+
+def reference_text(refset, labels, n_proteins=30, wl_start=240,
+                   wl_end=178, seed=0):
+    """Build a reference set table in the layout read by cdgo.basis
+
+    Protein spectra (delta epsilon, 1 nm steps) are helix/sheet/coil
+    mixtures with random fractions; labels starting with 'H' count as
+    helix, 'S' as sheet and the rest as coil, split evenly.
+
+    :refset: reference set name, written in the first line
+    :labels: structure class labels
+    :n_proteins: number of reference proteins
+    :seed: random seed
+    :returns: str
+
+    """
+    rng = np.random.RandomState(seed)
+    wl = np.arange(wl_start, wl_end - 1, -1, dtype=float)
+    groups = dict((label, 'helix' if label.startswith('H') else
+                   'sheet' if label.startswith('S') else 'coil')
+                  for label in labels)
+    mix = rng.dirichlet([2., 1.5, 2.], n_proteins)
+    spectra = []
+    fractions = []
+    for helix, sheet, coil in mix:
+        f = {'helix': helix, 'sheet': sheet, 'coil': coil}
+        spectra.append(mre_spectrum(wl, f) / 3298.)
+        fractions.append([f[groups[label]] /
+                          list(groups.values()).count(groups[label])
+                          for label in labels])
+    names = ['P{:02d}'.format(i + 1) for i in range(n_proteins)]
+    # first line as cdgo.basis.TABLE_HEADER requires
+    lines = ['# cdgo reference table {} (synthetic)'.format(refset),
+             'WL  ' + '  '.join(names)]
+    spectra = np.array(spectra).T
+    for x, row in zip(wl, spectra):
+        lines.append('{:.0f}  '.format(x) +
+                     '  '.join('{:.4f}'.format(v) for v in row))
+    for label, row in zip(labels, np.array(fractions).T):
+        lines.append(label + '  ' +
+                     '  '.join('{:.4f}'.format(v) for v in row))
+    return '\n'.join(lines) + '\n'
+
+
+def write_references(table_dir, n_proteins=30, seed=0):
+    """Write a synthetic reference table for every CDPro reference set
+
+    :table_dir: directory to write <REFSET>.txt files into
+    :n_proteins: number of reference proteins per set
+    :seed: random seed; each set uses seed + ibasis
+    :returns: list of file names
+
+    """
+    out = []
+    for i, refset in enumerate(REFSETS):
+        fname = os.path.join(table_dir, refset + '.txt')
+        with open(fname, 'w') as f:
+            f.write(reference_text(refset,
+                                   SS_LABELS.get(refset, DEFAULT_SS_LABELS),
+                                   n_proteins, seed=seed + i + 1))
+        out.append(fname)
+    return out
@@ -10,19 +10,49 @@ import logging
 import argparse
 import subprocess
 from datetime import datetime
-import numpy as np
 import shutil
-import seaborn as sns
 import time
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import more_itertools
-from mathops import sum_squares_residuals
-from mathops import r_squared
-from mathops import rms_error
-from readers import read_protss
-from readers import read_continll
-from readers import read_cdsstr
+import cdgo
+import profiling
+import metrics
+import neighbours
+from summary import SummaryStream
+from summary import Progress
+from summary import SUMMARY_COLUMNS
+from summary import SERIES_COLUMNS
+from archive import Archive
+from archive import sample_key
+from archive import FIT_FIELDS
+# plotting selects the Agg backend, so it is imported before pyplot
+import plotting
+import matplotlib.pyplot as plt
+import aviv
+import basis
+import bootstrap
+import qc
+import preprocess
+import cutoffs
+import sensitivity
+import cluster
+import parity
+import resources
+import fairqueue
+import vendors
+import importer
+import parsecache
+import factorcache
+from plotting import set_style
+from cdpro import ALGORITHMS
+from cdpro import ALGORITHM_ORDER
+from cdpro import cdpro_input_header
+from cdpro import input_text
+from jobs import FitJob
+from jobs import Runner
+from jobs import ResultCache
+from readers import FRACTIONS
+from readers import parse_percent
 
 notes = (
     "\n"
@@ -44,8 +74,6 @@ notes = (
 )
 now = datetime.now()
 
-print notes
-
 
 def allowed_ibasis_val(x):
     x = int(x)
@@ -61,9 +89,17 @@ def parse_num_list(string):
     """Docstring for parse_num_list
 
     :string:
-    :returns: list of integers
+    :returns: list of integers, or neighbours.Auto for 'auto:k'
 
     """
+    try:
+        auto = neighbours.parse_auto(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'" + string + "' is not a valid auto range. Expected forms "
+            "like 'auto:3'.")
+    if auto is not None:
+        return auto
     m = re.match(r'(\d+)(?:-(\d+))?$', string)
     # ^ (or use .split('-'). anyway you like.)
     if not m:
@@ -75,6 +111,22 @@ def parse_num_list(string):
     return list(range(int(start, 10), int(end, 10)+1))
 
 
+def parse_fractions(string):
+    """Summary fractions given on the command line
+
+    :string: comma separated fraction names
+    :returns: list of names in FRACTIONS
+
+    """
+    names = [x.strip() for x in string.split(',') if x.strip()]
+    unknown = [x for x in names if x not in FRACTIONS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(
+            "'{s}' is not a list of fractions. Choose from {f}.".format(
+                s=string, f=', '.join(FRACTIONS)))
+    return names
+
+
 # Argparse
 class MyParser(argparse.ArgumentParser):
     def error(self, message):
@@ -107,7 +159,9 @@ parser.add_argument('--db_range', type=parse_num_list,
                     between 1 and 10 inclusive.
 
                     Acceptable values are ranges (e.g. 2-5) or integers
-                    (e.g. 2).
+                    (e.g. 2). 'auto:k' fits only the k reference sets
+                    closest to the spectrum, ranked with the index of the
+                    basis store.
                     """)
 parser.add_argument('--continll', action="store_true", required=False,
                     help="""
@@ -124,22 +178,250 @@ parser.add_argument('--continll', action="store_true", required=False,
 
                     [2]
                     """)
+parser.add_argument('--selcon', action="store_true", required=False,
+                    help="""
+                    Use CDGo's native self-consistent (SELCON-style) solver.
+                    It runs in-process against the compiled reference sets
+                    (see --basis_store) and does not need wine.
+                    """)
+parser.add_argument('--lsq', action="store_true", required=False,
+                    help="""
+                    Use CDGo's native constrained least squares solver:
+                    non-negative fractions summing to 1, with every spectrum
+                    of a series fitted against a basis in one batched solve.
+                    It does not need wine.
+                    """)
+parser.add_argument('--lsq_shared', action="store", type=parse_fractions,
+                    required=False,
+                    help="""
+                    Comma separated fractions (ahelix, bstrand, turn,
+                    unord) the --lsq solver holds common to every scan of a
+                    --series run, e.g. 'ahelix' when a ligand is known not
+                    to change the helix content.
+                    """)
+parser.add_argument('--selcon3', action="store_true", required=False,
+                    help="""
+                    Use SELCON3 algorithm for fitting.
 
-parser.add_argument('-v', '--verbose', action="store_true",
-                    help="Increase verbosity")
+                    If you use SELCON3 for your work please cite the
+                    following:
 
-result = parser.parse_args()
+                    [1] Sreerama, N., & Woody, R. W. (1993). A
+                    self-consistent method for the analysis of protein
+                    secondary structure from circular dichroism. Analytical
+                    biochemistry, 209(1), 32-44.
+                    """)
 
-"""
-If verbosity set, change logging to debug.
-Else leave at info
-"""
-if result.verbose:
-    logging.basicConfig(format='%(levelname)s:\t%(message)s',
-                        level=logging.DEBUG)
-else:
-    logging.basicConfig(format='%(levelname)s:\t%(message)s',
-                        level=logging.INFO)
+parser.add_argument('-v', '--verbose', action="store_true",
+                    help="Increase verbosity")
+parser.add_argument('--no-plot', action="store_true", dest="no_plot",
+                    help="Skip all figures (throughput runs).")
+parser.add_argument('--plot_workers', action="store", type=int,
+                    required=False,
+                    help="""
+                    Processes used to render figures. Defaults to one per
+                    CPU; 1 renders serially.
+                    """)
+parser.add_argument('--archive', action="store", required=False,
+                    help="""
+                    Store every fit (curves, fractions, statistics and raw
+                    CDPro output) in this HDF5 file instead of one directory
+                    per ibasis and algorithm. Several runs may share one
+                    archive. Use `cdgo extract` to recreate the directories.
+                    """)
+parser.add_argument('--metrics_file', action="store", required=False,
+                    help="""
+                    Write Prometheus metrics to this file after every fit
+                    (e.g. for the node_exporter textfile collector).
+                    """)
+parser.add_argument('--metrics_port', action="store", type=int,
+                    required=False,
+                    help="Serve Prometheus metrics on this localhost port.")
+parser.add_argument('--workers', action="store", type=int, default=None,
+                    help="""
+                    Number of CDPro fits run at once. Each fit runs in its
+                    own temporary workspace. Defaults to one per selected
+                    algorithm, so the algorithms of an ibasis run together.
+                    """)
+parser.add_argument('--cpus', action="store", type=resources.parse_cpus,
+                    required=False, metavar='LIST',
+                    help="""
+                    Pin each worker's CDPro process to one CPU of this
+                    list, e.g. 0-3,6. Workers beyond the list share CPUs.
+                    """)
+parser.add_argument('--worker_memory', action="store", type=float,
+                    required=False, metavar='MB',
+                    help="Data segment ceiling of each CDPro process.")
+parser.add_argument('--nice', action="store", type=int, required=False,
+                    help="Run CDPro processes at this niceness.")
+parser.add_argument('--max_load', action="store", type=float,
+                    required=False,
+                    help="""
+                    Halve the number of CDPro processes run at once while
+                    the 1 minute load average is above this, and add them
+                    back one at a time while the host is idle.
+                    """)
+parser.add_argument('--min_free_memory', action="store", type=float,
+                    required=False, metavar='MB',
+                    help="""
+                    Halve the number of CDPro processes run at once while
+                    less memory than this is available.
+                    """)
+parser.add_argument('--queue', action="store", required=False,
+                    metavar='DIR',
+                    help="""
+                    Spool directory shared by CDGo runs on this host. CDPro
+                    processes then take slots from it by priority class,
+                    sharing them fairly between owners; see `cdgo queue`.
+                    """)
+parser.add_argument('--priority', action="store",
+                    choices=fairqueue.CLASSES, default='normal',
+                    help="Priority class of this run's fits in --queue.")
+parser.add_argument('--owner', action="store", required=False,
+                    help="""
+                    Owner of this run's fits in --queue. Defaults to the
+                    login name.
+                    """)
+parser.add_argument('--queue_slots', action="store", type=int,
+                    required=False, metavar='N',
+                    help="""
+                    CDPro processes run at once by all runs sharing --queue.
+                    Defaults to one per CPU.
+                    """)
+parser.add_argument('--max_wait', action="store", type=float,
+                    default=fairqueue.MAX_WAIT, metavar='SECONDS',
+                    help="""
+                    Fits waiting longer than this in --queue are served
+                    before any class, oldest first.
+                    """)
+parser.add_argument('--cache_dir', action="store", required=False,
+                    help="""
+                    Keep the raw output of every fit in this directory and
+                    reuse it whenever the same input, algorithm and ibasis
+                    are fitted again.
+                    """)
+parser.add_argument('--basis_store', action="store",
+                    default=basis.DEFAULT_STORE,
+                    help="""
+                    Compiled reference sets (see `cdgo basis`), used by
+                    --selcon and --lsq and to rank the sets for --db_range
+                    auto:k.
+                    """)
+parser.add_argument('--index_components', action="store", type=int,
+                    default=0, metavar='N',
+                    help="""
+                    Reduce the reference spectra to N principal components
+                    for --db_range auto:k ranking; 0 compares full spectra.
+                    """)
+parser.add_argument('--parse_cache', action="store",
+                    default=parsecache.DEFAULT_DIR, metavar='DIR',
+                    help="""
+                    Keep parsed input files in this directory and reuse
+                    them until the file changes; 'off' always parses the
+                    text.
+                    """)
+parser.add_argument('--factor_cache', action="store", metavar='DIR',
+                    help="""
+                    Also keep the reference matrix factorisations of the
+                    native solvers (--selcon, --lsq) in this directory, per
+                    basis and wavelength window, and reuse them in later
+                    runs. By default they are kept in memory only.
+                    """)
+parser.add_argument('--factor_cache_size', action="store", type=float,
+                    default=factorcache.MAX_BYTES / 2 ** 20, metavar='MB',
+                    help="""
+                    Memory held by cached factorisations before the least
+                    recently used are dropped.
+                    """)
+parser.add_argument('--bootstrap', action="store", type=int, default=0,
+                    metavar='N',
+                    help="""
+                    Refit every algorithm and ibasis against N resampled
+                    spectra and report the mean, standard deviation and
+                    95%% interval of each secondary structure fraction.
+                    """)
+parser.add_argument('--bootstrap_sigma', action="store", type=float,
+                    required=False,
+                    help="""
+                    Instrument error (millidegrees). Bootstrap replicates
+                    add Gaussian noise of this size to the measured
+                    spectrum instead of resampling the fit residuals.
+                    """)
+parser.add_argument('--seed', action="store", type=int, required=False,
+                    help="Random seed for bootstrap replicates.")
+parser.add_argument('--replicate', action="append", metavar='FILE',
+                    help="""
+                    Further replicate scan of the sample (repeatable). All
+                    scans of the input and replicate files are averaged
+                    before fitting.
+                    """)
+parser.add_argument('--buffer_replicate', action="append", metavar='FILE',
+                    help="""
+                    Further replicate scan of the buffer (repeatable),
+                    averaged with the buffer file.
+                    """)
+parser.add_argument('--average', action="store_true",
+                    help="""
+                    Average every scan of a multi-scan sample (and buffer)
+                    file into one spectrum, with a per-point standard
+                    error, instead of failing. Implied by --replicate.
+                    """)
+parser.add_argument('--smooth', action="store", type=preprocess.parse_smooth,
+                    metavar='WINDOW[:ORDER]',
+                    help="""
+                    Savitzky-Golay smooth the blank subtracted signal with
+                    this odd window (points) and polynomial order
+                    (default 2) before fitting.
+                    """)
+parser.add_argument('--resample', action="store", default='interp',
+                    choices=preprocess.RESAMPLE_METHODS,
+                    help="""
+                    How spectra are mapped onto CDPro's 1 nm grid: linear
+                    interpolation, or the mean of the points within 0.5 nm
+                    of each wavelength.
+                    """)
+parser.add_argument('--qc', action="store", default='flag',
+                    choices=qc.ACTIONS,
+                    help="""
+                    Spectrum quality checks (points, wavelength coverage,
+                    signal to noise, dynode saturation) run before any
+                    fit. 'reject' skips fitting spectra that fail, 'flag'
+                    fits them and marks the result.
+                    """)
+parser.add_argument('--qc_thresholds', action="store",
+                    type=qc.parse_thresholds, metavar='NAME=VALUE,...',
+                    help="""
+                    Override QC thresholds: min_points, max_low_wl (nm),
+                    min_span (nm), min_snr and max_ht_fraction.
+                    """)
+parser.add_argument('--series', action="store_true",
+                    help="""
+                    The input holds several scans (repeats or a temperature
+                    melt). Each scan is fitted separately and results are
+                    written to secondary_structure_series.csv. The buffer
+                    may hold one scan, used for every sample scan, or one
+                    per sample scan.
+                    """)
+parser.add_argument('--cutoff_scan', action="store",
+                    type=cutoffs.parse_cutoffs, metavar='NM,NM,...',
+                    help="""
+                    Also fit the spectrum truncated at each of these lower
+                    wavelength limits (e.g. 178,185,190) and report how the
+                    fractions and RMSD change with the cutoff.
+                    """)
+parser.add_argument('--sensitivity', action="append",
+                    type=sensitivity.parse_axis, metavar='PARAM=PCT,...',
+                    help="""
+                    Also fit the spectrum rescaled for these percentage
+                    changes of concentration, mol_weight or
+                    number_residues (repeatable; every combination is
+                    fitted) and report how the fractions and RMSD respond.
+                    """)
+parser.add_argument('--profile', action="store_true",
+                    help="""
+                    Write a cProfile dump (and tracemalloc statistics where
+                    available) into the output directory.
+                    """)
 
 
 def logfile(fname, parser):
@@ -165,6 +447,10 @@ def logfile(fname, parser):
         f.write('iBasis range: {}\n'.format(parser.db_range))
         f.write('CONTINLL?: {}\n'.format(parser.continll))
         f.write('CDSSTR?: {}\n'.format(parser.cdsstr))
+        f.write('SELCON3?: {}\n'.format(parser.selcon3))
+        f.write('SELCON (native)?: {}\n'.format(parser.selcon))
+        f.write('LSQ (native)?: {}\n'.format(parser.lsq))
+        f.write('LSQ shared fractions: {}\n'.format(parser.lsq_shared))
 
 
 def read_line(f, line_no):
@@ -183,10 +469,12 @@ def read_line(f, line_no):
     return l
 
 
-def read_aviv(f, save_line_no=False, last_line_no=False):
+@profiling.timed('read_aviv', path_arg=0)
+def read_aviv(f, save_line_no=False, last_line_no=False, cache=None):
     """Wrapper function to read in raw Aviv CD data files
 
     :f: TODO
+    :cache: parsecache.ParseCache keeping the parsed rows, or None
     :returns: TODO
 
     """
@@ -211,12 +499,20 @@ def read_aviv(f, save_line_no=False, last_line_no=False):
             "Experiment type for file {f} is {e}.".format(f=f, e=exp_type)
         )
 
-    df = pd.read_csv(f, sep='  ', skiprows=18, header=0, engine='python')
-    if last_line_no is False:
-        line_no = df[df['X'].str.contains("\$ENDDATA")].index.tolist()
-        line_no = line_no[0]
+    cached = cache.get(f) if cache is not None else None
+    if cached is None:
+        df = pd.read_csv(f, sep='  ', skiprows=18, header=0,
+                         engine='python')
+        end = df[df['X'].str.contains("\$ENDDATA")].index.tolist()[0]
+        if cache is not None:
+            rows = df.iloc[0:end]
+            cache.put(f, parsecache.to_table(rows),
+                      {'line_no': int(end), 'header': parsecache.header(f)})
     else:
-        line_no = last_line_no
+        table, meta = cached
+        end = meta['line_no']
+        df = parsecache.to_frame(table)
+    line_no = end if last_line_no is False else last_line_no
     df = df.iloc[0:line_no]
 
     # Subsample the resulting dataframe to exclude irrelevant cols
@@ -230,66 +526,6 @@ def read_aviv(f, save_line_no=False, last_line_no=False):
     return df, line_no if save_line_no is True else df
 
 
-def replace_input(input, output, ibasis):
-    """
-    return: None
-    """
-
-    pattern = '# PRINT(.*\n)\s+(\S+)(.*)'
-    replace = '# PRINT    IBasis\n      0         {}'.format(ibasis)
-    f = open(input, 'r')
-    lines = f.read()
-    f.close()
-    r = re.sub(pattern, replace, lines)
-
-    with open(output, 'w') as o:
-        for line in r:
-            o.write(line)
-
-
-def set_style():
-    """
-    Set the global style for seaborn plots
-    """
-    sns.set(style="darkgrid")
-
-
-def cdpro_input_header(firstvalue, lastvalue, factor):
-    """
-    :returns: Multiline string mimicking cdpro output
-
-    """
-
-    firstvalue = '{:0.4f}'.format(firstvalue)
-    lastvalue = '{:0.4f}'.format(lastvalue)
-    header = ("#                                                  \n"
-              "# PRINT    IBasis                                  \n"
-              "      1         0\n"
-              "#                                                  \n"
-              "#  ONE Title Line                                  \n"
-              " Title\n"
-              "#                                                  \n"
-              "#     WL_Begin     WL_End       Factor             \n"
-              "      {first}      {last}      1.0000\n"
-              "#                                                  \n"
-              "# CDDATA (Long->Short Wavelength; 260 - 178 LIMITS \n"
-              ).format(first=lastvalue, last=firstvalue)
-    return header
-
-
-def cdpro_input_footer():
-    """
-    :returns: Multiline string mimicking cdpro input footer
-
-    """
-
-    footer = ("#                                                  \n"
-              "#  IGuess  Str1   Str2   Str3   Str4   Str5    Str6\n"
-              "        0                                          \n"
-              )
-    return footer
-
-
 def check_dir(dir):
     """
     Check whether directory dir exists.
@@ -311,6 +547,36 @@ def delete_dir(dir):
     os.makedirs(dir)
 
 
+def export_metrics(result):
+    """Write the metrics file if one was requested
+
+    :result: argparse namespace
+    :returns: None
+
+    """
+    if result.metrics_file:
+        metrics.write_textfile(result.metrics_file)
+
+
+def archive_fit(archive, key, ibasis, row, curve, fit_dir):
+    """Store a parsed fit in the archive, if one is open
+
+    :archive: Archive instance or None
+    :key: archive sample key
+    :ibasis: ibasis integer
+    :row: summary row as written to the SummaryStream
+    :curve: fit dataframe from read_continll/read_cdsstr
+    :fit_dir: directory holding the raw CDPro output
+    :returns: None
+
+    """
+    if archive is None:
+        return
+    with profiling.stage('archive', ibasis=ibasis, algorithm=row[1]):
+        fields = dict(zip(FIT_FIELDS, [row[0]] + row[2:]))
+        archive.add_fit(key, row[1], ibasis, curve, fields, fit_dir=fit_dir)
+
+
 def check_cmd(*kwargs):
     """Verify that exe in accessible
 
@@ -351,25 +617,6 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
-def list_params(df):
-    """Get key list params.
-
-    :df: pandas dataframe
-    :returns: list max, min, and step size of the pandas indices
-    """
-    df = df.index.astype(float)
-    try:
-        max = df.max()
-        min = df.min()
-        step = df[-1] - df[-2]
-    except IndexError:
-        logging.error(
-            "Bad input data. Please check that data is correctly formatted"
-        )
-        sys.exit(2)
-    return min, max, step
-
-
 def single_line_scatter(datafile, fit_label, exp_label, ax,
                         flip=True, x_col_name='WaveL',
                         calc_col='CalcCD', xlabel='Wavelength (nm)',
@@ -398,25 +645,6 @@ def single_line_scatter(datafile, fit_label, exp_label, ax,
     ax.set_ylabel(ylabel)
 
 
-def cdpro_input_writer(body, head, fname='input'):
-    """TODO: Docstring for cdpro_input_writer.
-
-    :body: CDPro input body text. Contains n rows of length 10, where the final
-           line may be up to 10 items
-    :head: CDPro input header information
-    :returns: None
-
-    """
-
-    f = open(fname, 'w')
-    f.write(head)
-    for line in body:
-        # Separate list items by two spaces and append newline
-        f.write('  ' + '  '.join(str(x) for x in line) + '\n')
-    f.write(cdpro_input_footer())
-    f.close()
-
-
 def double_line_scatter(datafile1, datafile2, fit_label1, fit_label2,
                         exp_label,
                         df1_headers, df2_headers, outfile='output.png',
@@ -441,25 +669,6 @@ def double_line_scatter(datafile1, datafile2, fit_label1, fit_label2,
     plt.savefig(outfile, bbox_inches='tight')
 
 
-def drop_indices(df):
-    """TODO: Docstring for drop_indices.
-
-    :df: pandas dataframe with float-based index
-    :returns: pandas dataframe subsampled to exclude rows with indices not
-              evenly divisible by 1
-
-    """
-    # Establish what indices we want to discard. Namely, we want to get rid of
-    # non-integers, as CDPro discards these.
-    bad_indices = ~df.index.isin(np.arange(159.5, 260.5, 1))
-
-    # Subsample the input dataframe, removing integers that match the condition
-    # above
-    df = df[bad_indices]
-
-    return df
-
-
 def millidegrees_to_epsilon(df, mrc):
     """TODO
 
@@ -523,79 +732,181 @@ def find_line(fname, pattern):
     return o, db, rmsd
 
 
-def best_fit(df, col, ax):
-    """TODO: Docstring for best_fit.
+def to_epsilon(df, mrc, method='interp'):
+    """Convert a blank-subtracted spectrum for CDPro
 
-    :df: TODO
-    :col: value for dataframe column 'alg' with which to subsample
-    :returns: TODO
+    The signal is resampled onto CDPro's 1 nm grid before conversion.
+
+    :df: dataframe with a CD_Signal column (millidegrees) indexed by
+         wavelength
+    :mrc: mean residue concentration conversion factor
+    :method: resampling method, see preprocess.resample
+    :returns: (epsilon series sorted long to short wavelength, CDPro input
+              header)
+    :raises: ValueError if the spectrum cannot be resampled
 
     """
-    if col is 'continll':
-        fit_fname = "CONTIN.CD"
-    elif col is 'cdsstr':
-        fit_fname = 'reconCD.out'
-    else:
-        logging.error("Unknown algorithm reference {} supplied.".format(col))
+    signal = preprocess.to_grid(df, 'CD_Signal', method)
+    # Convert from the input units of millidegrees to the standard delta
+    # epsilon
+    epsilon = millidegrees_to_epsilon(signal, mrc)
+    return epsilon, cdpro_input_header(signal.index.min(),
+                                       signal.index.max(), 1)
+
+
+def check_spectra(f):
+    """Format of an input file; exit unless it holds usable spectra
+
+    Aviv files must hold wavelength scans; other formats only need to be
+    recognised.
+
+    :f: file name, or None
+    :returns: format name, or None for no file
+
+    """
+    if f is None:
+        return None
+    try:
+        fmt = vendors.detect(f)
+    except (ValueError, IOError) as e:
+        logging.error(e)
         sys.exit(2)
-    # select only rows with alg value equal to col
-    df = df.loc[df['alg'] == col]
-    # select row with lowest rmsd value as top
-    top = df.ix[df['rmsd'].idxmin()]
-    logging.info('best ibasis for {a}: {i}'.format(a=col, i=top.name))
-    # full file name and path for plot file
-    fname = '{a}-ibasis{i}/{f}'.format(a=col, i=top.name, f=fit_fname)
-    # plot label for matplotlib
-    flab = '{alg} ibasis {ib} (RMSD: {rmsd})'.format(
-        alg=col, ib=top.name, rmsd=top['rmsd'])
-    # exp label for matplotlib
-    elab = '{} exp'.format(col)
-    # plot on supplied axis
-    single_line_scatter(fname, flab, elab, ax)
+    if fmt == 'aviv':
+        aviv.check_spectra(f)
+    return fmt
 
 
-def main():
-    """Docstring for main
+def average_inputs(result):
+    """Average sample and buffer replicates and subtract the blank
+
+    :result: argparse namespace
+    :returns: (dataframe of the averaged sample, buffer and difference with
+              standard errors, blank subtracted dataframe for conversion)
 
-    :returns: None
     """
+    samples = [result.cdpro_input] + (result.replicate or [])
+    sample = preprocess.average(preprocess.read_replicates(samples))
+    buffer = None
+    if result.buffer:
+        buffers = [result.buffer] + (result.buffer_replicate or [])
+        buffer = preprocess.average(preprocess.read_replicates(buffers))
+    df = preprocess.subtract(sample, buffer)
+    logging.info('Averaged {s} sample and {b} buffer scans'.format(
+        s=sample['n'].iloc[0] if len(sample) else 0,
+        b=buffer['n'].iloc[0] if buffer is not None and len(buffer) else 0))
+
+    averaged = pd.DataFrame({'sample': sample['CD_Signal'],
+                             'sample_sem': sample['CD_SEM']},
+                            columns=['sample', 'sample_sem'])
+    if buffer is not None:
+        averaged['buffer'] = buffer['CD_Signal']
+        averaged['buffer_sem'] = buffer['CD_SEM']
+    averaged['signal'] = df['CD_Signal']
+    averaged['signal_sem'] = df['CD_SEM']
+    averaged['dynode'] = sample['CD_Dynode']
+    return averaged.dropna(subset=['signal']), df
+
+
+def check_quality(result, signal, dynode, name=None):
+    """Run the spectrum quality checks selected on the command line
+
+    :result: argparse namespace
+    :signal: blank subtracted signal indexed by wavelength
+    :dynode: dynode voltages of the sample scan
+    :name: description of the spectrum for log messages
+    :returns: (qc.assess report or None, summary label)
 
-    # shell commands for continll and cdsstr
-    continll_cmd = ('echo | WINEDEBUG=-all wine Continll.exe > stdout || '
-                    'echo -n "(crashed)"')
-    cdsstr_cmd = ('echo | WINEDEBUG=-all wine CDSSTR.EXE > stdout || '
-                  '"echo -n (crashed)"')
+    """
+    if result.qc == 'off':
+        return None, ''
+    with profiling.stage('qc'):
+        report = qc.assess(signal, dynode, result.qc_thresholds)
+    text = qc.label(report, result.qc)
+    if not report['passed']:
+        logging.warning('{n} {t}'.format(n=name or result.cdpro_input,
+                                         t=text))
+    return report, text
 
-    # read in data files for dataset (dat) and reference buffer for subtraction
-    # (buf)
-    dat, lline = read_aviv(result.cdpro_input, save_line_no=True)
-    buf = read_aviv(result.buffer, save_line_no=False, last_line_no=lline)[0]
 
-    # subtract signal for reference from sample
-    df = (dat - buf).dropna()
+def ranking_index(result):
+    """Reference set index for --db_range auto:k
 
+    :result: argparse namespace
+    :returns: neighbours.SpectrumIndex, or None if no reference sets are
+              available (a warning is logged)
+
+    """
+    try:
+        with profiling.stage('ranking'):
+            store = basis.BasisStore(os.path.abspath(result.basis_store))
+            return neighbours.load_index(store, result.index_components)
+    except (KeyError, ValueError) as e:
+        logging.warning('Cannot rank reference sets ({}); fitting every '
+                        'ibasis'.format(e))
+        return None
+
+
+def select_ibases(result, epsilon, index=None):
+    """ibases to fit a spectrum against
+
+    For --db_range auto:k the k reference sets whose proteins best cover the
+    neighbourhood of the spectrum are chosen; without an index every ibasis
+    is fitted.
+
+    :result: argparse namespace
+    :epsilon: epsilon series indexed by wavelength
+    :index: neighbours.SpectrumIndex from ranking_index
+    :returns: sorted list of ibasis integers
+
+    """
+    if not isinstance(result.db_range, neighbours.Auto):
+        return result.db_range
+    if index is None:
+        return list(range(1, 11))
+    try:
+        ranks = index.rank(epsilon.astype(float))
+    except ValueError as e:
+        logging.warning('Cannot rank reference sets ({}); fitting every '
+                        'ibasis'.format(e))
+        return list(range(1, 11))
+    logging.info('Reference sets by neighbourhood coverage: {}'.format(
+        ', '.join('{i} ({s:.2f}, {n} near)'.format(i=i, s=score, n=n)
+                  for i, score, n, best in ranks)))
+    return sorted(r[0] for r in ranks[:result.db_range.k])
+
+
+def mean_residue_factor(result):
+    """Mean residue concentration conversion factor
+
+    :result: argparse namespace
+    :returns: float
+
+    """
     # convert into units of mre
     pep_bonds = result.number_residues - 1
-    mrc = result.mol_weight / (pep_bonds * result.concentration)
+    return result.mol_weight / (pep_bonds * result.concentration)
 
-    # Convert from the input units of millidegrees to the standard delta
-    # epsilon
-    epsilon = millidegrees_to_epsilon(df['CD_Signal'], mrc)
-    max, min, step = list_params(epsilon)
 
-    # Remap the df index to floats. Required for drop_indices
-    epsilon.index = epsilon.index.map(float)
-    # drop bad datapoints
-    epsilon = drop_indices(epsilon)
-    # force inverse sorting
-    epsilon = epsilon.sort_index(ascending=False)    # force inverse sorting
+def selected_algorithms(result):
+    """CDPro algorithms chosen on the command line
+
+    :result: argparse namespace
+    :returns: list of algorithm names in ALGORITHM_ORDER
+
+    """
+    return [a for a in ALGORITHM_ORDER if getattr(result, a) is True]
+
 
-    head = cdpro_input_header(max, min, 1)
+def setup_run(result):
+    """Create the output directory and the fit runner for a run
 
-    body = list(more_itertools.chunked(epsilon, 10))
-    cdpro_input_writer(body, head)
+    :result: argparse namespace
+    :returns: (output directory, log file name, jobs.Runner)
 
-    check_cmd('wine')
+    """
+    if any(not ALGORITHMS[a].get('native')
+           for a in selected_algorithms(result)):
+        check_cmd('wine')
 
     check_dir(result.cdpro_dir)
 
@@ -608,132 +919,938 @@ def main():
     # log args into to logfile lname
     lname = '{p}/input.log'.format(p=cdpro_out_dir)
     logfile(lname, result)
-    shutil.copy("input", "%s/input" % (result.cdpro_dir))
-    os.chdir(result.cdpro_dir)
-    ss_assign = pd.DataFrame()
-
-    for ibasis in result.db_range:
-
-        logging.info('ibasis %s', ibasis)
-
-        replace_input('input', 'input', ibasis)
-
-        ss_col_head = ['ibasis', 'alg', 'ahelix', 'bstrand', 'turn', 'unord',
-                       'rmsd', 'ss_res', 'r2']
-
-        if result.continll is True:
-            """
-            if continll switch is True, run the continll algorithm and pull
-            secondary structure assignments
-            """
-            logging.debug('Running CONTINLL')
-            subprocess.call([continll_cmd], shell=True)
-
-            continll_outdir = ('%s/continll-ibasis%s' % (cdpro_out_dir,
-                                                         ibasis))
-            continll_out = cd_output_style("CONTINLL.OUT", "continll.out",
-                                           "continll")
-
-            make_dir(continll_outdir)
-            for f in ["CONTIN.CD", "CONTIN.OUT", continll_out,
-                      "BASIS.PG", "ProtSS.out", "SUMMARY.PG", "stdout"]:
-                shutil.move(f, "%s/" % (continll_outdir))
-                if os.path.isfile("input"):
-                    shutil.copy("input", "%s/" % (continll_outdir))
-            # read in fit values and stats
-            db, int, ss = read_protss(
-                '{}/ProtSS.out'.format(continll_outdir))
-
-            """
-            read in continll output
-            returns stats about fit such as rms error, sum-of-squares
-            residuals, etc
-            """
-            p = read_continll('{}/CONTIN.CD'.format(continll_outdir))
-            ss_res = sum_squares_residuals(p['CalcCD'], p['ExpCD'])
-            r2 = r_squared(p['CalcCD'], p['ExpCD'])
-            rmsd = rms_error(p['CalcCD'], p['ExpCD'])
-
-            # define new dataframe with output from read_protss
-            df = pd.DataFrame(
-                [[db, 'continll', ss['ahelix'], ss['bstrand'], ss['turn'],
-                  ss['unord'], rmsd, ss_res, r2]],
-                index=[ibasis]
-
-            )
-            # append fit values and stats to dataframe
-            ss_assign = ss_assign.append(df)
-
-        if result.cdsstr is True:
-            """
-            if cdsstr switch is True, run the cdsstr algorithm and pull
-            secondary structure assignments
-            """
-            logging.debug('Running CDSSTR')
-            subprocess.call([cdsstr_cmd], shell=True)
-            cdsstr_outdir = ('%s/cdsstr-ibasis%s' % (cdpro_out_dir, ibasis))
-            make_dir(cdsstr_outdir)
-            cdsstr_out = cd_output_style("CDsstr.out", "cdsstr.out", "CDSSTR")
-
-            for f in ["reconCD.out", "ProtSS.out", cdsstr_out,
-                      "stdout"]:
-                shutil.move(f, "%s/" % (cdsstr_outdir))
-            if os.path.isfile("input"):
-                shutil.copy("input", "%s/" % (cdsstr_outdir))
-            # read in fit values and stats
-            db, int, ss = read_protss(
-                '{}/ProtSS.out'.format(cdsstr_outdir))
-
-            """
-            read in continll output
-            returns stats about fit such as rms error, sum-of-squares
-            residuals, etc
-            """
-            p = read_cdsstr('{}/reconCD.out'.format(cdsstr_outdir))
-            ss_res = sum_squares_residuals(p['CalcCD'], p['Exptl'])
-            r2 = r_squared(p['CalcCD'], p['Exptl'])
-            rmsd = rms_error(p['CalcCD'], p['Exptl'])
-
-            df = pd.DataFrame(
-                [[db, 'cdsstr', ss['ahelix'], ss['bstrand'], ss['turn'],
-                  ss['unord'], rmsd, ss_res, r2]], index=[ibasis]
-            )
-            # append fit values and stats to dataframe
-            ss_assign = ss_assign.append(df)
 
-    os.chdir(cdpro_out_dir)
+    cache = None
+    if result.cache_dir:
+        cache = ResultCache(os.path.abspath(result.cache_dir))
+    workers = result.workers or len(selected_algorithms(result))
+    runner = Runner(result.cdpro_dir, workers=workers, cache=cache,
+                    basis_store=basis.BasisStore(result.basis_store),
+                    scheduler=scheduler(result, workers),
+                    queue=shared_queue(result),
+                    factors=factor_cache(result))
+    return cdpro_out_dir, lname, runner
 
-    set_style()
 
-    # assign column headings
-    ss_assign.columns = ss_col_head
+def factor_cache(result):
+    """Factorisation cache of the native solvers of a run
 
-    # round floats to 3 decimal places for certain columns
-    ss_assign.rmsd = ss_assign.rmsd.round(3)
-    ss_assign.ss_res = ss_assign.ss_res.round(3)
-    ss_assign.r2 = ss_assign.r2.round(3)
+    :result: argparse namespace
+    :returns: factorcache.FactorCache
 
-    # Print the matplotlib overlay
-    logging.debug('Plotting fit overlays')
+    """
+    cache_dir = None
+    if result.factor_cache is not None:
+        cache_dir = os.path.abspath(result.factor_cache)
+    return factorcache.FactorCache(
+        max_bytes=int(result.factor_cache_size * 2 ** 20),
+        cache_dir=cache_dir)
 
-    outfile = 'CDSpec-{}-{}-Overlay.png'.format(
-        result.cdpro_input, time.strftime("%Y%m%d"))
 
-    fig, ax = plt.subplots(nrows=1, ncols=1)
+def log_factor_stats(runner):
+    """Log the use of the factorisation cache, if any native fit ran
 
-    if result.continll is True:
-        best_fit(ss_assign, 'continll', ax)
+    :runner: jobs.Runner
+    :returns: None
 
-    if result.cdsstr is True:
-        best_fit(ss_assign, 'cdsstr', ax)
+    """
+    stats = runner.factors.stats()
+    if stats['hit_rate'] is None:
+        return
+    logging.info('Factorisation cache: {h} hits, {d} from disk, {m} '
+                 'computed, {e} evicted; {n} entries in {b:.1f} MB'.format(
+                     h=stats['hits'], d=stats['disk_hits'],
+                     m=stats['misses'], e=stats['evictions'],
+                     n=stats['entries'], b=stats['bytes'] / 2. ** 20))
 
-    ax.legend()
-    plt.savefig(outfile, bbox_inches='tight')
 
-    ss_assign.to_csv(
-        '{}/secondary_structure_summary.csv'.format(cdpro_out_dir)
-    )
+def scheduler(result, workers):
+    """Scheduler for the CDPro processes of a run
+
+    :result: argparse namespace
+    :workers: number of workers
+    :returns: resources.Scheduler, or None if no limits were requested
+
+    """
+    options = [result.cpus, result.worker_memory, result.nice,
+               result.max_load, result.min_free_memory]
+    if all(o is None for o in options):
+        return None
+    logging.info('CDPro processes: up to {w} at once, CPUs {c}, memory '
+                 'ceiling {m} MB, nice {n}, max load {l}, min free memory '
+                 '{f} MB'.format(w=workers, c=result.cpus,
+                                 m=result.worker_memory, n=result.nice,
+                                 l=result.max_load,
+                                 f=result.min_free_memory))
+    return resources.Scheduler(workers, cpus=result.cpus,
+                               memory=result.worker_memory,
+                               nice=result.nice, max_load=result.max_load,
+                               min_free=result.min_free_memory)
+
+
+def shared_queue(result):
+    """Shared queue of a run
+
+    :result: argparse namespace
+    :returns: fairqueue.SharedQueue, or None without --queue
+
+    """
+    if not result.queue:
+        return None
+    queue = fairqueue.SharedQueue(result.queue, slots=result.queue_slots,
+                                  owner=result.owner,
+                                  priority=result.priority,
+                                  max_wait=result.max_wait)
+    logging.info('Queueing {c} fits of {o} in {d} ({n} slots)'.format(
+        c=queue.priority, o=queue.owner, d=queue.directory, n=queue.slots))
+    return queue
+
+
+# single-spectrum options run_series does not apply, with their flags
+SERIES_IGNORED = [('average', '--average'), ('replicate', '--replicate'),
+                  ('buffer_replicate', '--buffer_replicate'),
+                  ('archive', '--archive'), ('bootstrap', '--bootstrap'),
+                  ('cutoff_scan', '--cutoff_scan'),
+                  ('sensitivity', '--sensitivity')]
+
+
+def series_scans(f, fmt):
+    """Scans of a series file
+
+    Aviv files are read one scan at a time; other formats are read whole.
+
+    :f: file name
+    :fmt: format name from check_spectra
+    :returns: (number of scans, function returning an iterable of
+              aviv.Scan)
+
+    """
+    if fmt == 'aviv':
+        return aviv.count_scans(f), lambda: aviv.iter_scans(f)
+    try:
+        scans = vendors.read(f, fmt)[1]
+    except (ValueError, IOError) as e:
+        logging.error(e)
+        sys.exit(2)
+    return len(scans), lambda: iter(scans)
+
+
+def run_series(result):
+    """Fit every scan of a multi-scan or temperature series file
+
+    Scans are read (Aviv files one at a time, other formats whole),
+    converted and queued one at a time, and results are streamed to
+    secondary_structure_series.csv as fits complete. Options that only
+    apply to a single averaged spectrum are ignored with a warning.
+
+    :result: argparse namespace
+    :returns: CDPro output directory
+
+    """
+    for option, flag in SERIES_IGNORED:
+        if getattr(result, option):
+            logging.warning('{} applies to single-spectrum runs; ignoring '
+                            'it with --series'.format(flag))
+    fmt = check_spectra(result.cdpro_input)
+    buffer_fmt = check_spectra(result.buffer)
+    with profiling.stage('setup') as rec:
+        cdpro_out_dir, lname, runner = setup_run(result)
+        rec['bytes_written'] = profiling.file_size(lname)
+    mrc = mean_residue_factor(result)
+    algorithms = selected_algorithms(result)
+    n_scans, sample_scans = series_scans(result.cdpro_input, fmt)
+    if 'lsq' in algorithms:
+        # the whole series is fitted against each basis in one solve
+        runner.batch = max(runner.batch, n_scans)
+        if result.lsq_shared:
+            runner.native_options['lsq'] = {'shared': result.lsq_shared}
+
+    def jobs():
+        scans = sample_scans()
+        if result.buffer:
+            pairs = aviv.paired(scans,
+                                series_scans(result.buffer, buffer_fmt)[1]())
+        else:
+            pairs = ((s, None) for s in scans)
+        for scan, buf in pairs:
+            with profiling.stage('conversion', scan=scan.number):
+                df = scan.data
+                if buf is not None:
+                    df = (df - buf.data).dropna(subset=['CD_Signal'])
+                if len(df) < 2:
+                    logging.warning('Skipping scan {}: no usable '
+                                    'points'.format(scan.number))
+                    continue
+                if result.smooth is not None:
+                    df = preprocess.smooth(df, *result.smooth)
+            dynode = scan.data['CD_Dynode']
+            if dynode.isnull().all():
+                # no detector voltage in the export
+                dynode = None
+            report, label = check_quality(
+                result, df['CD_Signal'], dynode,
+                name='Scan {}'.format(scan.number))
+            if report is not None:
+                report.update(scan=scan.number, temperature=scan.temperature)
+                reports.append(report)
+            if label.startswith('rejected'):
+                stream.write(scan.number, [scan.temperature] +
+                             [''] * (len(SERIES_COLUMNS) - 2) + [label],
+                             sample=result.cdpro_input)
+                continue
+            with profiling.stage('conversion', scan=scan.number):
+                try:
+                    epsilon, head = to_epsilon(df, mrc, result.resample)
+                except ValueError as e:
+                    logging.warning('Skipping scan {n}: {e}'.format(
+                        n=scan.number, e=e))
+                    continue
+            for ibasis in select_ibases(result, epsilon, index):
+                for alg in algorithms:
+                    yield FitJob(alg, ibasis,
+                                 input_text(epsilon, head, ibasis),
+                                 tag=(scan.number, scan.temperature, label))
+
+    reports = []
+    stream = SummaryStream(
+        '{}/secondary_structure_series'.format(cdpro_out_dir),
+        SERIES_COLUMNS)
+    index = None
+    if isinstance(result.db_range, neighbours.Auto):
+        index = ranking_index(result)
+        n_ibases = result.db_range.k if index is not None else 10
+    else:
+        n_ibases = len(result.db_range)
+    progress = Progress(n_scans * n_ibases * len(algorithms))
+    for fit in runner.run(jobs()):
+        number, temperature, label = fit.job.tag
+        msg = 'scan {n} ({t} C) {a} ibasis {i}'.format(
+            n=number, t=temperature, a=fit.job.algorithm, i=fit.job.ibasis)
+        if fit.ok:
+            stream.write(number, [temperature, fit.job.ibasis] + fit.row() +
+                         [label], sample=result.cdpro_input)
+        else:
+            msg += ' ' + fit.status
+        export_metrics(result)
+        progress.update(msg=msg)
+
+    with profiling.stage('csv_export') as rec:
+        stream.close()
+        rec['bytes_written'] = (profiling.file_size(stream.csv_name) +
+                                profiling.file_size(stream.jsonl_name))
+    if reports:
+        qc.write(reports, '{}/quality.json'.format(cdpro_out_dir))
+
+    series = pd.read_csv(stream.csv_name, index_col=0)
+    # rejected scans have a row holding only the QC verdict
+    series = series.dropna(subset=['alg'])
+    if len(series):
+        for frac in FRACTIONS:
+            series[frac] = series[frac].map(parse_percent)
+        table = series.groupby(['temperature', 'alg'])[
+            FRACTIONS + ['rmsd']].mean()
+        table = table.round({'ahelix': 1, 'bstrand': 1, 'turn': 1,
+                             'unord': 1, 'rmsd': 3})
+        logging.info('\nMean over ibases by temperature:\n{}\n'.format(
+            table))
+    log_factor_stats(runner)
+    return cdpro_out_dir
+
+
+def run(result):
+    """Run the full CDGo pipeline for parsed command line arguments
+
+    :result: argparse namespace
+    :returns: CDPro output directory
+
+    """
+
+    if result.series is True:
+        return run_series(result)
+    if result.lsq_shared:
+        logging.warning('--lsq_shared applies to --series runs only; '
+                        'ignoring it')
+
+    # read in data files for dataset (dat) and reference buffer for subtraction
+    # (buf)
+    averaged = None
+    sample_fmt = check_spectra(result.cdpro_input)
+    buffer_fmt = check_spectra(result.buffer)
+    if result.average is True or result.replicate or \
+            sample_fmt != 'aviv' or buffer_fmt not in ('aviv', None):
+        # other vendors and mixed pairs are read through vendors.read
+        with profiling.stage('averaging'):
+            averaged, df = average_inputs(result)
+    else:
+        cache = None
+        if result.parse_cache != 'off':
+            cache = parsecache.ParseCache(
+                os.path.abspath(result.parse_cache))
+        dat, lline = read_aviv(result.cdpro_input, save_line_no=True,
+                               cache=cache)
+        buf = 0
+        if result.buffer:
+            buf = read_aviv(result.buffer, save_line_no=False,
+                            last_line_no=lline, cache=cache)[0]
+
+    with profiling.stage('conversion'):
+        if averaged is None:
+            # subtract signal for reference from sample
+            df = (dat - buf).dropna()
+            dynode = dat['CD_Dynode']
+        else:
+            dynode = averaged['dynode']
+            if dynode.isnull().all():
+                # no detector voltage in the export
+                dynode = None
+        if result.smooth is not None:
+            df = preprocess.smooth(df, *result.smooth)
+
+    quality, qc_label = check_quality(result, df['CD_Signal'], dynode)
+    rejected = qc_label.startswith('rejected')
+    epsilon = head = None
+    if not rejected:
+        with profiling.stage('conversion'):
+            mrc = mean_residue_factor(result)
+            try:
+                epsilon, head = to_epsilon(df, mrc, result.resample)
+            except ValueError as e:
+                logging.error(
+                    "Bad input data ({}). Please check that data is "
+                    "correctly formatted".format(e))
+                sys.exit(2)
+
+    with profiling.stage('setup') as rec:
+        cdpro_out_dir, lname, runner = setup_run(result)
+        rec['bytes_written'] = profiling.file_size(lname)
+
+        archive = None
+        key = sample_key(result.cdpro_input)
+        if result.archive:
+            try:
+                archive = Archive(os.path.abspath(result.archive))
+            except ImportError as e:
+                logging.error(e)
+                sys.exit(2)
+            archive.start_run(key, input=result.cdpro_input,
+                              version=cdgo.__version__,
+                              created=now.strftime("%Y-%m-%d %H:%M"))
+
+    if quality is not None:
+        qc.write(quality, '{}/quality.json'.format(cdpro_out_dir))
+
+    if averaged is not None and epsilon is not None:
+        averaged['epsilon'] = epsilon.astype(float)
+        averaged.to_csv('{}/averaged_spectrum.csv'.format(cdpro_out_dir),
+                        index_label='X')
+
+    algorithms = selected_algorithms(result)
+    jobs = []
+    if not rejected:
+        if isinstance(result.db_range, neighbours.Auto):
+            result.db_range = select_ibases(result, epsilon,
+                                            ranking_index(result))
+        with profiling.stage('input_writing') as rec:
+            text = input_text(epsilon, head)
+            with open('{}/input'.format(cdpro_out_dir), 'w') as f:
+                f.write(text)
+            rec['bytes_written'] = len(text)
+
+        jobs = [FitJob(alg, ibasis, input_text(epsilon, head, ibasis),
+                       out_dir='{o}/{a}-ibasis{i}'.format(
+                           o=cdpro_out_dir, a=alg, i=ibasis))
+                for ibasis in result.db_range for alg in algorithms]
+
+    # rows are streamed to disk as each fit completes
+    rows = []
+    # successful fits, keyed by (algorithm, ibasis)
+    fits = {}
+    stream = SummaryStream(
+        '{}/secondary_structure_summary'.format(cdpro_out_dir))
+    progress = Progress(len(jobs))
+    if rejected:
+        # no fits; the reason is the only record of the spectrum
+        stream.write('', [''] * (len(SUMMARY_COLUMNS) - 1) + [qc_label],
+                     sample=result.cdpro_input, quality=quality)
+
+    for fit in runner.run(jobs):
+        alg, ibasis = fit.job.algorithm, fit.job.ibasis
+        if not fit.ok:
+            progress.update(msg='{a} ibasis {i} {s}'.format(
+                a=alg, i=ibasis, s=fit.status))
+            export_metrics(result)
+            continue
+        row = fit.row() + [qc_label]
+        stream.write(ibasis, row, sample=result.cdpro_input,
+                     cached=fit.cached)
+        rows.append((ibasis, row))
+        fits[(alg, ibasis)] = fit
+        archive_fit(archive, key, ibasis, row, fit.curve, fit.job.out_dir)
+        export_metrics(result)
+        progress.update(msg='{a} ibasis {i}{c}'.format(
+            a=alg, i=ibasis, c=' (cached)' if fit.cached else ''))
+
+    # fits complete out of order when run in parallel
+    rows.sort(key=lambda r: (r[0], algorithms.index(r[1][1])))
+    curves = dict((k, f.curve) for k, f in fits.items())
+
+    os.chdir(cdpro_out_dir)
+
+    with profiling.stage('csv_export') as rec:
+        stream.close()
+        rec['bytes_written'] = (profiling.file_size(stream.csv_name) +
+                                profiling.file_size(stream.jsonl_name))
+
+    ss_assign = pd.DataFrame([r for i, r in rows],
+                             index=[i for i, r in rows],
+                             columns=SUMMARY_COLUMNS)
+
+    extra_files = []
+    if averaged is not None:
+        extra_files.append('averaged_spectrum.csv')
+    if quality is not None:
+        extra_files.append('quality.json')
+    if result.bootstrap > 0 and fits:
+        with profiling.stage('bootstrap') as rec:
+            sigma = None
+            if result.bootstrap_sigma is not None:
+                # instrument error is given in the input units
+                sigma = result.bootstrap_sigma * mrc / 3298
+            boot = bootstrap.run(runner, epsilon, head,
+                                 [fits[k] for k in sorted(fits)],
+                                 result.bootstrap, seed=result.seed,
+                                 sigma=sigma)
+            bname = 'secondary_structure_bootstrap.csv'
+            boot.to_csv(bname)
+            rec['bytes_written'] = profiling.file_size(bname)
+            extra_files.append(bname)
+        export_metrics(result)
+        logging.info('\nBootstrap ({n} replicates):\n{b}\n'.format(
+            n=result.bootstrap, b=boot))
+
+    if result.cutoff_scan and algorithms and not rejected:
+        with profiling.stage('cutoff_scan') as rec:
+            scan = cutoffs.run(runner, epsilon, result.cutoff_scan,
+                               algorithms, result.db_range)
+            cname = 'secondary_structure_cutoffs.csv'
+            scan.to_csv(cname, index=False)
+            rec['bytes_written'] = profiling.file_size(cname)
+            extra_files.append(cname)
+        export_metrics(result)
+        if len(scan):
+            logging.info('\nChange across cutoffs {c} nm:\n{s}\n'.format(
+                c=', '.join(str(x) for x in result.cutoff_scan),
+                s=cutoffs.spread(scan)))
+
+    if result.sensitivity and algorithms and not rejected:
+        with profiling.stage('sensitivity') as rec:
+            sens = sensitivity.run(runner, epsilon, head, result.sensitivity,
+                                   result.number_residues, algorithms,
+                                   result.db_range)
+            sname = 'secondary_structure_sensitivity.csv'
+            sens.to_csv(sname, index=False)
+            rec['bytes_written'] = profiling.file_size(sname)
+            extra_files.append(sname)
+        export_metrics(result)
+        if len(sens):
+            logging.info('\nChange per 1% change of each input (mean over '
+                         'ibases):\n{}\n'.format(sensitivity.slopes(sens)))
+
+    figures = []
+    if result.no_plot is not True and rows:
+        # Print the matplotlib overlay and per-ibasis grids
+        logging.debug('Plotting fit overlays')
+        with profiling.stage('plotting') as rec:
+            set_style()
+            prefix = 'CDSpec-{}-{}'.format(result.cdpro_input,
+                                           time.strftime("%Y%m%d"))
+            tasks = plotting.plot_tasks(ss_assign, curves, algorithms,
+                                        prefix)
+            figures = plotting.render(tasks, result.plot_workers)
+            rec['bytes_written'] = sum(profiling.file_size(f)
+                                       for f in figures)
+
+    if archive is not None:
+        with profiling.stage('archive'):
+            run_files = [lname, stream.csv_name, stream.jsonl_name]
+            archive.add_run_files(key, run_files + extra_files + figures)
+            archive.close()
+            # the per-fit directories now live in the archive
+            for ibasis, row in rows:
+                shutil.rmtree('{a}-ibasis{i}'.format(a=row[1], i=ibasis),
+                              ignore_errors=True)
+
     logging.info('\n{}\n'.format(ss_assign))
+    log_factor_stats(runner)
+    return cdpro_out_dir
+
+
+def extract_main(argv):
+    """`cdgo extract`: recreate per-fit directories from an archive
+
+    :argv: command line arguments following the subcommand
+    :returns: None
+
+    """
+    p = MyParser(prog='cdgo extract',
+                 description='Recreate CDPro output directories from a '
+                             'CDGo archive.',
+                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('archive', help="HDF5 archive written with --archive")
+    p.add_argument('-o', action="store", dest="dest", default=".",
+                   help="Directory to extract into")
+    p.add_argument('--sample', action="append",
+                   help="Sample to extract (repeatable). Default: all")
+    args = p.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                        level=logging.INFO)
+    try:
+        with Archive(args.archive, 'r') as a:
+            a.extract(args.dest, args.sample)
+    except ImportError as e:
+        logging.error(e)
+        sys.exit(2)
+
+
+def basis_main(argv):
+    """`cdgo basis`: compile reference tables into a basis store
+
+    :argv: command line arguments following the subcommand
+    :returns: None
+
+    """
+    p = MyParser(prog='cdgo basis',
+                 description='Compile reference sets into a memory-mapped '
+                             'basis store, converting the reference files '
+                             'of a CDPro directory first if asked.',
+                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('table_dir', nargs='?',
+                   help="Directory of reference tables named after their "
+                        "set, e.g. SP29.txt (see docs/usage.rst); with "
+                        "--from_cdpro the converted tables are written here, "
+                        "by default to the tables directory of the store")
+    p.add_argument('--from_cdpro', '--from-cdpro', action="store",
+                   metavar='CDPRO_DIR',
+                   help="Convert the reference spectra and structure "
+                        "fractions of this CDPro directory to tables, then "
+                        "compile them")
+    p.add_argument('--basis_store', action="store",
+                   default=basis.DEFAULT_STORE,
+                   help="Directory of the compiled store")
+    p.add_argument('--db_range', type=parse_num_list, default="1-10",
+                   help="ibasis range to compile")
+    args = p.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                        level=logging.INFO)
+    if args.from_cdpro is None and args.table_dir is None:
+        p.error('give a directory of reference tables or --from_cdpro')
+    store = basis.BasisStore(os.path.abspath(args.basis_store))
+    try:
+        if args.from_cdpro is not None:
+            check_dir(args.from_cdpro)
+            if args.table_dir is None:
+                args.table_dir = os.path.join(store.store_dir, 'tables')
+            basis.convert_cdpro(args.from_cdpro, args.table_dir,
+                                args.db_range)
+        check_dir(args.table_dir)
+        paths = store.compile(args.table_dir, args.db_range)
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(2)
+    for path in paths:
+        b = store.open(path)
+        logging.info('ibasis {i:>2} {r:<6} {n:>3} proteins {hi:g}-{lo:g} nm '
+                     '{c}'.format(i=b.ibasis, r=b.refset,
+                                  n=b.spectra.shape[1],
+                                  hi=b.wavelengths[0], lo=b.wavelengths[-1],
+                                  c=b.checksum[:16]))
+
+
+def cluster_main(argv):
+    """`cdgo cluster`: group many spectra by similarity
+
+    :argv: command line arguments following the subcommand
+    :returns: None
+
+    """
+    p = MyParser(prog='cdgo cluster',
+                 description='Cluster many CD spectra by similarity and '
+                             'pick a representative of each cluster.',
+                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('inputs', nargs='+', help="Aviv files, one per sample")
+    p.add_argument('--buffer', action="store",
+                   help="Buffer file subtracted from every sample")
+    p.add_argument('--mol_weight', type=float,
+                   help="Molecular weight (Da); with --number_residues and "
+                        "--concentration spectra are compared as delta "
+                        "epsilon rather than millidegrees")
+    p.add_argument('--number_residues', type=int, help="Residues")
+    p.add_argument('--concentration', type=float,
+                   help="Concentration (mg/ml)")
+    p.add_argument('--metric', choices=cluster.METRICS,
+                   default='correlation',
+                   help="Distance between spectra")
+    p.add_argument('--normalise', action="store_true",
+                   help="Scale spectra to unit RMS before computing RMSD, "
+                        "so only their shapes are compared")
+    p.add_argument('--linkage', choices=cluster.LINKAGES, default='average',
+                   help="Hierarchical clustering linkage")
+    p.add_argument('--clusters', type=int,
+                   help="Number of clusters; overrides --threshold")
+    p.add_argument('--threshold', type=float, default=0.05,
+                   help="Largest distance between merged clusters")
+    p.add_argument('--resample', choices=preprocess.RESAMPLE_METHODS,
+                   default='interp', help="Resampling onto the 1 nm grid")
+    p.add_argument('-o', action="store", dest="out_dir",
+                   default='cdgo-cluster', help="Output directory")
+    args = p.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                        level=logging.INFO)
+
+    scale = 1.
+    if None not in (args.mol_weight, args.number_residues,
+                    args.concentration):
+        scale = mean_residue_factor(args) / 3298
+    buffer = None
+    if args.buffer:
+        buffer = preprocess.average(preprocess.read_replicates([args.buffer]))
+    names, spectra = [], []
+    with profiling.stage('reading'):
+        for f in args.inputs:
+            check_spectra(f)
+            sample = preprocess.average(preprocess.read_replicates([f]))
+            try:
+                s = preprocess.to_grid(preprocess.subtract(sample, buffer),
+                                       'CD_Signal', args.resample)
+            except ValueError as e:
+                logging.warning('Skipping {f}: {e}'.format(f=f, e=e))
+                continue
+            names.append(f)
+            spectra.append(s * scale)
+    if len(spectra) < 2:
+        logging.error('At least two usable spectra are needed to cluster')
+        sys.exit(2)
+
+    with profiling.stage('clustering'):
+        try:
+            wl, X = cluster.stack(spectra)
+        except ValueError as e:
+            logging.error(e)
+            sys.exit(2)
+        if args.normalise:
+            rms = np.sqrt((X * X).mean(axis=1))
+            X = X / np.where(rms > 0, rms, 1.)[:, None]
+        D = cluster.distances(X, args.metric)
+        Z = cluster.linkage(D, args.linkage)
+        labels = cluster.assign(Z, len(names), args.clusters,
+                                args.threshold)
+        centres = cluster.medoids(D, labels)
+        to_centre, flagged = cluster.outliers(D, labels, centres)
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    table = pd.DataFrame({
+        'sample': names, 'cluster': labels,
+        'representative': [names[centres[c]] for c in labels],
+        'distance': np.round(to_centre, 5), 'outlier': flagged},
+        columns=['sample', 'cluster', 'representative', 'distance',
+                 'outlier'])
+    table.to_csv(os.path.join(args.out_dir, 'clusters.csv'), index=False)
+    reps = pd.DataFrame(dict(('cluster{}'.format(c), X[i])
+                             for c, i in centres.items()),
+                        index=pd.Index(wl, name='X'),
+                        columns=['cluster{}'.format(c)
+                                 for c in sorted(centres)])
+    reps.to_csv(os.path.join(args.out_dir, 'representatives.csv'))
+    np.save(os.path.join(args.out_dir, 'distances.npy'), D)
+    np.save(os.path.join(args.out_dir, 'linkage.npy'), Z)
+
+    sizes = table.groupby('cluster').size()
+    logging.info('{n} spectra in {c} clusters on {w} wavelengths '
+                 '({lo:g}-{hi:g} nm)'.format(n=len(names), c=len(centres),
+                                             w=wl.size, lo=wl[-1], hi=wl[0]))
+    for c in sorted(centres):
+        logging.info('cluster {c}: {s} spectra, representative {r}'.format(
+            c=c, s=sizes[c], r=names[centres[c]]))
+    for name in table.loc[table['outlier'], 'sample']:
+        logging.warning('Outlier: {}'.format(name))
+
+
+def parity_main(argv):
+    """`cdgo parity`: compare the native engines with CDPro
+
+    :argv: command line arguments following the subcommand
+    :returns: None
+
+    """
+    p = MyParser(prog='cdgo parity',
+                 description='Fit a corpus of CDPro input files with CDPro '
+                             'and the native engines, and compare their '
+                             'fractions, RMSD and speed.',
+                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('inputs', nargs='+',
+                   help="CDPro input files, or directories searched for "
+                        "files named input (e.g. <sample>-CDPro)")
+    p.add_argument('-C', action="store", dest="cdpro_dir",
+                   default=parser.get_default('cdpro_dir'),
+                   help="CDPro directory")
+    p.add_argument('--basis_store', action="store",
+                   default=basis.DEFAULT_STORE,
+                   help="Compiled reference sets used by the native engines")
+    p.add_argument('--db_range', type=parse_num_list, default="1-10",
+                   help="ibasis range to compare")
+    p.add_argument('--reference', nargs='+', choices=parity.REFERENCE,
+                   default=['continll', 'cdsstr'],
+                   help="CDPro algorithms to compare against")
+    p.add_argument('--native', nargs='+', choices=parity.NATIVE,
+                   default=parity.NATIVE, help="Native algorithms to check")
+    p.add_argument('--tolerances', type=parity.parse_tolerances, default={},
+                   metavar='NAME=VALUE,...',
+                   help="Largest accepted differences, overriding {}".format(
+                       ', '.join('{k}={v:g}'.format(k=k, v=v) for k, v in
+                                 sorted(parity.TOLERANCES.items()))))
+    p.add_argument('--mode', choices=parity.MODES, default='live',
+                   help="live runs CDPro; record also saves its output to "
+                        "--fixtures; replay reads it from --fixtures and "
+                        "needs no wine")
+    p.add_argument('--fixtures', action="store",
+                   help="Directory of recorded CDPro output")
+    p.add_argument('--workers', type=int, default=4,
+                   help="Number of CDPro fits run at once")
+    p.add_argument('-o', action="store", dest="out_dir",
+                   default='cdgo-parity', help="Output directory")
+    args = p.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                        level=logging.INFO)
+    if args.mode != 'live' and not args.fixtures:
+        logging.error('--mode {} needs --fixtures'.format(args.mode))
+        sys.exit(2)
+    if args.mode != 'replay':
+        check_cmd('wine')
+    check_dir(args.cdpro_dir)
+    inputs = parity.find_inputs(args.inputs)
+    if not inputs:
+        logging.error('No CDPro input files found')
+        sys.exit(2)
+    tolerances = dict(parity.TOLERANCES, **args.tolerances)
+    fixtures = parity.Fixtures(args.fixtures) if args.fixtures else None
+    runner = Runner(args.cdpro_dir, workers=args.workers,
+                    basis_store=basis.BasisStore(args.basis_store))
+    logging.info('Fitting {n} inputs x {i} ibases with {a}'.format(
+        n=len(inputs), i=len(args.db_range),
+        a=', '.join(args.reference + args.native)))
+    with profiling.stage('parity'):
+        results, timings = parity.run(runner, inputs, args.reference,
+                                      args.native, args.db_range, fixtures,
+                                      args.mode)
+    table = parity.compare(results, inputs, args.reference, args.native,
+                           args.db_range, tolerances)
+    summary = parity.by_basis(table)
+    rates = parity.speed(timings)
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    table.to_csv(os.path.join(args.out_dir, 'parity.csv'), index=False)
+    summary.to_csv(os.path.join(args.out_dir, 'parity_by_basis.csv'))
+    rates.to_csv(os.path.join(args.out_dir, 'parity_speed.csv'))
+    with pd.option_context('display.width', 120):
+        logging.info('\nAccuracy per reference set:\n{}\n'.format(summary))
+        logging.info('\nSpeed:\n{}\n'.format(rates))
+    failed = int((~table['passed']).sum())
+    if failed:
+        logging.warning('{f} of {n} comparisons outside tolerance'.format(
+            f=failed, n=len(table)))
+        sys.exit(1)
+    logging.info('All {} comparisons within tolerance'.format(len(table)))
+
+
+def import_main(argv):
+    """`cdgo import`: convert spectra of any instrument to CDPro inputs
+
+    :argv: command line arguments following the subcommand
+    :returns: None
+
+    """
+    p = MyParser(prog='cdgo import',
+                 description='Read many spectrum files of any supported '
+                             'instrument in parallel, blank subtract them '
+                             'and write a CDPro input for each.',
+                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('inputs', nargs='+', help="Spectrum files, one per "
+                                             "sample; replicate scans in a "
+                                             "file are averaged")
+    p.add_argument('--format', choices=['auto'] + sorted(vendors.FORMATS),
+                   default='auto', help="Format of the input files")
+    p.add_argument('--buffer', action="store",
+                   help="Buffer file subtracted from every sample, in any "
+                        "supported format")
+    p.add_argument('--mol_weight', type=float, required=True,
+                   help="Molecular weight (Da)")
+    p.add_argument('--number_residues', type=int, required=True,
+                   help="Residues")
+    p.add_argument('--concentration', type=float, required=True,
+                   help="Concentration (mg/ml)")
+    p.add_argument('--smooth', type=preprocess.parse_smooth,
+                   metavar='WINDOW[:ORDER]',
+                   help="Savitzky-Golay smoothing of the blank subtracted "
+                        "signal")
+    p.add_argument('--resample', choices=preprocess.RESAMPLE_METHODS,
+                   default='interp', help="Resampling onto the 1 nm grid")
+    p.add_argument('--workers', type=int,
+                   help="Processes reading files; defaults to one per CPU")
+    p.add_argument('-o', action="store", dest="out_dir",
+                   default='cdgo-import', help="Output directory")
+    args = p.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                        level=logging.INFO)
+    fmt = None if args.format == 'auto' else args.format
+
+    buffer = None
+    if args.buffer:
+        _, _, buffer, error = importer.load((args.buffer, None))
+        if buffer is None:
+            logging.error('Cannot read buffer {f}: {e}'.format(
+                f=args.buffer, e=error))
+            sys.exit(2)
+    with profiling.stage('reading') as rec:
+        rec['bytes_read'] = sum(profiling.file_size(f) for f in args.inputs)
+        loaded = importer.load_all(args.inputs, fmt, args.workers)
+
+    mrc = mean_residue_factor(args)
+    names = importer.sample_names(args.inputs)
+    rows = []
+    for sample, (fname, fmt_s, averaged, error) in zip(names, loaded):
+        if averaged is not None:
+            with profiling.stage('conversion'):
+                df = preprocess.subtract(averaged, buffer).dropna()
+                if args.smooth is not None:
+                    df = preprocess.smooth(df, *args.smooth)
+                try:
+                    epsilon, head = to_epsilon(df, mrc, args.resample)
+                except ValueError as e:
+                    averaged, error = None, str(e)
+        rows.append(importer.manifest_row(fname, sample, fmt_s, averaged,
+                                          error))
+        if averaged is None:
+            continue
+        out = os.path.join(args.out_dir, sample)
+        if not os.path.isdir(out):
+            os.makedirs(out)
+        with profiling.stage('input_writing') as rec:
+            text = input_text(epsilon, head)
+            with open(os.path.join(out, 'input'), 'w') as f:
+                f.write(text)
+            rec['bytes_written'] = len(text)
+        spectrum = pd.DataFrame({'signal': df['CD_Signal'],
+                                 'signal_sem': df['CD_SEM']},
+                                columns=['signal', 'signal_sem'])
+        spectrum['epsilon'] = epsilon.astype(float)
+        spectrum.to_csv(os.path.join(out, 'spectrum.csv'), index_label='X')
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    manifest = pd.DataFrame(rows, columns=importer.MANIFEST_COLUMNS)
+    manifest.to_csv(os.path.join(args.out_dir, 'import.csv'), index=False)
+    ok = manifest['status'] == 'ok'
+    logging.info('Imported {n} of {t} files ({f}) into {o}'.format(
+        n=ok.sum(), t=len(manifest), o=args.out_dir,
+        f=', '.join('{c} {k}'.format(c=c, k=k) for k, c in
+                    manifest.loc[ok, 'format'].value_counts().items())))
+    if not ok.all():
+        sys.exit(1)
+
+
+def queue_main(argv):
+    """`cdgo queue`: state and wait latencies of a shared queue
+
+    :argv: command line arguments following the subcommand
+    :returns: None
+
+    """
+    p = MyParser(prog='cdgo queue',
+                 description='Show the fits waiting and running in a '
+                             'shared queue and how long each priority '
+                             'class has waited for a slot.',
+                 formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('directory', help="Spool directory given as --queue")
+    p.add_argument('--since', type=float, default=3600., metavar='SECONDS',
+                   help="Report waits of slots granted this recently; 0 "
+                        "reports all")
+    args = p.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                        level=logging.INFO)
+    if not os.path.isdir(args.directory):
+        logging.error('{} is not a queue directory'.format(args.directory))
+        sys.exit(2)
+    queue = fairqueue.SharedQueue(args.directory)
+    state = fairqueue.status(queue)
+    logging.info('\nFits in the queue:\n{}\n'.format(
+        state.to_string() if len(state) else 'none'))
+    waits = queue.waits()
+    if args.since > 0:
+        waits = waits[waits['time'] >= time.time() - args.since]
+    table = fairqueue.latency(waits)
+    logging.info('\nQueue wait per class:\n{}\n'.format(
+        table.to_string() if len(table) else 'no slots granted'))
+
+
+# subcommands dispatched from main(); anything else is a normal CDGo run
+commands = {
+    'extract': extract_main,
+    'basis': basis_main,
+    'cluster': cluster_main,
+    'parity': parity_main,
+    'queue': queue_main,
+    'import': import_main,
+}
+
+
+def main():
+    """Docstring for main
+
+    :returns: None
+    """
+
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        return commands[sys.argv[1]](sys.argv[2:])
+
+    print notes
+
+    result = parser.parse_args()
+
+    """
+    If verbosity set, change logging to debug.
+    Else leave at info
+    """
+    if result.verbose:
+        logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                            level=logging.DEBUG)
+    else:
+        logging.basicConfig(format='%(levelname)s:\t%(message)s',
+                            level=logging.INFO)
+
+    if result.metrics_port:
+        metrics.serve(result.metrics_port)
+    if result.metrics_file:
+        result.metrics_file = os.path.abspath(result.metrics_file)
+
+    report = profiling.RunReport(version=cdgo.__version__,
+                                 argv=sys.argv[1:])
+    profiling.activate(report)
+    if result.profile is True:
+        prof = profiling.Profile()
+        prof.start()
+    try:
+        cdpro_out_dir = run(result)
+    finally:
+        profiling.activate(None)
+        if result.profile is True:
+            prof.stop()
+
+    # run report sits alongside input.log
+    report.write('{}/run_report.json'.format(cdpro_out_dir))
+    if result.profile is True:
+        prof.dump(cdpro_out_dir)
 
 
 if __name__ == '__main__':
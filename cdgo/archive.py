@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Consolidated HDF5 archive of CDPro fits.
+
+Instead of one directory per ibasis and algorithm holding a handful of small
+files, every fit of a run (or of a whole batch sharing one archive) is
+stored in a single compressed HDF5 file:
+
+    /runs/<sample>                        run attributes
+    /runs/<sample>/files/<name>           run level files (input.log, ...)
+    /runs/<sample>/<alg>/ibasis<N>        fractions and fit statistics
+    /runs/<sample>/<alg>/ibasis<N>/curve  fitted and experimental spectra
+    /runs/<sample>/<alg>/ibasis<N>/files  raw CDPro output, one blob each
+
+Fits can be read back individually with `Archive.fit` and `extract`
+recreates the legacy `<sample>-CDPro/<alg>-ibasis<N>/` layout on demand.
+h5py is an optional dependency, installed with `pip install cdgo[archive]`.
+"""
+
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+from readers import parse_percent
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+FIT_FIELDS = ['refset', 'ahelix', 'bstrand', 'turn', 'unord', 'rmsd',
+              'ss_res', 'r2']
+
+
+def _text(v):
+    if isinstance(v, bytes) and not isinstance(v, str):
+        return v.decode('utf-8')
+    return v
+
+
+def sample_key(fname):
+    """Archive key for an input file name
+
+    :fname: input file name
+    :returns: str safe for use as an HDF5 group name
+
+    """
+    return os.path.basename(fname).replace('/', '_')
+
+
+class Archive(object):
+    """Read and write the consolidated HDF5 fit archive"""
+
+    def __init__(self, fname, mode='a'):
+        """
+        :fname: archive file name
+        :mode: h5py file mode; 'r' to read, 'a' to read/write
+        """
+        if h5py is None:
+            raise ImportError(
+                'h5py is required for archive output. Install it with '
+                '`pip install h5py`.')
+        self.fname = fname
+        self.h5 = h5py.File(fname, mode)
+
+    def close(self):
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _blob(self, group, name, fname):
+        with open(fname, 'rb') as f:
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+        if name in group:
+            del group[name]
+        if data.size:
+            group.create_dataset(name, data=data, compression='gzip',
+                                 compression_opts=4, shuffle=False)
+        else:
+            group.create_dataset(name, data=data)
+
+    def start_run(self, sample, **attrs):
+        """Create (or replace) the group for a sample
+
+        :sample: sample key, see sample_key
+        :attrs: run attributes (e.g. input path, version)
+        :returns: None
+
+        """
+        runs = self.h5.require_group('runs')
+        if sample in runs:
+            del runs[sample]
+        g = runs.create_group(sample)
+        for k, v in attrs.items():
+            g.attrs[k] = v
+
+    def add_run_files(self, sample, fnames):
+        """Store run level files (input.log, summaries...) as blobs
+
+        :sample: sample key
+        :fnames: list of file names; missing files are skipped
+        :returns: None
+
+        """
+        g = self.h5['runs'][sample].require_group('files')
+        for fname in fnames:
+            if os.path.isfile(fname):
+                self._blob(g, os.path.basename(fname), fname)
+
+    def add_fit(self, sample, algorithm, ibasis, curve, fields, fit_dir=None):
+        """Store one CDPro fit
+
+        :sample: sample key
+        :algorithm: algorithm name
+        :ibasis: ibasis integer
+        :curve: pandas dataframe indexed by wavelength (e.g. read_continll)
+        :fields: dict with the keys in FIT_FIELDS
+        :fit_dir: directory of raw CDPro output to store as blobs
+        :returns: None
+
+        """
+        alg = self.h5['runs'][sample].require_group(algorithm)
+        name = 'ibasis{}'.format(ibasis)
+        if name in alg:
+            del alg[name]
+        g = alg.create_group(name)
+        g.attrs['ibasis'] = ibasis
+        g.attrs['refset'] = fields['refset']
+        for k in FIT_FIELDS[1:]:
+            g.attrs[k] = parse_percent(fields[k])
+
+        c = curve.reset_index()
+        d = g.create_dataset('curve', data=c.values.astype(float),
+                             compression='gzip', compression_opts=4)
+        d.attrs['columns'] = np.array([str(x) for x in c.columns],
+                                      dtype='S')
+
+        if fit_dir is not None:
+            files = g.create_group('files')
+            for f in sorted(os.listdir(fit_dir)):
+                path = os.path.join(fit_dir, f)
+                if os.path.isfile(path):
+                    self._blob(files, f, path)
+
+    def samples(self):
+        """Sample keys held in the archive
+
+        :returns: list of str
+
+        """
+        if 'runs' not in self.h5:
+            return []
+        return sorted(self.h5['runs'].keys())
+
+    def fits(self, sample):
+        """(algorithm, ibasis) pairs stored for a sample
+
+        :sample: sample key
+        :returns: list of tuples
+
+        """
+        out = []
+        run = self.h5['runs'][sample]
+        for alg in run:
+            if alg == 'files':
+                continue
+            for name in run[alg]:
+                out.append((alg, int(run[alg][name].attrs['ibasis'])))
+        return sorted(out)
+
+    def fit(self, sample, algorithm, ibasis):
+        """Read a single fit
+
+        :sample: sample key
+        :algorithm: algorithm name
+        :ibasis: ibasis integer
+        :returns: dict with the FIT_FIELDS, 'curve' dataframe and 'files'
+                  dict of file name to bytes
+
+        """
+        g = self.h5['runs'][sample][algorithm]['ibasis{}'.format(ibasis)]
+        out = dict((k, _text(g.attrs[k])) for k in FIT_FIELDS)
+        d = g['curve']
+        columns = [_text(x) for x in d.attrs['columns']]
+        curve = pd.DataFrame(d[()], columns=columns)
+        out['curve'] = curve.set_index(columns[0])
+        out['files'] = {}
+        if 'files' in g:
+            for f in g['files']:
+                out['files'][f] = g['files'][f][()].tobytes()
+        return out
+
+    def summary(self, samples=None):
+        """Secondary structure summary across samples
+
+        :samples: list of sample keys; defaults to all
+        :returns: pandas dataframe
+
+        """
+        rows = []
+        for sample in samples or self.samples():
+            for alg, ibasis in self.fits(sample):
+                g = self.h5['runs'][sample][alg]['ibasis{}'.format(ibasis)]
+                row = {'sample': sample, 'alg': alg, 'ibasis': ibasis}
+                row.update((k, _text(g.attrs[k])) for k in FIT_FIELDS)
+                rows.append(row)
+        return pd.DataFrame(rows, columns=['sample', 'ibasis', 'alg'] +
+                            FIT_FIELDS)
+
+    def extract(self, dest, samples=None):
+        """Recreate the legacy per-fit directory layout
+
+        :dest: directory in which <sample>-CDPro directories are created
+        :samples: list of sample keys; defaults to all
+        :returns: list of created output directories
+
+        """
+        created = []
+        for sample in samples or self.samples():
+            run = self.h5['runs'][sample]
+            out_dir = os.path.join(dest, '{}-CDPro'.format(sample))
+            if not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+            if 'files' in run:
+                for f in run['files']:
+                    with open(os.path.join(out_dir, f), 'wb') as fp:
+                        fp.write(run['files'][f][()].tobytes())
+            for alg, ibasis in self.fits(sample):
+                fit_dir = os.path.join(out_dir, '{a}-ibasis{i}'.format(
+                    a=alg, i=ibasis))
+                if not os.path.isdir(fit_dir):
+                    os.makedirs(fit_dir)
+                for f, data in self.fit(sample, alg, ibasis)['files'].items():
+                    with open(os.path.join(fit_dir, f), 'wb') as fp:
+                        fp.write(data)
+            logging.info('Extracted {s} into {d}'.format(s=sample,
+                                                         d=out_dir))
+            created.append(out_dir)
+        return created
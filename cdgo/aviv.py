@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming reader for multi-scan Aviv exports.
+
+Temperature melts and repeated scans are exported by the Aviv software as
+one file holding a block per scan: a column header row (`X  CD_Signal ...`),
+the data rows and a closing `$ENDDATA`, optionally preceded by `key: value`
+metadata such as `Temperature (C): 45.00`. `iter_scans` reads such a file
+line by line and yields one `Scan` at a time, so a series of any length is
+processed without holding more than one spectrum in memory.
+"""
+
+import sys
+import logging
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# one spectrum of a series; data is indexed by wavelength and holds the
+# CD_Signal and CD_Dynode columns, like read_aviv
+Scan = namedtuple('Scan', ['number', 'temperature', 'meta', 'data'])
+
+# dynode voltage above which points are discarded, as in read_aviv
+MAX_DYNODE = 600
+
+
+def _meta(line):
+    key, sep, value = line.partition(':')
+    if not sep:
+        return None
+    return key.strip(), value.strip()
+
+
+def experiment_type(f):
+    """Experiment type recorded in the header of an Aviv file
+
+    :f: file name
+    :returns: str, or None if there is no 'Experiment Type' line
+
+    """
+    with open(f) as fp:
+        for line in fp:
+            kv = _meta(line)
+            if kv and kv[0] == 'Experiment Type':
+                return kv[1]
+            if line.startswith('$ENDDATA'):
+                break
+    return None
+
+
+def check_spectra(f):
+    """Exit unless f holds wavelength scans (single, repeated or a melt)
+
+    :f: file name
+    :returns: experiment type
+
+    """
+    exp_type = experiment_type(f)
+    if exp_type is None or 'wavelength' not in exp_type.lower():
+        logging.error(
+            ("The experiment type for {f} is {e}.\n"
+             "Only wavelength scans, repeated or at a series of\n"
+             "temperatures, can be fitted.").format(f=f, e=exp_type))
+        sys.exit(2)
+    return exp_type
+
+
+def count_scans(f):
+    """Number of scans in an Aviv file
+
+    :f: file name
+    :returns: int
+
+    """
+    with open(f) as fp:
+        return sum(1 for line in fp if line.startswith('$ENDDATA'))
+
+
+def _temperature(meta, data):
+    if 'CD_Temp' in data:
+        t = np.nanmean(data['CD_Temp'])
+        if np.isfinite(t):
+            return round(float(t), 2)
+    for k, v in meta.items():
+        if k.startswith('Temperature'):
+            try:
+                return float(v)
+            except ValueError:
+                pass
+    return None
+
+
+def _scan(number, meta, columns, rows):
+    data = pd.DataFrame(np.array(rows, dtype=float).reshape(-1, len(columns)),
+                        columns=columns)
+    temperature = _temperature(meta, data)
+    data = data.set_index('X')[['CD_Signal', 'CD_Dynode']]
+    # Throw away data when the dynode voltage peaks beyond 600
+    data = data[data.CD_Dynode < MAX_DYNODE]
+    return Scan(number, temperature, dict(meta), data)
+
+
+def iter_scans(f):
+    """Yield the scans of an Aviv file one at a time
+
+    :f: file name
+    :returns: generator of Scan
+
+    """
+    meta = {}
+    columns = None
+    rows = []
+    number = 0
+    with open(f) as fp:
+        for line in fp:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == '$ENDDATA':
+                if columns is not None:
+                    number += 1
+                    yield _scan(number, meta, columns, rows)
+                columns = None
+                rows = []
+            elif columns is not None:
+                try:
+                    if len(fields) < len(columns):
+                        raise ValueError
+                    rows.append([float(x) for x in fields[:len(columns)]])
+                except ValueError:
+                    logging.warning('{f}: skipping line {l!r}'.format(
+                        f=f, l=line.strip()))
+            elif fields[0] == 'X':
+                columns = fields
+            else:
+                kv = _meta(line)
+                if kv is not None:
+                    meta[kv[0]] = kv[1]
+
+
+def paired(samples, buffers):
+    """Pair each sample scan with its buffer scan
+
+    A buffer file holding a single scan is used as the blank for every
+    sample scan; otherwise scans are paired in order.
+
+    :samples: iterable of Scan
+    :buffers: iterable of Scan
+    :returns: generator of (sample, buffer) tuples
+
+    """
+    buffers = iter(buffers)
+    first = next(buffers)
+    second = next(buffers, None)
+    if second is None:
+        for s in samples:
+            yield s, first
+        return
+    pending = [first, second]
+    for s in samples:
+        b = pending.pop(0) if pending else next(buffers, None)
+        if b is None:
+            logging.warning('Buffer has fewer scans than the sample; '
+                            'stopping at scan {}'.format(s.number - 1))
+            return
+        yield s, b
@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Precompiled, memory-mapped store of the CDPro reference sets.
+
+The reference protein spectra and secondary structure fractions of each
+ibasis are read once from a reference table and compiled into plain `.npy`
+arrays:
+
+    <store>/v1/<refset>-<checksum>/wavelengths.npy   (m,) long to short
+    <store>/v1/<refset>-<checksum>/spectra.npy       (m, n) delta epsilon
+    <store>/v1/<refset>-<checksum>/fractions.npy     (k, n) per protein
+    <store>/v1/<refset>-<checksum>/meta.json         labels, source, ...
+
+Entries are keyed by reference set and the checksum of the source file, so
+an edited reference file is compiled into a new entry and never shadows the
+old one. The size and modification time of the source are kept too, and an
+unchanged file is not hashed again. Arrays are opened with
+`numpy.load(mmap_mode='r')`: loading is near-instant and every process
+using a basis shares the same pages of the page cache.
+
+Sets are compiled from CDGo reference tables named after the set
+(`SP29.txt`, `sp29.dat`, ...): a first line starting with TABLE_HEADER, a
+header row of protein names, one row per wavelength (wavelength followed by
+one value per protein) and one row per structure class (class label
+followed by the fraction of each protein). Files without the first line are
+never compiled.
+
+`convert_cdpro` writes these tables from the reference files of a CDPro
+directory. Each set there has a spectra file, one row per wavelength with
+one delta epsilon value per protein, and a fractions file with a header of
+structure class labels as in ProtSS.out and one row per protein. The files
+are named after the set (`SP29.cd`, `sp29ss.txt`, ...) and told apart by
+their contents.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from selcon import CLASSES
+
+# store used when none is given on the command line
+DEFAULT_STORE = os.path.join(os.path.expanduser('~'), '.cdgo', 'basis')
+
+# layout version of compiled entries; bump when the layout changes
+STORE_VERSION = 1
+
+# reference sets in ibasis order, as named in ProtSS.out
+REFSETS = ['SP29', 'SP22X', 'SP37', 'SP43', 'SP37A', 'SDP42', 'SDP48',
+           'CLSTR', 'SMP50', 'SMP56']
+
+ARRAYS = ['wavelengths', 'spectra', 'fractions']
+
+# first line of every reference table
+TABLE_HEADER = '# cdgo reference table'
+
+# fewest wavelengths a CDPro spectra file holds
+MIN_ROWS = 3
+
+Basis = namedtuple('Basis', ['ibasis', 'refset', 'checksum', 'wavelengths',
+                             'spectra', 'fractions', 'labels', 'proteins'])
+
+
+def refset_name(ibasis):
+    """Reference set name of an ibasis
+
+    :ibasis: integer 1-10
+    :returns: str
+    :raises: ValueError for an unknown ibasis
+
+    """
+    if not 1 <= ibasis <= len(REFSETS):
+        raise ValueError('Unknown ibasis {}'.format(ibasis))
+    return REFSETS[ibasis - 1]
+
+
+def is_table(fname):
+    """Whether a file is a CDGo reference table
+
+    :fname: file name
+    :returns: bool
+
+    """
+    try:
+        with open(fname) as f:
+            return f.readline().startswith(TABLE_HEADER)
+    except (IOError, OSError):
+        return False
+
+
+def find_reference(table_dir, refset):
+    """Reference table of a set
+
+    Files named after the set that are not reference tables, such as
+    CDPro's own files, are skipped.
+
+    :table_dir: directory of reference tables
+    :refset: reference set name, e.g. 'SP29'
+    :returns: path, or None if there is no such table
+
+    """
+    for f in sorted(os.listdir(table_dir)):
+        stem, ext = os.path.splitext(f)
+        if stem.lower() == refset.lower() and ext.lower() != '.npy':
+            path = os.path.join(table_dir, f)
+            if os.path.isfile(path) and is_table(path):
+                return path
+            logging.debug('{} is not a reference table; skipped'.format(
+                path))
+    return None
+
+
+def checksum(fname):
+    """sha1 of a file's contents
+
+    :fname: file name
+    :returns: hex digest
+
+    """
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_stat(fname):
+    """Identity of a source file short of its checksum
+
+    :fname: file name
+    :returns: dict of source (absolute path), size and mtime
+
+    """
+    st = os.stat(fname)
+    return {'source': os.path.abspath(fname), 'size': st.st_size,
+            'mtime': st.st_mtime}
+
+
+def read_reference(fname):
+    """Parse a reference set text table
+
+    :fname: reference file
+    :returns: (wavelengths long to short, (m, n) spectra, (k, n) fractions,
+              structure labels, protein names)
+    :raises: ValueError if the file is not a reference table or is malformed
+
+    """
+    proteins = None
+    rows = {}
+    labels = []
+    fractions = []
+    with open(fname) as fp:
+        if not fp.readline().startswith(TABLE_HEADER):
+            raise ValueError('{f} is not a reference table (first line '
+                             '{h!r})'.format(f=fname, h=TABLE_HEADER))
+        for line in fp:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if proteins is None:
+                proteins = fields[1:]
+                continue
+            try:
+                values = [float(x) for x in fields[1:]]
+            except ValueError:
+                raise ValueError('{f}: bad row {l!r}'.format(
+                    f=fname, l=line.strip()))
+            if len(values) != len(proteins):
+                raise ValueError('{f}: expected {n} values in row '
+                                 '{l!r}'.format(f=fname, n=len(proteins),
+                                                l=line.strip()))
+            try:
+                rows[float(fields[0])] = values
+            except ValueError:
+                labels.append(fields[0])
+                fractions.append(values)
+    if not rows or not labels:
+        raise ValueError('{} holds no reference spectra or fractions'.format(
+            fname))
+    wl = np.array(sorted(rows, reverse=True))
+    spectra = np.array([rows[w] for w in wl])
+    return wl, spectra, np.array(fractions), labels, proteins
+
+
+def _numbers(fields):
+    try:
+        return [float(x) for x in fields]
+    except ValueError:
+        return None
+
+
+def _is_fraction_header(fields):
+    return bool(fields) and all(x in CLASSES for x in fields)
+
+
+def cdpro_kind(fname):
+    """Kind of a CDPro reference file
+
+    :fname: file name
+    :returns: 'spectra', 'fractions', or None for any other file
+
+    """
+    rows = 0
+    try:
+        with open(fname) as fp:
+            for line in fp:
+                fields = line.replace('#', ' ').split()
+                if _is_fraction_header(fields):
+                    return 'fractions'
+                values = _numbers(fields)
+                if values and len(values) >= 2 and 100 <= values[0] <= 400:
+                    rows += 1
+    except (IOError, OSError):
+        return None
+    return 'spectra' if rows >= MIN_ROWS else None
+
+
+def find_cdpro_reference(cdpro_dir, refset):
+    """Spectra and fractions files of a reference set in a CDPro directory
+
+    :cdpro_dir: CDPro directory
+    :refset: reference set name, e.g. 'SP29'
+    :returns: (spectra file, fractions file); either is None if missing
+
+    """
+    # files of SP37A are not files of SP37
+    longer = [r.upper() for r in REFSETS
+              if r.upper().startswith(refset.upper()) and r != refset]
+    found = {}
+    for f in sorted(os.listdir(cdpro_dir)):
+        stem, ext = os.path.splitext(f)
+        stem = stem.upper()
+        if not stem.startswith(refset.upper()) or ext.lower() == '.npy' or \
+                any(stem.startswith(r) for r in longer):
+            continue
+        path = os.path.join(cdpro_dir, f)
+        if not os.path.isfile(path) or is_table(path):
+            continue
+        kind = cdpro_kind(path)
+        if kind is not None and kind not in found:
+            found[kind] = path
+    return found.get('spectra'), found.get('fractions')
+
+
+def read_cdpro_reference(spectra_file, fractions_file):
+    """Parse the reference files of a CDPro set
+
+    Fractions given in percent are scaled to sum to 1.
+
+    :spectra_file: one row per wavelength: wavelength, then one delta
+                   epsilon value per protein; optional title, count and
+                   protein name rows come first
+    :fractions_file: a row of structure class labels, then one row per
+                     protein: optional protein name and one fraction per
+                     class
+    :returns: (wavelengths long to short, (m, n) spectra, (k, n) fractions,
+              structure labels, protein names)
+    :raises: ValueError if the files are malformed or disagree
+
+    """
+    labels = None
+    names = []
+    fractions = []
+    with open(fractions_file) as fp:
+        for line in fp:
+            fields = line.replace('#', ' ').split()
+            if labels is None:
+                if _is_fraction_header(fields):
+                    labels = fields
+                continue
+            values = _numbers(fields[-len(labels):])
+            if values is None or len(fields) < len(labels):
+                if fields and _numbers(fields[-1:]) is not None:
+                    raise ValueError('{f}: bad row {l!r}'.format(
+                        f=fractions_file, l=line.strip()))
+                continue
+            # the protein name, if any, precedes its fractions
+            if len(fields) > len(labels):
+                names.append(fields[-len(labels) - 1])
+            fractions.append(values)
+    if labels is None or not fractions:
+        raise ValueError('{} holds no structure fractions'.format(
+            fractions_file))
+    n = len(fractions)
+    proteins = None
+    rows = {}
+    with open(spectra_file) as fp:
+        for line in fp:
+            fields = line.replace('#', ' ').split()
+            values = _numbers(fields)
+            if values is None:
+                if proteins is None and len(fields) in (n, n + 1):
+                    proteins = fields[-n:]
+                continue
+            if not values:
+                continue
+            if len(values) != n + 1 or not 100 <= values[0] <= 400:
+                if not rows:
+                    # counts or ranges ahead of the data
+                    continue
+                raise ValueError('{f}: expected a wavelength and {n} values '
+                                 'in row {l!r}'.format(f=spectra_file, n=n,
+                                                       l=line.strip()))
+            rows[values[0]] = values[1:]
+    if len(rows) < MIN_ROWS:
+        raise ValueError('{} holds no reference spectra'.format(
+            spectra_file))
+    if names and len(names) != n:
+        raise ValueError('{} names only some proteins'.format(
+            fractions_file))
+    if names and proteins and names != proteins:
+        raise ValueError('{s} and {f} list different proteins'.format(
+            s=spectra_file, f=fractions_file))
+    proteins = names or proteins or \
+        ['P{:02d}'.format(i + 1) for i in range(n)]
+    F = np.array(fractions).T
+    if F.sum(axis=0).max() > 1.5:
+        F = F / 100.
+    wl = np.array(sorted(rows, reverse=True))
+    spectra = np.array([rows[w] for w in wl])
+    return wl, spectra, F, labels, proteins
+
+
+def reference_text(refset, wl, spectra, fractions, labels, proteins):
+    """Reference table of a set, as read by read_reference
+
+    :refset: reference set name, written in the first line
+    :wl: (m,) wavelengths
+    :spectra: (m, n) delta epsilon
+    :fractions: (k, n) structure fractions
+    :labels: structure class labels
+    :proteins: protein names
+    :returns: str
+
+    """
+    lines = ['{h}: {r}'.format(h=TABLE_HEADER, r=refset),
+             'WL  ' + '  '.join(proteins)]
+    for x, row in zip(wl, spectra):
+        lines.append('{:g}  '.format(x) +
+                     '  '.join('{:.6g}'.format(v) for v in row))
+    for label, row in zip(labels, fractions):
+        lines.append(label + '  ' +
+                     '  '.join('{:.6g}'.format(v) for v in row))
+    return '\n'.join(lines) + '\n'
+
+
+def convert_cdpro(cdpro_dir, table_dir, ibases=None):
+    """Write reference tables from the reference files of a CDPro directory
+
+    Tables whose contents would not change are left untouched.
+
+    :cdpro_dir: CDPro directory
+    :table_dir: directory to write <REFSET>.txt tables into; created if
+                missing
+    :ibases: ibasis integers to convert; default all
+    :returns: list of table file names
+    :raises: ValueError if a reference file is malformed
+
+    """
+    if not os.path.isdir(table_dir):
+        os.makedirs(table_dir)
+    out = []
+    for ibasis in ibases or range(1, len(REFSETS) + 1):
+        refset = refset_name(ibasis)
+        spectra_file, fractions_file = find_cdpro_reference(cdpro_dir,
+                                                            refset)
+        if spectra_file is None or fractions_file is None:
+            logging.warning('No CDPro reference spectra and fractions for '
+                            '{r} (ibasis {i}) in {d}'.format(
+                                r=refset, i=ibasis, d=cdpro_dir))
+            continue
+        text = reference_text(refset, *read_cdpro_reference(
+            spectra_file, fractions_file))
+        fname = os.path.join(table_dir, refset + '.txt')
+        old = None
+        if os.path.isfile(fname):
+            with open(fname) as f:
+                old = f.read()
+        if text != old:
+            with open(fname, 'w') as f:
+                f.write(text)
+            logging.info('Converted {r} from {s} and {f}'.format(
+                r=refset, s=spectra_file, f=fractions_file))
+        out.append(fname)
+    return out
+
+
+class BasisStore(object):
+    """Compile and open memory-mapped reference sets"""
+
+    def __init__(self, store_dir):
+        """
+        :store_dir: store directory; created if missing
+        """
+        self.store_dir = store_dir
+        self.root = os.path.join(store_dir, 'v{}'.format(STORE_VERSION))
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    def path(self, refset, digest):
+        return os.path.join(self.root, '{r}-{c}'.format(r=refset,
+                                                        c=digest[:16]))
+
+    def compile(self, table_dir, ibases=None):
+        """Compile the reference tables found in a directory
+
+        Sets already compiled from identical files are left as they are; a
+        file of unchanged size and modification time is not hashed again.
+
+        :table_dir: directory of reference tables
+        :ibases: ibasis integers to compile; default all
+        :returns: list of entry directories, one per compiled set
+
+        """
+        out = []
+        entries = self.entries()
+        for ibasis in ibases or range(1, len(REFSETS) + 1):
+            refset = refset_name(ibasis)
+            src = find_reference(table_dir, refset)
+            if src is None:
+                logging.warning('No reference table for {r} (ibasis {i}) in '
+                                '{d}'.format(r=refset, i=ibasis,
+                                             d=table_dir))
+                continue
+            stat = source_stat(src)
+            current = [e['path'] for e in entries if e['refset'] == refset and
+                       all(e.get(k) == v for k, v in stat.items())]
+            if current:
+                out.append(current[0])
+                continue
+            digest = checksum(src)
+            path = self.path(refset, digest)
+            if not os.path.isdir(path):
+                self._write(path, ibasis, refset, digest, src)
+            else:
+                self._update_meta(path, stat)
+            out.append(path)
+        return out
+
+    def _update_meta(self, path, stat):
+        # an identical file under a new name or time: record it so that
+        # later loads recognise it without hashing
+        fname = os.path.join(path, 'meta.json')
+        with open(fname) as f:
+            meta = json.load(f)
+        meta.update(stat)
+        fd, tmp = tempfile.mkstemp(dir=path, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        os.rename(tmp, fname)
+
+    def _write(self, path, ibasis, refset, digest, src):
+        wl, spectra, fractions, labels, proteins = read_reference(src)
+        tmp = tempfile.mkdtemp(dir=self.root, prefix='.tmp-')
+        for name, arr in zip(ARRAYS, [wl, spectra, fractions]):
+            np.save(os.path.join(tmp, name + '.npy'),
+                    np.ascontiguousarray(arr, dtype=np.float64))
+        meta = {'version': STORE_VERSION, 'ibasis': ibasis,
+                'refset': refset, 'checksum': digest, 'labels': labels,
+                'proteins': proteins}
+        meta.update(source_stat(src))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        try:
+            # atomic, so concurrent compilers never expose a partial entry
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        logging.info('Compiled {r} ({n} proteins, {m} wavelengths)'.format(
+            r=refset, n=spectra.shape[1], m=wl.size))
+
+    def entries(self):
+        """Metadata of every compiled entry
+
+        :returns: list of dicts from meta.json, with the entry 'path' added
+
+        """
+        out = []
+        for d in sorted(os.listdir(self.root)):
+            meta = os.path.join(self.root, d, 'meta.json')
+            if d.startswith('.') or not os.path.isfile(meta):
+                continue
+            with open(meta) as f:
+                entry = json.load(f)
+            entry['path'] = os.path.join(self.root, d)
+            out.append(entry)
+        return out
+
+    def open(self, path):
+        """Memory-map a compiled entry
+
+        :path: entry directory
+        :returns: Basis with read-only memory-mapped arrays
+
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in ARRAYS]
+        return Basis(meta['ibasis'], meta['refset'], meta['checksum'],
+                     arrays[0], arrays[1], arrays[2], meta['labels'],
+                     meta['proteins'])
+
+    def load(self, ibasis, table_dir=None):
+        """Open the compiled reference set of an ibasis
+
+        With table_dir the entry matching the current reference table is
+        opened, compiling it first if the table is new or has changed.
+        Otherwise the most recently compiled entry is used.
+
+        :ibasis: integer 1-10
+        :table_dir: directory of reference tables to check the entry
+                    against, or None
+        :returns: Basis
+        :raises: KeyError if the set is neither compiled nor compilable
+
+        """
+        refset = refset_name(ibasis)
+        if table_dir is not None and find_reference(table_dir, refset):
+            return self.open(self.compile(table_dir, [ibasis])[0])
+        entries = [e for e in self.entries() if e['refset'] == refset]
+        if not entries:
+            raise KeyError(
+                '{r} (ibasis {i}) has not been compiled; see `cdgo basis '
+                '--from_cdpro`'.format(r=refset, i=ibasis))
+        latest = max(entries, key=lambda e: os.path.getmtime(e['path']))
+        return self.open(latest['path'])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bootstrap uncertainty estimates for secondary structure fractions.
+
+Each (algorithm, ibasis) fit is repeated against N perturbed copies of the
+epsilon spectrum and the spread of the refitted fractions is reported. By
+default the perturbations are residual bootstrap replicates: the residuals
+of the original fit are resampled with replacement and added back onto its
+calculated spectrum. Alternatively Gaussian noise of a known instrument
+error is added to the measured spectrum. All replicates of all fits are
+generated as one array and run as a single batch of FitJobs, so they share
+the runner's workers and result cache.
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+from cdpro import input_text
+from jobs import FitJob
+from readers import FRACTIONS
+from readers import parse_percent
+
+PERCENTILES = (2.5, 97.5)
+
+
+def residuals(curve, exp_col, wavelengths):
+    """Calculated spectrum and centred residuals of a fit
+
+    :curve: fit dataframe indexed by wavelength
+    :exp_col: name of the experimental column in curve
+    :wavelengths: array of wavelengths to return the calculated spectrum on
+    :returns: (calc, resid) arrays; calc is NaN where the fit has no point
+
+    """
+    index = np.asarray(curve.index, dtype=float)
+    calc = np.asarray(curve['CalcCD'], dtype=float)
+    resid = np.asarray(curve[exp_col], dtype=float) - calc
+    resid = resid - resid.mean()
+    lookup = pd.Series(calc, index=np.round(index, 1))
+    lookup = lookup[~lookup.index.duplicated()]
+    on_grid = lookup.reindex(np.round(wavelengths, 1)).values
+    return on_grid, resid
+
+
+def replicates(eps, n, rng, calc=None, resid=None, sigma=None):
+    """Perturbed copies of a spectrum
+
+    :eps: measured epsilon spectrum, 1D array
+    :n: number of replicates
+    :rng: numpy RandomState
+    :calc: calculated spectrum on the grid of eps (residual bootstrap);
+           NaN entries fall back to eps
+    :resid: residuals to resample (residual bootstrap)
+    :sigma: standard deviation of Gaussian noise added to eps instead
+    :returns: (n, len(eps)) array
+
+    """
+    eps = np.asarray(eps, dtype=float)
+    if sigma is not None:
+        return eps + rng.normal(0.0, sigma, size=(n, eps.size))
+    base = np.where(np.isnan(calc), eps, calc)
+    return base + rng.choice(resid, size=(n, eps.size), replace=True)
+
+
+def jobs(algorithm, ibasis, spectra, head):
+    """FitJobs for a block of replicate spectra
+
+    :algorithm: algorithm name
+    :ibasis: ibasis integer
+    :spectra: (n, m) array of replicate spectra, long to short wavelength
+    :head: CDPro input header
+    :returns: list of FitJob tagged with the replicate number
+
+    """
+    out = []
+    for i, spectrum in enumerate(spectra):
+        values = ['%1.3f' % x for x in spectrum]
+        out.append(FitJob(algorithm, ibasis,
+                          input_text(values, head, ibasis), tag=i))
+    return out
+
+
+def summarise(samples):
+    """Mean, standard deviation and percentile interval per fit
+
+    :samples: dict of (algorithm, ibasis) to a list of ss dicts as returned
+              by read_protss
+    :returns: dataframe indexed by ibasis
+
+    """
+    rows = []
+    index = []
+    for (alg, ibasis), ss in sorted(samples.items(),
+                                    key=lambda kv: (kv[0][1], kv[0][0])):
+        row = [alg, len(ss)]
+        for frac in FRACTIONS:
+            x = np.array([parse_percent(s[frac]) for s in ss])
+            if x.size == 0:
+                row.extend([np.nan] * 4)
+                continue
+            lo, hi = np.percentile(x, PERCENTILES)
+            row.extend([round(x.mean(), 1),
+                        round(x.std(ddof=1), 1) if x.size > 1 else np.nan,
+                        round(lo, 1), round(hi, 1)])
+        rows.append(row)
+        index.append(ibasis)
+    columns = ['alg', 'n']
+    for frac in FRACTIONS:
+        columns.extend([frac + '_mean', frac + '_sd', frac + '_lo',
+                        frac + '_hi'])
+    return pd.DataFrame(rows, index=index, columns=columns)
+
+
+def run(runner, epsilon, head, fits, n, seed=None, sigma=None):
+    """Bootstrap every fit of a run
+
+    :runner: jobs.Runner
+    :epsilon: epsilon series indexed by wavelength, long to short, as
+              written to the CDPro input
+    :head: CDPro input header
+    :fits: list of successful jobs.FitResult from the main sweep
+    :n: replicates per fit
+    :seed: random seed; fixing it makes replicates (and cache keys)
+           reproducible
+    :sigma: Gaussian noise in delta epsilon units; None for residual
+            bootstrap
+    :returns: summarise dataframe
+
+    """
+    rng = np.random.RandomState(seed)
+    wl = np.asarray(epsilon.index, dtype=float)
+    eps = np.asarray(epsilon, dtype=float)
+    batch = []
+    samples = {}
+    for fit in fits:
+        alg = fit.job.algorithm
+        calc = resid = None
+        if sigma is None:
+            exp_col = 'ExpCD' if 'ExpCD' in fit.curve.columns else 'Exptl'
+            calc, resid = residuals(fit.curve, exp_col, wl)
+        spectra = replicates(eps, n, rng, calc=calc, resid=resid,
+                             sigma=sigma)
+        batch.extend(jobs(alg, fit.job.ibasis, spectra, head))
+        samples[(alg, fit.job.ibasis)] = []
+
+    logging.info('Bootstrapping {f} fits with {n} replicates each'.format(
+        f=len(fits), n=n))
+    failed = 0
+    for r in runner.run(batch):
+        if r.ok:
+            samples[(r.job.algorithm, r.job.ibasis)].append(r.ss)
+        else:
+            failed += 1
+    if failed:
+        logging.warning('{} bootstrap replicates failed'.format(failed))
+    return summarise(samples)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CDPro input files and the table of supported CDPro programs.
+
+Everything CDGo needs to know about a CDPro algorithm (executable, output
+files, the fit file and its reader) lives in `ALGORITHMS`, so the job
+runner can treat every algorithm the same way. Algorithms marked `native`
+are solved in-process (see `selcon` and `lsq`) instead of by a program
+under wine; `stack` ones fit every spectrum of a batch on their common
+wavelengths in one solve.
+"""
+
+import re
+import more_itertools
+import numpy as np
+from readers import read_continll
+from readers import read_cdsstr
+from readers import read_selcon3
+
+# shell command run in a workspace holding the CDPro files and `input`
+COMMAND = 'echo | WINEDEBUG=-all wine {exe} > stdout || echo -n "(crashed)"'
+
+ALGORITHMS = {
+    'continll': {
+        'exe': 'Continll.exe',
+        'outputs': ['CONTIN.CD', 'CONTIN.OUT', 'CONTINLL.OUT', 'BASIS.PG',
+                    'ProtSS.out', 'SUMMARY.PG'],
+        'fit_file': 'CONTIN.CD',
+        'exp_col': 'ExpCD',
+        'reader': read_continll,
+    },
+    'cdsstr': {
+        'exe': 'CDSSTR.EXE',
+        'outputs': ['reconCD.out', 'ProtSS.out', 'CDsstr.out'],
+        'fit_file': 'reconCD.out',
+        'exp_col': 'Exptl',
+        'reader': read_cdsstr,
+    },
+    'selcon3': {
+        'exe': 'SELCON3.EXE',
+        'outputs': ['CalcCD.OUT', 'ProtSS.out', 'SELCON3.OUT'],
+        'fit_file': 'CalcCD.OUT',
+        'exp_col': 'ExpCD',
+        'reader': read_selcon3,
+    },
+    'selcon': {
+        'native': True,
+        'exe': None,
+        'outputs': ['CalcCD.out', 'ProtSS.out'],
+        'fit_file': 'CalcCD.out',
+        'exp_col': 'ExpCD',
+        'reader': read_selcon3,
+    },
+    'lsq': {
+        'native': True,
+        'stack': True,
+        'exe': None,
+        'outputs': ['CalcCD.out', 'ProtSS.out'],
+        'fit_file': 'CalcCD.out',
+        'exp_col': 'ExpCD',
+        'reader': read_selcon3,
+    },
+}
+
+# order in which algorithms are run and reported
+ALGORITHM_ORDER = ['continll', 'cdsstr', 'selcon3', 'selcon', 'lsq']
+
+
+def output_files():
+    """Names of every file a CDPro program may write
+
+    :returns: set of lower case file names
+
+    """
+    out = set(['input', 'stdout'])
+    for alg in ALGORITHMS.values():
+        out.update(f.lower() for f in alg['outputs'])
+    return out
+
+
+def read_input_text(text):
+    """Parse CDPro input file contents
+
+    :text: CDPro input file contents, as written by input_text
+    :returns: (ibasis, wavelengths long to short, CD values) with the
+              arrays as floats
+
+    """
+    lines = text.splitlines()
+    ibasis = None
+    first = None
+    values = []
+    in_data = False
+    for i, line in enumerate(lines):
+        if line.startswith('# PRINT'):
+            ibasis = int(lines[i + 1].split()[1])
+        elif line.startswith('#     WL_Begin'):
+            first = float(lines[i + 1].split()[0])
+        elif line.startswith('# CDDATA'):
+            in_data = True
+        elif line.startswith('#'):
+            in_data = False
+        elif in_data:
+            values.extend(float(x) for x in line.split())
+    wavelengths = first - np.arange(len(values), dtype=float)
+    return ibasis, wavelengths, np.array(values)
+
+
+def set_ibasis(text, ibasis):
+    """Set the ibasis of CDPro input text
+
+    :text: CDPro input file contents
+    :ibasis: ibasis integer
+    :returns: str
+
+    """
+    pattern = '# PRINT(.*\n)\s+(\S+)(.*)'
+    replace = '# PRINT    IBasis\n      0         {}'.format(ibasis)
+    return re.sub(pattern, replace, text)
+
+
+def replace_input(input, output, ibasis):
+    """
+    return: None
+    """
+    f = open(input, 'r')
+    lines = f.read()
+    f.close()
+    r = set_ibasis(lines, ibasis)
+
+    with open(output, 'w') as o:
+        for line in r:
+            o.write(line)
+
+
+def cdpro_input_header(firstvalue, lastvalue, factor):
+    """
+    :returns: Multiline string mimicking cdpro output
+
+    """
+
+    firstvalue = '{:0.4f}'.format(firstvalue)
+    lastvalue = '{:0.4f}'.format(lastvalue)
+    header = ("#                                                  \n"
+              "# PRINT    IBasis                                  \n"
+              "      1         0\n"
+              "#                                                  \n"
+              "#  ONE Title Line                                  \n"
+              " Title\n"
+              "#                                                  \n"
+              "#     WL_Begin     WL_End       Factor             \n"
+              "      {first}      {last}      1.0000\n"
+              "#                                                  \n"
+              "# CDDATA (Long->Short Wavelength; 260 - 178 LIMITS \n"
+              ).format(first=lastvalue, last=firstvalue)
+    return header
+
+
+def cdpro_input_footer():
+    """
+    :returns: Multiline string mimicking cdpro input footer
+
+    """
+
+    footer = ("#                                                  \n"
+              "#  IGuess  Str1   Str2   Str3   Str4   Str5    Str6\n"
+              "        0                                          \n"
+              )
+    return footer
+
+
+def input_text(values, head, ibasis=None):
+    """CDPro input file contents
+
+    :values: CD values, long to short wavelength
+    :head: CDPro input header from cdpro_input_header
+    :ibasis: ibasis integer; None leaves the header default
+    :returns: str
+
+    """
+    lines = [head]
+    for line in more_itertools.chunked(values, 10):
+        # Separate list items by two spaces and append newline
+        lines.append('  ' + '  '.join(str(x) for x in line) + '\n')
+    lines.append(cdpro_input_footer())
+    text = ''.join(lines)
+    if ibasis is not None:
+        text = set_ibasis(text, ibasis)
+    return text
+
+
+def cdpro_input_writer(body, head, fname='input'):
+    """TODO: Docstring for cdpro_input_writer.
+
+    :body: CDPro input body text. Contains n rows of length 10, where the final
+           line may be up to 10 items
+    :head: CDPro input header information
+    :returns: None
+
+    """
+
+    f = open(fname, 'w')
+    f.write(head)
+    for line in body:
+        # Separate list items by two spaces and append newline
+        f.write('  ' + '  '.join(str(x) for x in line) + '\n')
+    f.write(cdpro_input_footer())
+    f.close()
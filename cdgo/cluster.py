@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Similarity clustering of many spectra.
+
+Spectra resampled onto the 1 nm grid are stacked into one matrix on the
+wavelengths they share. Pairwise distances (RMSD or one minus the Pearson
+correlation) are computed with matrix products, a block of rows at a time
+so the temporary arrays stay small, and the spectra are grouped by
+agglomerative hierarchical clustering. Each cluster is represented by its
+medoid, the member closest on average to the others, so a representative
+can be fitted first; members far from their medoid are flagged as
+outliers.
+"""
+
+import numpy as np
+import pandas as pd
+
+METRICS = ['correlation', 'rmsd']
+LINKAGES = ['average', 'complete', 'single']
+
+# rows of the distance matrix computed per block
+CHUNK = 256
+
+
+def stack(spectra):
+    """Stack spectra on their common wavelengths
+
+    :spectra: list of series indexed by wavelength
+    :returns: (wavelengths long to short, (n, m) array)
+    :raises: ValueError if the spectra share fewer than two wavelengths
+
+    """
+    common = None
+    for s in spectra:
+        wl = np.round(np.asarray(s.index, dtype=float), 2)
+        common = wl if common is None else np.intersect1d(common, wl)
+    common = np.sort(common)[::-1]
+    if common.size < 2:
+        raise ValueError('spectra share fewer than two wavelengths')
+    X = np.empty((len(spectra), common.size))
+    for i, s in enumerate(spectra):
+        s = pd.Series(np.asarray(s, dtype=float),
+                      index=np.round(np.asarray(s.index, dtype=float), 2))
+        X[i] = s.reindex(common).values
+    return common, X
+
+
+def distances(X, metric='correlation', chunk=CHUNK):
+    """Pairwise distances between the rows of X
+
+    :X: (n, m) array of spectra
+    :metric: 'rmsd' or 'correlation' (1 - Pearson r)
+    :chunk: rows computed per block
+    :returns: (n, n) symmetric array with a zero diagonal
+
+    """
+    X = np.asarray(X, dtype=float)
+    n, m = X.shape
+    if metric == 'correlation':
+        X = X - X.mean(axis=1)[:, None]
+        norm = np.sqrt((X * X).sum(axis=1))
+        norm[norm == 0] = 1.
+        X = X / norm[:, None]
+    elif metric != 'rmsd':
+        raise ValueError('unknown metric {}'.format(metric))
+    sq = (X * X).sum(axis=1)
+    D = np.empty((n, n))
+    for start in range(0, n, chunk):
+        block = X[start:start + chunk]
+        prod = block.dot(X.T)
+        if metric == 'correlation':
+            D[start:start + chunk] = 1. - prod
+        else:
+            d2 = sq[start:start + chunk, None] + sq[None, :] - 2. * prod
+            D[start:start + chunk] = np.sqrt(np.maximum(d2, 0.) / m)
+    np.fill_diagonal(D, 0.)
+    return np.maximum(D, 0.)
+
+
+def linkage(D, method='average'):
+    """Agglomerative hierarchical clustering of a distance matrix
+
+    Clusters are merged closest first, distances to a merged cluster being
+    updated with the Lance-Williams formula of the linkage method.
+
+    :D: (n, n) distance matrix
+    :method: 'average', 'complete' or 'single'
+    :returns: (n - 1, 4) array of merges in the layout of
+              scipy.cluster.hierarchy.linkage: the two merged cluster ids,
+              their distance and the size of the new cluster
+
+    """
+    if method not in LINKAGES:
+        raise ValueError('unknown linkage {}'.format(method))
+    n = D.shape[0]
+    d = np.array(D, dtype=float)
+    np.fill_diagonal(d, np.inf)
+    size = np.ones(n)
+    ids = np.arange(n)
+    Z = np.empty((max(n - 1, 0), 4))
+    for step in range(n - 1):
+        i, j = np.unravel_index(np.argmin(d), d.shape)
+        if i > j:
+            i, j = j, i
+        Z[step] = [min(ids[i], ids[j]), max(ids[i], ids[j]), d[i, j],
+                   size[i] + size[j]]
+        if method == 'average':
+            new = (size[i] * d[i] + size[j] * d[j]) / (size[i] + size[j])
+        elif method == 'complete':
+            new = np.maximum(d[i], d[j])
+        else:
+            new = np.minimum(d[i], d[j])
+        # cluster i becomes the merged cluster; j is retired
+        d[i], d[:, i] = new, new
+        d[i, i] = np.inf
+        d[j], d[:, j] = np.inf, np.inf
+        size[i] += size[j]
+        ids[i] = n + step
+    return Z
+
+
+def assign(Z, n, clusters=None, threshold=None):
+    """Cut a linkage into flat clusters
+
+    :Z: linkage from `linkage`
+    :n: number of observations
+    :clusters: number of clusters wanted, or
+    :threshold: largest merge distance within a cluster
+    :returns: (n,) array of cluster numbers from 1, numbered by first member
+
+    """
+    parent = np.arange(2 * n - 1)
+
+    def root(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    for step, (a, b, dist, _) in enumerate(Z):
+        if clusters is not None and step >= n - clusters:
+            break
+        if clusters is None and dist > threshold:
+            break
+        parent[root(int(a))] = n + step
+        parent[root(int(b))] = n + step
+    roots = [root(k) for k in range(n)]
+    numbers = {}
+    for r in roots:
+        numbers.setdefault(r, len(numbers) + 1)
+    return np.array([numbers[r] for r in roots])
+
+
+def medoids(D, labels):
+    """Medoid of each cluster
+
+    :D: (n, n) distance matrix
+    :labels: cluster numbers from `assign`
+    :returns: dict of cluster number: index of its medoid
+
+    """
+    out = {}
+    for c in np.unique(labels):
+        members = np.nonzero(labels == c)[0]
+        within = D[np.ix_(members, members)].sum(axis=1)
+        out[int(c)] = int(members[np.argmin(within)])
+    return out
+
+
+def outliers(D, labels, centres, cutoff=3.0):
+    """Members unusually far from their cluster's medoid
+
+    In clusters of three or more spectra, a member is an outlier when its
+    distance to the medoid exceeds cutoff times the median distance of the
+    other members. When there is more than one cluster, a spectrum in a
+    cluster of its own is an outlier too.
+
+    :D: (n, n) distance matrix
+    :labels: cluster numbers
+    :centres: dict from `medoids`
+    :cutoff: multiple of the median member-medoid distance
+    :returns: (distance to medoid, boolean outlier flag) arrays
+
+    """
+    to_centre = np.array([D[i, centres[c]] for i, c in enumerate(labels)])
+    flagged = np.zeros(len(labels), dtype=bool)
+    for c, centre in centres.items():
+        members = np.nonzero(labels == c)[0]
+        if len(members) == 1:
+            flagged[members] = len(centres) > 1
+            continue
+        others = members[members != centre]
+        if len(others) >= 2:
+            typical = np.median(to_centre[others])
+            flagged[others] = to_centre[others] > cutoff * typical
+    return to_centre, flagged
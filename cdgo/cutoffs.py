@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scan of the low-wavelength limit of the fitted spectrum.
+
+The usable lower limit of a spectrum (e.g. 178, 185 or 190 nm) changes the
+fitted fractions considerably. For each candidate cutoff the epsilon
+spectrum is truncated, a CDPro input is generated and every ibasis and
+algorithm is fitted; all cutoffs are submitted to the runner as one batch
+so they share its workers and result cache. The report shows how the
+fractions and RMSD move with the cutoff.
+"""
+
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+from cdpro import cdpro_input_header
+from cdpro import input_text
+from jobs import FitJob
+from readers import FRACTIONS
+from readers import parse_percent
+
+COLUMNS = ['cutoff', 'ibasis', 'refset', 'alg', 'ahelix', 'bstrand', 'turn',
+           'unord', 'rmsd', 'ss_res', 'r2']
+
+
+def parse_cutoffs(string):
+    """argparse type for a comma separated list of wavelengths
+
+    :string: e.g. '178,185,190'
+    :returns: sorted list of floats
+
+    """
+    try:
+        values = sorted(set(float(x) for x in string.split(',') if x))
+    except ValueError:
+        values = []
+    if not values:
+        raise argparse.ArgumentTypeError(
+            "'" + string + "' is not a list of wavelengths. Expected forms "
+            "like '178,185,190'.")
+    return values
+
+
+def truncate(epsilon, cutoff):
+    """Drop points below a lower wavelength limit
+
+    :epsilon: epsilon series indexed by wavelength
+    :cutoff: lowest wavelength kept (nm)
+    :returns: series
+
+    """
+    return epsilon[np.asarray(epsilon.index, dtype=float) >= cutoff]
+
+
+def jobs(epsilon, cutoffs, algorithms, ibases, min_points=10):
+    """FitJobs for every cutoff, ibasis and algorithm
+
+    :epsilon: epsilon series indexed by wavelength, long to short
+    :cutoffs: list of lower wavelength limits
+    :algorithms: list of algorithm names
+    :ibases: list of ibasis integers
+    :min_points: cutoffs leaving fewer points than this are skipped
+    :returns: list of FitJob tagged with their cutoff
+
+    """
+    out = []
+    for cutoff in cutoffs:
+        eps = truncate(epsilon, cutoff)
+        if len(eps) < min_points:
+            logging.warning('Skipping cutoff {c} nm: only {n} points '
+                            'remain'.format(c=cutoff, n=len(eps)))
+            continue
+        wl = np.asarray(eps.index, dtype=float)
+        head = cdpro_input_header(wl.min(), wl.max(), 1)
+        for ibasis in ibases:
+            for alg in algorithms:
+                out.append(FitJob(alg, ibasis, input_text(eps, head, ibasis),
+                                  tag=cutoff))
+    return out
+
+
+def spread(df):
+    """Change of each fraction and of the RMSD across cutoffs
+
+    :df: dataframe as returned by run
+    :returns: dataframe indexed by (alg, ibasis) with the max - min of each
+              fraction (percentage points) and of the rmsd
+
+    """
+    d = df.copy()
+    for frac in FRACTIONS:
+        d[frac] = d[frac].map(parse_percent)
+    cols = FRACTIONS + ['rmsd']
+    g = d.groupby(['alg', 'ibasis'])[cols]
+    out = (g.max() - g.min()).round(3)
+    out['best_cutoff'] = d.loc[d.groupby(['alg', 'ibasis'])['rmsd'].idxmin(),
+                               ['alg', 'ibasis', 'cutoff']].set_index(
+                                   ['alg', 'ibasis'])['cutoff']
+    return out
+
+
+def run(runner, epsilon, cutoffs, algorithms, ibases):
+    """Fit every cutoff, ibasis and algorithm
+
+    :runner: jobs.Runner
+    :epsilon: epsilon series indexed by wavelength, long to short
+    :cutoffs: list of lower wavelength limits
+    :algorithms: list of algorithm names
+    :ibases: list of ibasis integers
+    :returns: dataframe with COLUMNS, sorted by cutoff, ibasis and algorithm
+
+    """
+    batch = jobs(epsilon, cutoffs, algorithms, ibases)
+    logging.info('Scanning {c} cutoffs: {n} fits'.format(c=len(cutoffs),
+                                                         n=len(batch)))
+    rows = []
+    for r in runner.run(batch):
+        if r.ok:
+            rows.append([r.job.tag, r.job.ibasis] + r.row())
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df['order'] = df['alg'].map(algorithms.index)
+    df = df.sort_values(['cutoff', 'ibasis', 'order']).drop('order', axis=1)
+    return df.reset_index(drop=True)
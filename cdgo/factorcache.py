@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache of reference matrix factorisations.
+
+The native solvers restrict the reference spectra of an ibasis to the
+wavelength window of the input (high, low and step, as written by
+`cdpro_input_header`) and derive the class spectra from them; `lsq` also
+inverts the Gram matrix of every set of classes. That work only depends on
+the basis and the window, so a `FactorCache` keeps it, keyed by
+
+    (solver, refset, basis checksum, high, low, step, points)
+
+Cached values never depend on the order of the input wavelengths; solvers
+map them onto the input grid on every call.
+
+Entries are held in memory and the least recently used are evicted once
+`max_bytes` is exceeded. Given a cache directory they are also pickled to
+disk, so later runs (or several processes of a batch) start warm:
+
+    <cache>/v<VERSION>/<sha1 of key>.pkl
+
+Hit, miss and memory statistics are kept by `stats` and exported as
+metrics.
+"""
+
+import os
+import logging
+import hashlib
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+# layout version of disk entries; bump when a solver changes what it stores
+VERSION = 2
+
+# memory held by factorisations before the least recently used are dropped
+MAX_BYTES = 256 * 2 ** 20
+
+
+def window(wavelengths):
+    """Wavelength window of a grid
+
+    :wavelengths: wavelengths (nm)
+    :returns: (high, low, step, points); step is None for an irregular grid
+
+    """
+    wl = np.round(np.asarray(wavelengths, dtype=float), 2)
+    steps = np.unique(np.round(np.abs(np.diff(wl)), 2))
+    step = float(steps[0]) if steps.size == 1 else None
+    return float(wl.max()), float(wl.min()), step, int(wl.size)
+
+
+def make_key(solver, basis, wavelengths):
+    """Cache key of a factorisation
+
+    :solver: solver name
+    :basis: basis.Basis
+    :wavelengths: wavelengths the basis is restricted to, in any order
+    :returns: tuple
+
+    """
+    high, low, step, points = window(wavelengths)
+    if step is None:
+        # irregular grids are told apart by their wavelengths
+        step = hashlib.sha1(np.sort(np.round(np.asarray(
+            wavelengths, dtype=float), 2)).tobytes()).hexdigest()[:16]
+    return (solver, str(basis.refset), str(basis.checksum), high, low, step,
+            points)
+
+
+def nbytes(value):
+    """Memory held by the arrays of a value
+
+    :value: array, or list, tuple or dict of values
+    :returns: int
+
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        value = value.values()
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+    return 0
+
+
+def lookup(cache, key, compute):
+    """Factorisation from a cache, computing it on a miss
+
+    :cache: FactorCache, or None to always compute
+    :key: key from make_key
+    :compute: function of no arguments returning the factorisation
+    :returns: factorisation
+
+    """
+    if cache is None:
+        return compute()
+    return cache.get(key, compute)
+
+
+class FactorCache(object):
+    """Factorisations in memory with LRU eviction, optionally on disk"""
+
+    def __init__(self, max_bytes=MAX_BYTES, cache_dir=None):
+        """
+        :max_bytes: memory held before least recently used entries are
+                    evicted
+        :cache_dir: directory to persist entries in, or None; created if
+                    missing
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = None
+        if cache_dir is not None:
+            self.cache_dir = os.path.join(cache_dir, 'v{}'.format(VERSION))
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.counts = dict(hit=0, disk=0, miss=0, evicted=0)
+
+    def path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.pkl')
+
+    def get(self, key, compute):
+        """Factorisation of a key, computing and storing it on a miss
+
+        :key: key from make_key
+        :compute: function of no arguments returning the factorisation
+        :returns: factorisation
+
+        """
+        with self._lock:
+            if key in self._entries:
+                value = self._entries.pop(key)
+                self._entries[key] = value
+                self._count('hit')
+                return value
+        value = self._read(key)
+        if value is not None:
+            self._count('disk')
+        else:
+            value = compute()
+            self._count('miss')
+            self._write(key, value)
+        with self._lock:
+            self._store(key, value)
+        return value
+
+    def _count(self, result):
+        self.counts[result] += 1
+        metrics.FACTOR_CACHE.inc(result=result)
+
+    def _store(self, key, value):
+        if key in self._entries:
+            self.bytes -= nbytes(self._entries.pop(key))
+        self._entries[key] = value
+        self.bytes += nbytes(value)
+        # the newest entry is kept even if it alone exceeds the limit
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, dropped = self._entries.popitem(last=False)
+            self.bytes -= nbytes(dropped)
+            self._count('evicted')
+        metrics.FACTOR_CACHE_BYTES.set(self.bytes)
+
+    def _read(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                stored_key, value = pickle.load(f)
+        except Exception:
+            # missing, partial or foreign files are recomputed
+            return None
+        return value if stored_key == key else None
+
+    def _write(self, key, value):
+        if self.cache_dir is None:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+            # atomic, so concurrent runs never read a partial entry
+            os.rename(tmp, self.path(key))
+        except (IOError, OSError) as e:
+            logging.warning('Could not store factorisation: {}'.format(e))
+
+    def clear(self):
+        """Drop every entry held in memory
+
+        :returns: None
+
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+        metrics.FACTOR_CACHE_BYTES.set(0)
+
+    def stats(self):
+        """Use of the cache so far
+
+        :returns: dict of entries, bytes, hits (in memory), disk_hits,
+                  misses, evictions and hit_rate (memory and disk hits over
+                  lookups)
+
+        """
+        lookups = sum(self.counts[k] for k in ('hit', 'disk', 'miss'))
+        hits = self.counts['hit'] + self.counts['disk']
+        return {'entries': len(self._entries), 'bytes': self.bytes,
+                'hits': self.counts['hit'], 'disk_hits': self.counts['disk'],
+                'misses': self.counts['miss'],
+                'evictions': self.counts['evicted'],
+                'hit_rate': round(hits / float(lookups), 4) if lookups
+                else None}
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Host-wide priority queue with fair sharing for CDPro processes.
+
+CDGo runs started by different users on one machine share a spool
+directory. Before a wine process starts, its fit takes a ticket carrying a
+priority class and an owner:
+
+    <queue>/waiting/<ticket>.json   fits waiting for a slot
+    <queue>/running/<ticket>.json   fits holding one of the slots
+    <queue>/waits.csv               time, owner, class and wait of each grant
+
+Whenever a slot is free, the waiting fit chosen by `pick` is moved to
+running. Fits that have waited longer than the starvation limit go first,
+oldest first. Otherwise the highest class waiting wins (interactive before
+normal before bulk) and, within it, the owner with fewest fits running,
+then the oldest ticket. A single urgent sample therefore starts at the
+next free slot even behind another user's 500-spectrum batch, and bulk
+work still progresses under a steady stream of interactive fits. All
+decisions are taken under an exclusive lock on the spool, and tickets of
+processes that died on this host are removed.
+"""
+
+import os
+import csv
+import json
+import time
+import errno
+import fcntl
+import socket
+import getpass
+import logging
+import itertools
+import threading
+import multiprocessing
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import metrics
+import profiling
+
+CLASSES = ['interactive', 'normal', 'bulk']
+
+# seconds a fit may wait before it is served ahead of every class
+MAX_WAIT = 300.
+# seconds between attempts to take a slot
+POLL = 0.2
+
+WAIT_COLUMNS = ['time', 'owner', 'priority', 'wait']
+
+
+def pick(waiting, running, now, max_wait=MAX_WAIT):
+    """Ticket to be granted the next free slot
+
+    :waiting: list of waiting ticket dicts
+    :running: list of running ticket dicts
+    :now: current time
+    :max_wait: starvation limit (seconds)
+    :returns: ticket dict, or None if nothing is waiting
+
+    """
+    if not waiting:
+        return None
+    starved = [t for t in waiting if now - t['enqueued'] > max_wait]
+    if starved:
+        return min(starved, key=lambda t: (t['enqueued'], t['id']))
+    top = min(CLASSES.index(t['priority']) for t in waiting)
+    share = Counter(t['owner'] for t in running)
+    return min((t for t in waiting if CLASSES.index(t['priority']) == top),
+               key=lambda t: (share[t['owner']], t['enqueued'], t['id']))
+
+
+def _alive(ticket):
+    if ticket.get('host') != socket.gethostname():
+        return True
+    try:
+        os.kill(ticket['pid'], 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+class SharedQueue(object):
+    """Slots for CDPro processes shared by every run using one spool"""
+
+    _ids = itertools.count()
+
+    def __init__(self, directory, slots=None, owner=None, priority='normal',
+                 max_wait=MAX_WAIT, poll=POLL):
+        """
+        :directory: spool directory, created if needed
+        :slots: CDPro processes run at once across all runs; default one
+                per CPU
+        :owner: default owner of fits; default the login name
+        :priority: default class of fits, one of CLASSES
+        :max_wait: starvation limit (seconds)
+        :poll: seconds between attempts to take a slot
+        """
+        if priority not in CLASSES:
+            raise ValueError('Unknown priority class {}'.format(priority))
+        self.directory = os.path.abspath(directory)
+        self.slots = slots or multiprocessing.cpu_count()
+        self.owner = owner or getpass.getuser()
+        self.priority = priority
+        self.max_wait = max_wait
+        self.poll = poll
+        for sub in ('waiting', 'running'):
+            path = os.path.join(self.directory, sub)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    if not os.path.isdir(path):
+                        raise
+        self._lockfile = os.path.join(self.directory, 'lock')
+        self._local = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        # threads of a run queue on a local lock rather than each
+        # contending for the spool's
+        with self._local:
+            with open(self._lockfile, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _path(self, state, ticket):
+        return os.path.join(self.directory, state,
+                            '{}.json'.format(ticket['id']))
+
+    def tickets(self, state):
+        """Tickets in a state, removing those of dead processes
+
+        :state: 'waiting' or 'running'
+        :returns: list of ticket dicts
+
+        """
+        out = []
+        path = os.path.join(self.directory, state)
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(path, name)) as f:
+                    ticket = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            if _alive(ticket):
+                out.append(ticket)
+            else:
+                logging.debug('Removing stale ticket {}'.format(name))
+                _remove(os.path.join(path, name))
+        return out
+
+    def ticket(self, job=None):
+        """New ticket for a job
+
+        :job: jobs.FitJob; its owner and priority, when set, override the
+              queue's defaults
+        :returns: dict
+
+        """
+        owner = getattr(job, 'owner', None) or self.owner
+        priority = getattr(job, 'priority', None) or self.priority
+        if priority not in CLASSES:
+            raise ValueError('Unknown priority class {}'.format(priority))
+        now = time.time()
+        return {'id': '{t:.6f}-{h}-{p}-{n}'.format(
+                    t=now, h=socket.gethostname(), p=os.getpid(),
+                    n=next(self._ids)),
+                'owner': owner, 'priority': priority, 'enqueued': now,
+                'host': socket.gethostname(), 'pid': os.getpid()}
+
+    def _try(self, ticket):
+        with self._locked():
+            running = self.tickets('running')
+            if len(running) >= self.slots:
+                return None
+            now = time.time()
+            if pick(self.tickets('waiting'), running, now,
+                    self.max_wait)['id'] != ticket['id']:
+                return None
+            os.rename(self._path('waiting', ticket),
+                      self._path('running', ticket))
+            wait = now - ticket['enqueued']
+            log = os.path.join(self.directory, 'waits.csv')
+            new = not os.path.exists(log)
+            with open(log, 'a') as f:
+                w = csv.writer(f)
+                if new:
+                    w.writerow(WAIT_COLUMNS)
+                w.writerow(['{:.3f}'.format(now), ticket['owner'],
+                            ticket['priority'], '{:.3f}'.format(wait)])
+            return wait
+
+    @contextmanager
+    def slot(self, job=None):
+        """Wait for a slot for a job
+
+        :job: jobs.FitJob, or None for a fit of the default owner and class
+        :returns: context manager yielding the seconds spent waiting
+
+        """
+        ticket = self.ticket(job)
+        with open(self._path('waiting', ticket) + '.tmp', 'w') as f:
+            json.dump(ticket, f)
+        os.rename(self._path('waiting', ticket) + '.tmp',
+                  self._path('waiting', ticket))
+        try:
+            with profiling.stage('queue_wait', owner=ticket['owner'],
+                                 priority=ticket['priority']) as rec:
+                wait = self._try(ticket)
+                while wait is None:
+                    time.sleep(self.poll)
+                    wait = self._try(ticket)
+                rec['wait'] = wait
+            metrics.QUEUE_WAIT.observe(wait, priority=ticket['priority'])
+            yield wait
+        finally:
+            _remove(self._path('waiting', ticket))
+            _remove(self._path('running', ticket))
+
+    def waits(self):
+        """Recorded grants
+
+        :returns: dataframe with WAIT_COLUMNS
+
+        """
+        log = os.path.join(self.directory, 'waits.csv')
+        if not os.path.exists(log):
+            return pd.DataFrame(columns=WAIT_COLUMNS)
+        return pd.read_csv(log)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def latency(waits):
+    """Queue wait latency of each class
+
+    :waits: dataframe with WAIT_COLUMNS, e.g. from SharedQueue.waits
+    :returns: dataframe indexed by class with the number of grants and the
+              mean, median, 95th percentile and largest wait (seconds)
+
+    """
+    rows = []
+    for c in CLASSES:
+        w = waits.loc[waits['priority'] == c, 'wait'].values.astype(float)
+        if not len(w):
+            continue
+        rows.append([c, len(w), w.mean(), np.percentile(w, 50),
+                     np.percentile(w, 95), w.max()])
+    out = pd.DataFrame(rows, columns=['priority', 'fits', 'mean_s', 'p50_s',
+                                      'p95_s', 'max_s'])
+    return out.set_index('priority').round(3)
+
+
+def status(queue):
+    """Fits waiting and running per class and owner
+
+    :queue: SharedQueue
+    :returns: dataframe indexed by (priority, owner) with columns waiting
+              and running
+
+    """
+    rows = []
+    for state in ('waiting', 'running'):
+        for t in queue.tickets(state):
+            rows.append([t['priority'], t['owner'], state])
+    df = pd.DataFrame(rows, columns=['priority', 'owner', 'state'])
+    if df.empty:
+        return pd.DataFrame(columns=['waiting', 'running'])
+    out = pd.crosstab([df['priority'], df['owner']], df['state'])
+    for state in ('waiting', 'running'):
+        if state not in out.columns:
+            out[state] = 0
+    return out[['waiting', 'running']]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parallel import of spectrum files from any supported instrument.
+
+Files are parsed in a process pool. Each worker detects the format of one
+file, reads its scans with the registered reader and averages them
+(blank scans are averaged once, in the parent). The averaged spectra are
+returned in input order together with a manifest row per file, ready for
+blank subtraction, conversion to delta epsilon and CDPro input writing.
+A file that cannot be read is recorded in the manifest and skipped rather
+than stopping the import.
+"""
+
+import os
+import logging
+import multiprocessing
+
+import preprocess
+import vendors
+
+MANIFEST_COLUMNS = ['file', 'sample', 'format', 'scans', 'points',
+                    'low_wl', 'high_wl', 'status', 'error']
+
+
+def load(task):
+    """Read and average the scans of one file
+
+    :task: (file name, format name or None to detect it)
+    :returns: (file name, format, averaged dataframe from
+              preprocess.average, or None, error message or None)
+
+    """
+    fname, fmt = task
+    try:
+        fmt, scans = vendors.read(fname, fmt)
+        return fname, fmt, preprocess.average([s.data for s in scans]), None
+    except Exception as e:
+        return fname, fmt, None, str(e)
+
+
+def load_all(fnames, fmt=None, processes=None):
+    """Read and average many files, in parallel when worthwhile
+
+    :fnames: list of file names
+    :fmt: format name of all files; None detects each
+    :processes: worker processes; None for one per CPU (capped at the
+                number of files), 1 to read serially
+    :returns: list of results from load, in the order of fnames
+
+    """
+    tasks = [(f, fmt) for f in fnames]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(tasks))
+    if processes <= 1:
+        return [load(t) for t in tasks]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(load, tasks, chunksize=max(1, len(tasks) //
+                                                   (4 * processes)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def sample_names(fnames):
+    """Unique output name for each file
+
+    :fnames: list of file names
+    :returns: list of str; the base name, with a numeric suffix where two
+              files share one
+
+    """
+    seen = {}
+    out = []
+    for f in fnames:
+        base = os.path.splitext(os.path.basename(f))[0]
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        out.append(base if n == 0 else '{b}-{n}'.format(b=base, n=n + 1))
+    return out
+
+
+def manifest_row(fname, sample, fmt, averaged, error):
+    """Manifest entry of an imported file
+
+    :fname: file name
+    :sample: output name
+    :fmt: format name, or None
+    :averaged: averaged dataframe, or None
+    :error: error message, or None
+    :returns: list in the order of MANIFEST_COLUMNS
+
+    """
+    if averaged is None or not len(averaged):
+        logging.warning('Skipping {f}: {e}'.format(
+            f=fname, e=error or 'no data'))
+        return [fname, sample, fmt, 0, 0, None, None, 'failed',
+                error or 'no data']
+    wl = averaged.index.values
+    return [fname, sample, fmt, int(averaged['n'].iloc[0]), len(averaged),
+            float(wl.min()), float(wl.max()), 'ok', None]
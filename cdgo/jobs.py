@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched, parallel and cached execution of CDPro fits.
+
+A `FitJob` is one CDPro program run against one input file and ibasis.
+Every job runs in its own temporary workspace: the CDPro directory is
+linked in, the job's `input` is written alongside, and whatever the program
+writes is collected as the job's output. Jobs therefore do not interfere
+with each other and a `Runner` can execute several at once. An optional
+`ResultCache` keeps the raw output of completed fits, keyed by the input
+text, algorithm, ibasis and CDPro executable, so identical fits are only
+ever run once.
+
+Jobs of native algorithms never reach wine: the runner collects them per
+ibasis and solves each batch in-process against the compiled reference
+set, with results in the same form as those parsed from CDPro output.
+Batches of `stack` algorithms are fitted on the wavelengths all their
+spectra share, so a whole series is one solve. Factorisations of the
+reference matrices are kept in a `factorcache.FactorCache` and reused by
+every later batch on the same basis and wavelength window.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+try:
+    from Queue import Queue
+except ImportError:  # python 3
+    from queue import Queue
+
+import numpy as np
+import pandas as pd
+
+import metrics
+import lsq
+import factorcache
+import profiling
+import selcon
+from basis import BasisStore
+from basis import DEFAULT_STORE
+from cdpro import ALGORITHMS
+from cdpro import COMMAND
+from cdpro import output_files
+from cdpro import read_input_text
+from readers import read_protss
+from mathops import sum_squares_residuals
+from mathops import r_squared
+from mathops import rms_error
+
+
+def find_file(directory, fname):
+    """Path of fname in directory, matched case-insensitively
+
+    CDPro output names differ in case between versions (e.g. CONTINLL.OUT
+    and continll.out).
+
+    :directory: directory to search
+    :fname: file name
+    :returns: path, or None if there is no such file
+
+    """
+    for f in os.listdir(directory):
+        if f.lower() == fname.lower():
+            return os.path.join(directory, f)
+    return None
+
+
+class FitJob(object):
+    """A single CDPro fit"""
+
+    def __init__(self, algorithm, ibasis, text, out_dir=None, tag=None,
+                 priority=None, owner=None):
+        """
+        :algorithm: key of cdpro.ALGORITHMS
+        :ibasis: ibasis integer; must match the ibasis set in text
+        :text: CDPro input file contents
+        :out_dir: directory to keep the raw CDPro output in; None discards it
+                  once parsed
+        :tag: caller defined label, e.g. a bootstrap replicate number
+        :priority: class in a shared queue (see fairqueue.CLASSES); None
+                   uses the queue's default
+        :owner: owner in a shared queue; None uses the queue's default
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unknown CDPro algorithm {}'.format(algorithm))
+        self.algorithm = algorithm
+        self.ibasis = ibasis
+        self.text = text
+        self.out_dir = out_dir
+        self.tag = tag
+        self.priority = priority
+        self.owner = owner
+
+    def __repr__(self):
+        return 'FitJob({a}, ibasis={i}, tag={t})'.format(
+            a=self.algorithm, i=self.ibasis, t=self.tag)
+
+
+class FitResult(object):
+    """Parsed outcome of a FitJob"""
+
+    def __init__(self, job, status, cached=False, duration=0.0, error=None):
+        """
+        :job: FitJob
+        :status: 'ok', 'crashed' (wine reported a crash) or 'failed'
+                 (output missing or unreadable)
+        :cached: True if the output came from the ResultCache
+        :duration: seconds spent running CDPro
+        :error: description of the failure, if any
+        """
+        self.job = job
+        self.status = status
+        self.cached = cached
+        self.duration = duration
+        self.error = error
+        self.refset = None
+        self.ss = None
+        self.curve = None
+        self.rmsd = None
+        self.ss_res = None
+        self.r2 = None
+
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+    def row(self):
+        """Summary row in the order of summary.SUMMARY_COLUMNS
+
+        :returns: list
+
+        """
+        # round floats to 3 decimal places for certain columns
+        return [self.refset, self.job.algorithm, self.ss['ahelix'],
+                self.ss['bstrand'], self.ss['turn'], self.ss['unord'],
+                round(self.rmsd, 3), round(self.ss_res, 3),
+                round(self.r2, 3)]
+
+
+def parse_fit(result, directory):
+    """Read CDPro output for a fit into result
+
+    :result: FitResult to fill in
+    :directory: directory holding ProtSS.out and the fit file
+    :returns: result
+
+    """
+    alg = ALGORITHMS[result.job.algorithm]
+    result.refset, ibasis, result.ss = read_protss(
+        find_file(directory, 'ProtSS.out'))
+    return fill_fit(result, alg['reader'](find_file(directory,
+                                                    alg['fit_file'])))
+
+
+def fill_fit(result, curve):
+    """Set the fit statistics of a result from its fit curve
+
+    :result: FitResult
+    :curve: fit dataframe holding the algorithm's experimental column and
+            CalcCD
+    :returns: result
+
+    """
+    exp = curve[ALGORITHMS[result.job.algorithm]['exp_col']]
+    result.curve = curve
+    result.ss_res = sum_squares_residuals(curve['CalcCD'], exp)
+    result.r2 = r_squared(curve['CalcCD'], exp)
+    result.rmsd = rms_error(curve['CalcCD'], exp)
+    return result
+
+
+def fingerprint(cdpro_dir, exe):
+    """Identify a CDPro executable by name, size and modification time
+
+    :cdpro_dir: CDPro directory
+    :exe: executable name
+    :returns: str
+
+    """
+    path = find_file(cdpro_dir, exe)
+    if path is None:
+        return exe
+    st = os.stat(path)
+    return '{}:{}:{}'.format(exe, st.st_size, int(st.st_mtime))
+
+
+class ResultCache(object):
+    """On-disk cache of raw CDPro output, one directory per fit"""
+
+    def __init__(self, cache_dir):
+        """
+        :cache_dir: cache directory; created if missing
+        """
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, job, cdpro_dir):
+        """Cache key of a job
+
+        :job: FitJob
+        :cdpro_dir: CDPro directory the job runs against
+        :returns: hex digest
+
+        """
+        h = hashlib.sha1()
+        for part in (job.algorithm, str(job.ibasis),
+                     fingerprint(cdpro_dir, ALGORITHMS[job.algorithm]['exe']),
+                     job.text):
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Directory of cached output, or None on a miss
+
+        :key: cache key
+        :returns: str or None
+
+        """
+        path = self.path(key)
+        hit = os.path.isdir(path)
+        metrics.CACHE.inc(result='hit' if hit else 'miss')
+        return path if hit else None
+
+    def put(self, key, files):
+        """Store the output of a fit
+
+        :key: cache key
+        :files: list of output file paths
+        :returns: None
+
+        """
+        path = self.path(key)
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+        for f in files:
+            shutil.copy(f, tmp)
+        try:
+            # atomic, so concurrent runs never see a partial entry
+            os.rename(tmp, path)
+        except OSError:
+            # another run stored the same fit first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+# native jobs of one ibasis solved in a single batch
+NATIVE_BATCH = 256
+
+# in-process solvers of the native algorithms
+SOLVERS = {'selcon': selcon.fit, 'lsq': lsq.fit}
+
+
+def _common_wavelengths(groups):
+    """Merge groups of spectra onto the wavelengths they all share
+
+    :groups: dict of wavelength tuple to list of (job index, values)
+    :returns: dict with a single entry
+
+    """
+    common = set.intersection(*[set(wl) for wl in groups])
+    wl = tuple(x for x in sorted(groups)[0] if x in common)
+    members = []
+    for key, group in groups.items():
+        keep = np.array([x in common for x in key])
+        members.extend((k, np.asarray(v)[keep]) for k, v in group)
+    return {wl: sorted(members, key=lambda m: m[0])}
+
+
+@contextmanager
+def _optional(context):
+    if context is None:
+        yield None
+    else:
+        with context as value:
+            yield value
+
+
+class Runner(object):
+    """Run FitJobs in isolated workspaces, optionally in parallel"""
+
+    def __init__(self, cdpro_dir, workers=1, cache=None, basis_store=None,
+                 batch=NATIVE_BATCH, scheduler=None, queue=None,
+                 native_options=None, factors=None):
+        """
+        :cdpro_dir: CDPro directory holding the executables and reference
+                    sets of the CDPro programs
+        :workers: number of fits run at once
+        :cache: ResultCache or None
+        :basis_store: basis.BasisStore of compiled reference sets for
+                      native algorithms; default the store in
+                      basis.DEFAULT_STORE
+        :batch: native jobs of an ibasis solved together
+        :scheduler: resources.Scheduler limiting and pinning the CDPro
+                    processes, or None to run one per worker
+        :queue: fairqueue.SharedQueue granting CDPro processes slots shared
+                with other runs, or None
+        :native_options: dict of algorithm name to keyword arguments of its
+                         solver, e.g. {'lsq': {'shared': ['ahelix']}}
+        :factors: factorcache.FactorCache of the native solvers; default a
+                  new in-memory cache
+        """
+        self.cdpro_dir = os.path.abspath(cdpro_dir)
+        self.workers = max(1, workers or 1)
+        self.cache = cache
+        self.basis_store = basis_store
+        self.batch = batch
+        self.scheduler = scheduler
+        self.queue = queue
+        self.native_options = native_options or {}
+        self.factors = factors if factors is not None else \
+            factorcache.FactorCache()
+        self._outputs = output_files()
+
+    def workspace(self, job):
+        """Create a workspace for a job
+
+        Files of the CDPro directory are symlinked (copied where links are
+        unsupported), except for anything a CDPro program writes, so the
+        shared directory is never modified.
+
+        :job: FitJob
+        :returns: workspace directory
+
+        """
+        ws = tempfile.mkdtemp(prefix='cdgo-{}-'.format(job.algorithm))
+        for f in os.listdir(self.cdpro_dir):
+            if f.lower() in self._outputs:
+                continue
+            src = os.path.join(self.cdpro_dir, f)
+            try:
+                os.symlink(src, os.path.join(ws, f))
+            except (OSError, AttributeError):
+                if os.path.isdir(src):
+                    shutil.copytree(src, os.path.join(ws, f))
+                else:
+                    shutil.copy(src, ws)
+        with open(os.path.join(ws, 'input'), 'w') as f:
+            f.write(job.text)
+        return ws
+
+    @contextmanager
+    def slot(self, job, cmd):
+        """Wait until the CDPro process of a job may start
+
+        The local scheduler slot is taken first, so a slot of the shared
+        queue is never held by a fit that cannot start.
+
+        :job: FitJob
+        :cmd: shell command of the process
+        :returns: context manager yielding (shell command, preexec_fn)
+
+        """
+        with _optional(self.scheduler and self.scheduler.slot()) as slot:
+            with _optional(self.queue and self.queue.slot(job)):
+                if self.scheduler is None:
+                    yield cmd, None
+                else:
+                    yield (self.scheduler.command(cmd, slot),
+                           self.scheduler.preexec(slot))
+
+    def execute(self, job, ws):
+        """Run the CDPro program of a job in its workspace
+
+        :job: FitJob
+        :ws: workspace from Runner.workspace
+        :returns: (crashed, seconds)
+
+        """
+        cmd = COMMAND.format(exe=ALGORITHMS[job.algorithm]['exe'])
+        with self.slot(job, cmd) as (cmd, preexec):
+            t0 = time.time()
+            p = subprocess.Popen([cmd], shell=True, cwd=ws,
+                                 stdout=subprocess.PIPE, preexec_fn=preexec)
+            out = p.communicate()[0]
+        duration = time.time() - t0
+        metrics.FIT_LATENCY.observe(duration, algorithm=job.algorithm,
+                                    ibasis=job.ibasis)
+        return b'(crashed)' in out, duration
+
+    def _outputs_of(self, ws):
+        return [os.path.join(ws, f) for f in sorted(os.listdir(ws))
+                if not os.path.islink(os.path.join(ws, f)) and
+                os.path.isfile(os.path.join(ws, f))]
+
+    def run_one(self, job):
+        """Run (or fetch from the cache) and parse a single job
+
+        :job: FitJob
+        :returns: FitResult
+
+        """
+        metrics.QUEUE_DEPTH.dec()
+        tags = dict(ibasis=job.ibasis, algorithm=job.algorithm)
+        key = None
+        ws = None
+        try:
+            src = None
+            if self.cache is not None:
+                key = self.cache.key(job, self.cdpro_dir)
+                src = self.cache.get(key)
+            result = FitResult(job, 'ok', cached=src is not None)
+            if src is None:
+                ws = self.workspace(job)
+                with profiling.stage('execution', **tags):
+                    crashed, result.duration = self.execute(job, ws)
+                if crashed:
+                    logging.warning('{a} crashed for ibasis {i}'.format(
+                        a=job.algorithm, i=job.ibasis))
+                    metrics.CRASHES.inc(algorithm=job.algorithm)
+                    result.status = 'crashed'
+                    return result
+                src = ws
+            files = self._outputs_of(src)
+            if job.out_dir is not None:
+                with profiling.stage('file_moves', **tags) as rec:
+                    if not os.path.isdir(job.out_dir):
+                        os.makedirs(job.out_dir)
+                    for f in files:
+                        rec['bytes_written'] += profiling.file_size(f)
+                        shutil.copy(f, job.out_dir)
+            with profiling.stage('parsing', **tags):
+                parse_fit(result, src)
+            if ws is not None and key is not None:
+                self.cache.put(key, files)
+            return result
+        except Exception as e:
+            logging.warning('{a} ibasis {i}: could not read CDPro output '
+                            '({e})'.format(a=job.algorithm, i=job.ibasis,
+                                           e=e))
+            return FitResult(job, 'failed', error=str(e))
+        finally:
+            if ws is not None:
+                shutil.rmtree(ws, ignore_errors=True)
+
+    def run_native(self, jobs):
+        """Solve native jobs of one ibasis as a batch
+
+        :jobs: list of FitJob sharing an algorithm and ibasis
+        :returns: list of FitResult, in the order of jobs
+
+        """
+        job = jobs[0]
+        tags = dict(ibasis=job.ibasis, algorithm=job.algorithm)
+        metrics.QUEUE_DEPTH.dec(len(jobs))
+        try:
+            if self.basis_store is None:
+                self.basis_store = BasisStore(DEFAULT_STORE)
+            basis = self.basis_store.load(job.ibasis)
+        except (KeyError, ValueError, IOError, OSError) as e:
+            logging.warning('{a} ibasis {i}: no reference set ({e})'.format(
+                a=job.algorithm, i=job.ibasis, e=e))
+            return [FitResult(j, 'failed', error=str(e)) for j in jobs]
+        # spectra on the same wavelengths are solved together
+        groups = {}
+        for k, j in enumerate(jobs):
+            _, wl, values = read_input_text(j.text)
+            groups.setdefault(tuple(wl), []).append((k, values))
+        if ALGORITHMS[job.algorithm].get('stack') and len(groups) > 1:
+            groups = _common_wavelengths(groups)
+        solver = SOLVERS[job.algorithm]
+        options = self.native_options.get(job.algorithm, {})
+        results = [None] * len(jobs)
+        for wl, members in groups.items():
+            t0 = time.time()
+            try:
+                with profiling.stage('execution', **tags):
+                    out = solver(basis, np.array(wl),
+                                 np.array([v for k, v in members]),
+                                 cache=self.factors, **options)
+            except ValueError as e:
+                logging.warning('{a} ibasis {i}: {e}'.format(
+                    a=job.algorithm, i=job.ibasis, e=e))
+                for k, v in members:
+                    results[k] = FitResult(jobs[k], 'failed', error=str(e))
+                continue
+            duration = (time.time() - t0) / len(members)
+            fit_wl, spectra, fractions, calc, count = out
+            for (k, v), y, f, c, n in zip(members, spectra, fractions, calc,
+                                          count):
+                metrics.FIT_LATENCY.observe(duration, **tags)
+                results[k] = self._native_result(jobs[k], basis, fit_wl, y,
+                                                 f, c, n, duration)
+        return results
+
+    def _native_result(self, job, basis, wl, y, f, calc, count, duration):
+        if count == 0:
+            logging.warning('{a} ibasis {i}: no self-consistent '
+                            'solution'.format(a=job.algorithm, i=job.ibasis))
+            return FitResult(job, 'failed', duration=duration,
+                             error='no self-consistent solution')
+        result = FitResult(job, 'ok', duration=duration)
+        result.refset = str(basis.refset)
+        result.ss = selcon.summary(basis.labels, f)
+        curve = pd.DataFrame({'ExpCD': y, 'CalcCD': calc},
+                             index=pd.Index(wl, name='WaveL'),
+                             columns=['ExpCD', 'CalcCD'])
+        fill_fit(result, curve)
+        if job.out_dir is not None:
+            if not os.path.isdir(job.out_dir):
+                os.makedirs(job.out_dir)
+            selcon.write_output(job.out_dir, basis, f, wl, y, calc,
+                                program=job.algorithm.upper())
+        return result
+
+    def run(self, jobs):
+        """Run jobs, yielding results as they complete
+
+        jobs may be a generator; it is consumed only a few jobs ahead of the
+        workers, so long or streamed batches are never held in memory.
+        Native jobs are held back per ibasis until a batch is full or the
+        jobs run out.
+
+        :jobs: iterable of FitJob
+        :returns: generator of FitResult, in completion order
+
+        """
+        pool = ThreadPool(self.workers) if self.workers > 1 else None
+        done = Queue()
+        pending = 0
+        native = {}
+        try:
+            for job in jobs:
+                metrics.QUEUE_DEPTH.inc()
+                if ALGORITHMS[job.algorithm].get('native'):
+                    key = (job.algorithm, job.ibasis)
+                    native.setdefault(key, []).append(job)
+                    if len(native[key]) >= self.batch:
+                        for result in self.run_native(native.pop(key)):
+                            yield self._done(result)
+                elif pool is None:
+                    yield self._done(self.run_one(job))
+                else:
+                    pool.apply_async(self.run_one, (job,),
+                                     callback=done.put)
+                    pending += 1
+                    while pending >= 2 * self.workers:
+                        pending -= 1
+                        yield self._done(done.get())
+            for key in sorted(native):
+                for result in self.run_native(native[key]):
+                    yield self._done(result)
+            while pending:
+                pending -= 1
+                yield self._done(done.get())
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _done(self, result):
+        metrics.FITS.inc(algorithm=result.job.algorithm,
+                         ibasis=result.job.ibasis, status=result.status)
+        return result
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Global constrained least squares fits of many spectra against one basis.
+
+Each spectrum y is fitted as P f, P being the (m, k) spectra of the
+structure classes of a basis (see selcon.class_spectra), with fractions
+f >= 0 that sum to 1. The optimum has some set of non-zero classes, and on
+that set it is the solution of the equality constrained problem alone.
+`factorise` therefore inverts the Gram matrix P^T P restricted to every
+non-empty set of classes once per basis and wavelength window (at most 255
+small matrices for 8 classes; kept in a factorcache.FactorCache), and
+`solve` evaluates every set for all spectra with a few matrix products,
+keeping for each spectrum the feasible solution of least residual. A whole
+titration or melt is fitted against a basis in one batched operation,
+whatever its length.
+
+Fractions can also be shared across a series, e.g. when a ligand is known
+not to change the helix content. The classes of the shared summary
+fractions then take one value for every spectrum, which couples the
+spectra; `solve_shared` solves the stacked problem as one non-negative
+least squares problem in normal equation form, enforcing each sum to 1
+with a heavily weighted penalty.
+"""
+
+import itertools
+
+import numpy as np
+
+import factorcache
+import selcon
+
+# weight of the sum-to-one penalty relative to the mean diagonal of P^T P
+SUM_WEIGHT = 1e6
+# smallest fraction counted as non-zero
+TOL = 1e-10
+
+
+def factorise(P):
+    """Inverses of the Gram matrix of every set of classes
+
+    :P: (m, k) class spectra
+    :returns: list of (class indices, inverse of the restricted Gram
+              matrix, its row sums, their total), one per non-empty set
+
+    """
+    G = P.T.dot(P)
+    k = G.shape[0]
+    out = []
+    for size in range(1, k + 1):
+        for idx in itertools.combinations(range(k), size):
+            idx = np.array(idx)
+            inv = np.linalg.pinv(G[np.ix_(idx, idx)])
+            u = inv.sum(axis=1)
+            out.append((idx, inv, u, u.sum()))
+    return out
+
+
+def solve(P, Y, factors=None):
+    """Fractions of every spectrum, non-negative and summing to 1
+
+    :P: (m, k) class spectra
+    :Y: (b, m) spectra
+    :factors: result of factorise(P), to reuse between calls
+    :returns: (b, k) fractions
+
+    """
+    if factors is None:
+        factors = factorise(P)
+    G = P.T.dot(P)
+    B = Y.dot(P)
+    yy = (Y * Y).sum(axis=1)
+    b, k = B.shape
+    best = np.full(b, np.inf)
+    f = np.zeros((b, k))
+    for idx, inv, u, total in factors:
+        if total <= 0:
+            continue
+        Bs = B[:, idx]
+        x = Bs.dot(inv)
+        # Lagrange multiplier of the sum constraint, per spectrum
+        fs = x - ((x.sum(axis=1) - 1.) / total)[:, None] * u[None, :]
+        Gs = G[np.ix_(idx, idx)]
+        resid = yy - 2. * (fs * Bs).sum(axis=1) + \
+            (fs.dot(Gs) * fs).sum(axis=1)
+        better = (fs.min(axis=1) >= -TOL) & (resid < best)
+        if better.any():
+            best[better] = resid[better]
+            f[better] = 0.
+            f[np.ix_(np.nonzero(better)[0], idx)] = fs[better]
+    return np.clip(f, 0., None)
+
+
+def nnls(AtA, Atb, max_iter=None):
+    """Non-negative least squares in normal equation form
+
+    Lawson and Hanson's active set method as reformulated by Bro and de
+    Jong, working on A^T A and A^T b only.
+
+    :AtA: (n, n) array
+    :Atb: (n,) array
+    :max_iter: iterations before giving up; default 3 n
+    :returns: (n,) array
+
+    """
+    n = Atb.size
+    max_iter = 3 * n if max_iter is None else max_iter
+    tol = 10 * np.finfo(float).eps * np.abs(AtA).sum(axis=0).max() * n
+    passive = np.zeros(n, dtype=bool)
+    x = np.zeros(n)
+    w = Atb - AtA.dot(x)
+    for _ in range(max_iter):
+        if passive.all() or w[~passive].max() <= tol:
+            break
+        passive[np.argmax(np.where(passive, -np.inf, w))] = True
+        while True:
+            s = np.zeros(n)
+            s[passive] = np.linalg.solve(AtA[np.ix_(passive, passive)],
+                                         Atb[passive])
+            if s[passive].min() > 0:
+                break
+            bad = passive & (s <= 0)
+            alpha = (x[bad] / (x[bad] - s[bad])).min()
+            x = x + alpha * (s - x)
+            passive &= x > tol
+        x = s
+        w = Atb - AtA.dot(x)
+    return x
+
+
+def solve_shared(P, Y, shared):
+    """Fractions of spectra sharing the fractions of some classes
+
+    :P: (m, k) class spectra
+    :Y: (b, m) spectra
+    :shared: (k,) boolean, classes whose fraction is common to all spectra
+    :returns: (b, k) fractions
+
+    """
+    shared = np.asarray(shared, dtype=bool)
+    Ps, Po = P[:, shared], P[:, ~shared]
+    b = Y.shape[0]
+    ns, no = Ps.shape[1], Po.shape[1]
+    G = P.T.dot(P)
+    w2 = SUM_WEIGHT * np.trace(G) / G.shape[0]
+    # normal equations of the stacked problem: the shared fractions
+    # followed by the other fractions of each spectrum
+    n = ns + b * no
+    AtA = np.zeros((n, n))
+    Atb = np.zeros(n)
+    AtA[:ns, :ns] = b * (Ps.T.dot(Ps) + w2)
+    Atb[:ns] = Ps.T.dot(Y.sum(axis=0)) + b * w2
+    cross = Ps.T.dot(Po) + w2
+    own = Po.T.dot(Po) + w2
+    for i in range(b):
+        j = ns + i * no
+        AtA[:ns, j:j + no] = cross
+        AtA[j:j + no, :ns] = cross.T
+        AtA[j:j + no, j:j + no] = own
+        Atb[j:j + no] = Po.T.dot(Y[i]) + w2
+    x = nnls(AtA, Atb)
+    f = np.empty((b, P.shape[1]))
+    f[:, shared] = x[:ns]
+    f[:, ~shared] = x[ns:].reshape(b, no)
+    return f
+
+
+def fit(basis, wavelengths, Y, shared=None, cache=None):
+    """Fit spectra against one basis
+
+    :basis: basis.Basis
+    :wavelengths: (m,) wavelengths of the spectra
+    :Y: (b, m) delta epsilon spectra
+    :shared: summary fractions (selcon.FRACTIONS) common to all spectra
+    :cache: factorcache.FactorCache for the basis restricted to the
+            wavelength window and its factorisations, or None
+    :returns: (wavelengths long to short, (b, m') spectra on them,
+              (b, k) fractions of the basis classes, (b, m') calculated
+              spectra, (b,) 1 for every solved spectrum)
+    :raises: ValueError if the spectra and basis share too few wavelengths
+
+    """
+    wl, iy, A, F, P = selcon.prepare(basis, wavelengths, cache)
+    Yc = np.asarray(np.atleast_2d(Y), dtype=float)[:, iy]
+    if shared:
+        M = selcon.class_matrix(basis.labels)
+        mask = M[[selcon.FRACTIONS.index(s) for s in shared]].any(axis=0)
+        f = solve_shared(P, Yc, mask)
+    else:
+        factors = factorcache.lookup(
+            cache, factorcache.make_key('lsq', basis, wavelengths),
+            lambda: factorise(P))
+        f = solve(P, Yc, factors)
+    return wl, Yc, f, f.dot(P.T), np.ones(len(f), dtype=int)
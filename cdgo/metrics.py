@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Operational metrics for long-running CDGo processes.
+
+Counters, gauges and histograms are kept in a process-wide registry and
+rendered in the Prometheus text exposition format, either to a file for
+node_exporter's textfile collector (`write_textfile`) or over HTTP on a
+local port (`serve`).
+"""
+
+import os
+import time
+import logging
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# seconds; CDPro fits under wine typically take between 0.5 and 30 s
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(v):
+    return (str(v).replace('\\', r'\\')
+                  .replace('\n', r'\n')
+                  .replace('"', r'\"'))
+
+
+def _labelstr(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v))
+                          for k, v in pairs) + '}'
+
+
+def _fmt(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        missing = set(self.labels) - set(labels)
+        if missing:
+            raise ValueError('{} missing labels {}'.format(self.name,
+                                                           sorted(missing)))
+        return tuple(labels[k] for k in self.labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return ['{}{} {}'.format(self.name, _labelstr(self.labels, key),
+                                 _fmt(value))]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, total = self._values.get(self._key(labels), ([0], 0.0))
+        return counts[-1]
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        for bound, c in zip(self.buckets, counts):
+            lines.append('{}_bucket{} {}'.format(
+                self.name, _labelstr(self.labels, key, ('le', _fmt(bound))),
+                c))
+        labels = _labelstr(self.labels, key)
+        lines.append('{}_sum{} {}'.format(self.name, labels, _fmt(total)))
+        lines.append('{}_count{} {}'.format(self.name, labels, counts[-1]))
+        return lines
+
+
+class Registry(object):
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Render every metric in Prometheus text format
+
+        :returns: str
+
+        """
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+START_TIME = REGISTRY.register(Gauge(
+    'cdgo_start_time_seconds', 'Unix time the CDGo process started.'))
+FITS = REGISTRY.register(Counter(
+    'cdgo_fits_total', 'CDPro fits completed, by outcome.',
+    ['algorithm', 'ibasis', 'status']))
+CRASHES = REGISTRY.register(Counter(
+    'cdgo_wine_crashes_total', 'CDPro runs under wine that crashed.',
+    ['algorithm']))
+FIT_LATENCY = REGISTRY.register(Histogram(
+    'cdgo_fit_duration_seconds', 'Wall time of a single CDPro run.',
+    ['algorithm', 'ibasis']))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'cdgo_queue_depth', 'CDPro fits waiting to run.'))
+WORKER_LIMIT = REGISTRY.register(Gauge(
+    'cdgo_worker_limit', 'CDPro processes allowed to run at once.'))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    'cdgo_queue_wait_seconds',
+    'Time a fit waited for a slot of the shared queue, by class.',
+    ['priority']))
+CACHE = REGISTRY.register(Counter(
+    'cdgo_cache_requests_total', 'Fit result cache lookups, by result.',
+    ['result']))
+PARSE_CACHE = REGISTRY.register(Counter(
+    'cdgo_parse_cache_requests_total',
+    'Parsed Aviv file cache lookups, by result.', ['result']))
+FACTOR_CACHE = REGISTRY.register(Counter(
+    'cdgo_factor_cache_requests_total',
+    'Reference matrix factorisation cache lookups and evictions, by '
+    'result.', ['result']))
+FACTOR_CACHE_BYTES = REGISTRY.register(Gauge(
+    'cdgo_factor_cache_bytes',
+    'Memory held by cached reference matrix factorisations.'))
+
+START_TIME.set(time.time())
+
+
+def write_textfile(fname, registry=REGISTRY):
+    """Atomically write the registry for the node_exporter textfile collector
+
+    :fname: output .prom file
+    :registry: Registry instance
+    :returns: None
+
+    """
+    tmp = '{}.{}.tmp'.format(fname, os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(registry.render())
+    os.rename(tmp, fname)
+
+
+def serve(port, addr='127.0.0.1', registry=REGISTRY):
+    """Expose the registry over HTTP from a daemon thread
+
+    :port: TCP port
+    :addr: address to bind; defaults to localhost only
+    :registry: Registry instance
+    :returns: HTTPServer instance (call shutdown() to stop)
+
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug('metrics: ' + format, *args)
+
+    server = HTTPServer((addr, port), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    logging.info('Serving metrics on http://{}:{}/metrics'.format(addr,
+                                                                  port))
+    return server
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Nearest-neighbour ranking of reference sets for a spectrum.
+
+Every reference protein of every compiled basis is stacked into one matrix
+on the wavelengths the bases share, each spectrum scaled to unit length, and
+optionally reduced by PCA. A query spectrum is compared with all of them in
+a single matrix-vector product; the bases are ranked by how much of the
+spectrum's neighbourhood (its most similar reference proteins) they cover.
+`--db_range auto:k` fits only the k best ranked bases.
+
+The index is saved next to the basis store, keyed by the checksums of the
+entries it was built from, and rebuilt when any of them change.
+"""
+
+import os
+import logging
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+
+# --db_range auto:k
+Auto = namedtuple('Auto', ['k'])
+
+# reference proteins making up the neighbourhood of a query
+NEIGHBOURS = 10
+
+
+def parse_auto(string):
+    """Parse 'auto:k'
+
+    :string: db_range value
+    :returns: Auto, or None if string is not of this form
+
+    """
+    head, sep, k = string.partition(':')
+    if head != 'auto':
+        return None
+    if not sep:
+        k = '3'
+    if not k.isdigit() or int(k) < 1:
+        raise ValueError(k)
+    return Auto(int(k))
+
+
+def _unit(x):
+    norm = np.sqrt((x * x).sum(axis=-1))
+    norm[norm == 0] = 1.
+    return x / norm[..., None]
+
+
+class SpectrumIndex(object):
+    """Unit-normalised reference spectra of every basis, with owners"""
+
+    def __init__(self, wavelengths, vectors, owners, components=None,
+                 mean=None):
+        """
+        :wavelengths: shared grid, long to short
+        :vectors: (n, m) unit spectra on the grid
+        :owners: (n,) ibasis of each row
+        :components: (p, m) PCA components, or None
+        :mean: (m,) mean subtracted before projection
+        """
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.vectors = np.asarray(vectors, dtype=float)
+        self.owners = np.asarray(owners, dtype=int)
+        self.components = components
+        self.mean = mean
+        self.reduced = None
+        if components is not None:
+            self.reduced = _unit((self.vectors - mean).dot(components.T))
+
+    @classmethod
+    def build(cls, bases, n_components=0):
+        """Index a list of compiled bases
+
+        :bases: list of basis.Basis
+        :n_components: PCA dimensions to keep; 0 for none
+        :returns: SpectrumIndex
+        :raises: ValueError if the bases share fewer than two wavelengths
+
+        """
+        grid = np.asarray(bases[0].wavelengths)
+        for b in bases[1:]:
+            grid = np.intersect1d(grid, np.asarray(b.wavelengths))
+        grid = np.sort(grid)[::-1]
+        if grid.size < 2:
+            raise ValueError('reference sets share no wavelength range')
+        rows, owners = [], []
+        for b in bases:
+            wl = np.asarray(b.wavelengths)
+            pick = np.searchsorted(-wl, -grid)
+            rows.append(np.asarray(b.spectra)[pick].T)
+            owners.append(np.full(b.spectra.shape[1], b.ibasis))
+        vectors = _unit(np.vstack(rows))
+        components = mean = None
+        if n_components:
+            mean = vectors.mean(axis=0)
+            u, s, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+            components = vt[:n_components]
+        return cls(grid, vectors, np.concatenate(owners), components, mean)
+
+    def save(self, fname):
+        arrays = dict(wavelengths=self.wavelengths, vectors=self.vectors,
+                      owners=self.owners)
+        if self.components is not None:
+            arrays.update(components=self.components, mean=self.mean)
+        with open(fname, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, fname):
+        d = np.load(fname)
+        pca = 'components' in d.files
+        return cls(d['wavelengths'], d['vectors'], d['owners'],
+                   d['components'] if pca else None,
+                   d['mean'] if pca else None)
+
+    def similarity(self, epsilon):
+        """Cosine similarity of a spectrum to every reference protein
+
+        The full (or PCA reduced) index is used when the spectrum covers the
+        whole shared grid; otherwise only the wavelengths it covers.
+
+        :epsilon: series of delta epsilon indexed by wavelength
+        :returns: (n,) array
+        :raises: ValueError if the spectrum overlaps the grid at fewer than
+                 two wavelengths
+
+        """
+        wl = np.round(np.asarray(epsilon.index, dtype=float), 2)
+        y = dict(zip(wl, np.asarray(epsilon, dtype=float)))
+        common = np.array([w in y for w in self.wavelengths])
+        if common.sum() < 2:
+            raise ValueError('spectrum does not overlap the reference sets')
+        q = np.array([y[w] for w in self.wavelengths[common]])
+        if common.all():
+            q = _unit(q[None])[0]
+            if self.reduced is not None:
+                q = _unit(((q - self.mean).dot(self.components.T))[None])[0]
+                return self.reduced.dot(q)
+            return self.vectors.dot(q)
+        return _unit(self.vectors[:, common]).dot(_unit(q[None])[0])
+
+    def rank(self, epsilon, neighbours=NEIGHBOURS):
+        """Rank bases by coverage of a spectrum's neighbourhood
+
+        :epsilon: series of delta epsilon indexed by wavelength
+        :neighbours: size of the neighbourhood
+        :returns: list of (ibasis, score, members in the neighbourhood,
+                  best similarity), best first
+
+        """
+        sim = self.similarity(epsilon)
+        near = np.argsort(-sim)[:neighbours]
+        out = []
+        for ibasis in np.unique(self.owners):
+            mine = self.owners == ibasis
+            hits = mine[near]
+            out.append((int(ibasis), float(sim[near][hits].sum()),
+                        int(hits.sum()), float(sim[mine].max())))
+        out.sort(key=lambda r: (-r[1], -r[3], r[0]))
+        return out
+
+
+def index_key(bases, n_components):
+    h = hashlib.sha1()
+    for b in sorted(bases, key=lambda b: b.ibasis):
+        h.update('{}:{};'.format(b.ibasis, b.checksum).encode('utf-8'))
+    h.update(str(n_components).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def load_index(store, n_components=0):
+    """Index of every basis available in a store, built on first use
+
+    :store: basis.BasisStore
+    :n_components: PCA dimensions; 0 for none
+    :returns: SpectrumIndex
+    :raises: KeyError if no basis is available
+
+    """
+    bases = []
+    for ibasis in range(1, 11):
+        try:
+            bases.append(store.load(ibasis))
+        except KeyError:
+            pass
+    if not bases:
+        raise KeyError('no compiled reference sets in {}'.format(
+            store.store_dir))
+    fname = os.path.join(store.root, 'index-{}.npz'.format(
+        index_key(bases, n_components)))
+    if os.path.isfile(fname):
+        return SpectrumIndex.load(fname)
+    index = SpectrumIndex.build(bases, n_components)
+    tmp = '{f}.{p}.tmp'.format(f=fname, p=os.getpid())
+    index.save(tmp)
+    os.rename(tmp, fname)
+    logging.debug('Built reference index {}'.format(fname))
+    return index
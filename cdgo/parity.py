@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parity and speed of the native engines against CDPro.
+
+A corpus of CDPro input files is fitted with every ibasis by the CDPro
+programs under wine (the reference) and by the native engines. All jobs go
+to one Runner, so native batches are solved while the wine fits run in the
+worker pool. For every input, ibasis and pair of reference and native
+algorithm, the four fractions and the RMSD are compared against
+tolerances, and the fit latency and throughput of each algorithm are
+reported.
+
+Reference output can be recorded into a fixture directory
+
+    <fixtures>/<sha1 of input>/<algorithm>-ibasis<N>/ProtSS.out, ...
+    <fixtures>/<sha1 of input>/<algorithm>-ibasis<N>/fixture.json
+
+and replayed instead of running wine, so the comparison also runs on
+machines without wine or CDPro.
+"""
+
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from cdpro import ALGORITHMS
+from cdpro import ALGORITHM_ORDER
+from cdpro import set_ibasis
+from jobs import FitJob
+from jobs import FitResult
+from jobs import parse_fit
+from readers import FRACTIONS
+from readers import parse_percent
+
+MEASURES = FRACTIONS + ['rmsd']
+
+# largest accepted |native - reference|: percentage points, and delta
+# epsilon for the rmsd
+TOLERANCES = {'ahelix': 5., 'bstrand': 5., 'turn': 5., 'unord': 5.,
+              'rmsd': 0.05}
+
+MODES = ['live', 'record', 'replay']
+
+NATIVE = [a for a in ALGORITHM_ORDER if ALGORITHMS[a].get('native')]
+REFERENCE = [a for a in ALGORITHM_ORDER if not ALGORITHMS[a].get('native')]
+
+COLUMNS = ['input', 'ibasis', 'refset', 'reference', 'native', 'status'] + \
+    ['{m}_{s}'.format(m=m, s=s) for m in MEASURES
+     for s in ('reference', 'native', 'delta')] + ['passed']
+
+
+def parse_tolerances(string):
+    """argparse type for tolerance overrides, e.g. 'ahelix=3,rmsd=0.02'
+
+    :string: comma separated name=value pairs
+    :returns: dict
+
+    """
+    out = {}
+    for item in string.split(','):
+        name, sep, value = item.partition('=')
+        name = name.strip()
+        if not sep or name not in TOLERANCES:
+            raise argparse.ArgumentTypeError(
+                "'{i}' is not a parity tolerance. Known tolerances: "
+                "{k}".format(i=item, k=', '.join(MEASURES)))
+        try:
+            out[name] = float(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "'{}' is not a number".format(value))
+    return out
+
+
+def find_inputs(paths):
+    """CDPro input files of a corpus
+
+    :paths: files, or directories searched for files named `input` (such
+            as the `<sample>-CDPro` output directories)
+    :returns: sorted list of file names
+
+    """
+    out = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                if 'input' in files:
+                    out.add(os.path.join(root, 'input'))
+                    # per-fit copies of the same input
+                    dirs[:] = []
+        else:
+            out.add(path)
+    return sorted(out)
+
+
+def input_key(text):
+    """Fixture key of CDPro input text
+
+    :text: CDPro input file contents
+    :returns: hex digest prefix
+
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class Fixtures(object):
+    """Recorded CDPro output, keyed by input text, algorithm and ibasis"""
+
+    def __init__(self, root):
+        """
+        :root: fixture directory
+        """
+        self.root = root
+
+    def path(self, job):
+        """Directory of the recorded output of a job
+
+        :job: FitJob
+        :returns: str
+
+        """
+        return os.path.join(self.root, input_key(job.text),
+                            '{a}-ibasis{i}'.format(a=job.algorithm,
+                                                   i=job.ibasis))
+
+    def record(self, result):
+        """Store the outcome of a fit whose output was copied to its out_dir
+
+        :result: FitResult
+        :returns: None
+
+        """
+        path = self.path(result.job)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, 'fixture.json'), 'w') as f:
+            json.dump({'algorithm': result.job.algorithm,
+                       'ibasis': result.job.ibasis,
+                       'status': result.status,
+                       'duration': result.duration}, f, sort_keys=True)
+
+    def load(self, job):
+        """Recorded result of a job
+
+        :job: FitJob
+        :returns: FitResult; 'failed' if nothing was recorded
+
+        """
+        path = self.path(job)
+        try:
+            with open(os.path.join(path, 'fixture.json')) as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return FitResult(job, 'failed', error='no recorded output')
+        result = FitResult(job, meta['status'], cached=True,
+                           duration=meta['duration'])
+        if result.ok:
+            try:
+                parse_fit(result, path)
+            except Exception as e:
+                return FitResult(job, 'failed', error=str(e))
+        return result
+
+
+def jobs(inputs, algorithms, ibases, fixtures=None):
+    """FitJobs for every input, ibasis and algorithm
+
+    :inputs: list of CDPro input file names
+    :algorithms: list of algorithm names
+    :ibases: list of ibasis integers
+    :fixtures: Fixtures to record the output of CDPro programs into, or
+               None
+    :returns: list of FitJob tagged with their input file name
+
+    """
+    out = []
+    for name in inputs:
+        with open(name) as f:
+            text = f.read()
+        for ibasis in ibases:
+            for alg in algorithms:
+                job = FitJob(alg, ibasis, set_ibasis(text, ibasis), tag=name)
+                if fixtures is not None and not ALGORITHMS[alg].get('native'):
+                    job.out_dir = fixtures.path(job)
+                out.append(job)
+    return out
+
+
+def run(runner, inputs, reference, native, ibases, fixtures=None,
+        mode='live'):
+    """Fit a corpus with the reference and native algorithms
+
+    :runner: jobs.Runner
+    :inputs: list of CDPro input file names
+    :reference: list of CDPro algorithm names
+    :native: list of native algorithm names
+    :ibases: list of ibasis integers
+    :fixtures: Fixtures, required to record or replay
+    :mode: 'live' runs CDPro, 'record' also stores its output in fixtures,
+           'replay' reads the CDPro results from fixtures instead
+    :returns: (dict of (input, algorithm, ibasis) to FitResult, dataframe
+              of algorithm, duration and source ('live' or 'recorded') per
+              fit)
+
+    """
+    results = {}
+    timings = []
+    if mode == 'replay':
+        for job in jobs(inputs, reference, ibases):
+            r = fixtures.load(job)
+            results[(job.tag, job.algorithm, job.ibasis)] = r
+            if r.ok:
+                timings.append([job.algorithm, r.duration, 'recorded'])
+        batch = jobs(inputs, native, ibases)
+    else:
+        batch = jobs(inputs, reference + native, ibases,
+                     fixtures if mode == 'record' else None)
+    for r in runner.run(batch):
+        job = r.job
+        results[(job.tag, job.algorithm, job.ibasis)] = r
+        if mode == 'record' and not ALGORITHMS[job.algorithm].get('native'):
+            fixtures.record(r)
+        if r.ok:
+            timings.append([job.algorithm, r.duration, 'live'])
+    return results, pd.DataFrame(timings, columns=['algorithm', 'duration',
+                                                   'source'])
+
+
+def compare(results, inputs, reference, native, ibases,
+            tolerances=TOLERANCES):
+    """Differences between native and reference fits
+
+    :results: dict from run
+    :inputs: list of CDPro input file names
+    :reference: list of CDPro algorithm names
+    :native: list of native algorithm names
+    :ibases: list of ibasis integers
+    :tolerances: dict of largest accepted absolute difference per measure
+    :returns: dataframe with COLUMNS, one row per input, ibasis, reference
+              and native algorithm
+
+    """
+    rows = []
+    for name in inputs:
+        for ibasis in ibases:
+            for ref in reference:
+                for nat in native:
+                    r = results.get((name, ref, ibasis))
+                    n = results.get((name, nat, ibasis))
+                    rows.append(_row(name, ibasis, ref, nat, r, n,
+                                     tolerances))
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df['passed'] = df['passed'].astype(bool)
+    return df
+
+
+def _row(name, ibasis, ref, nat, r, n, tolerances):
+    row = [name, ibasis, None, ref, nat]
+    if r is None or not r.ok:
+        return row + ['reference ' + (r.status if r else 'missing')] + \
+            [np.nan] * 3 * len(MEASURES) + [False]
+    if n is None or not n.ok:
+        return row + ['native ' + (n.status if n else 'missing')] + \
+            [np.nan] * 3 * len(MEASURES) + [False]
+    row[2] = r.refset
+    row.append('ok')
+    passed = True
+    for m in MEASURES:
+        if m == 'rmsd':
+            a, b = r.rmsd, n.rmsd
+        else:
+            a, b = parse_percent(r.ss[m]), parse_percent(n.ss[m])
+        delta = round(b - a, 4)
+        passed &= abs(delta) <= tolerances.get(m, TOLERANCES[m])
+        row += [a, b, delta]
+    return row + [passed]
+
+
+def by_basis(df):
+    """Accuracy of the native fits per reference set
+
+    :df: dataframe from compare
+    :returns: dataframe indexed by (ibasis, reference, native) with the
+              number of comparisons, the fraction passing, the mean
+              absolute difference of each fraction and the largest
+              absolute rmsd difference
+
+    """
+    d = df.copy()
+    deltas = ['{}_delta'.format(m) for m in MEASURES]
+    d[deltas] = d[deltas].abs()
+    d['passed'] = d['passed'].astype(float)
+    g = d.groupby(['ibasis', 'reference', 'native'])
+    out = g[deltas[:-1]].mean()
+    out.columns = ['{}_mad'.format(m) for m in FRACTIONS]
+    out['rmsd_max'] = g['rmsd_delta'].max()
+    out.insert(0, 'passed', g['passed'].mean())
+    out.insert(0, 'n', g.size())
+    return out.round(3)
+
+
+def speed(timings):
+    """Throughput and latency of each algorithm
+
+    Throughput is per worker: fits per second of summed fit time. For
+    CDPro programs a fit is one wine run; native fits are solved in
+    batches and each fit is charged an equal share of its batch.
+
+    :timings: dataframe from run
+    :returns: dataframe indexed by algorithm
+
+    """
+    rows = []
+    for alg, g in timings.groupby('algorithm', sort=False):
+        d = g['duration'].values
+        total = d.sum()
+        rows.append([alg, g['source'].iloc[0], len(g), total,
+                     len(g) / total if total > 0 else np.nan, d.mean(),
+                     np.percentile(d, 50), np.percentile(d, 95), d.max()])
+    out = pd.DataFrame(rows, columns=['algorithm', 'source', 'fits',
+                                      'total_s', 'fits_per_s', 'mean_s',
+                                      'p50_s', 'p95_s', 'max_s'])
+    return out.set_index('algorithm').round(5)
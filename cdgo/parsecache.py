@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Binary cache of parsed Aviv files.
+
+`read_aviv` tokenises the whole text export with pandas on every run. The
+parsed rows (wavelength label, CD signal and dynode voltage up to
+`$ENDDATA`) are kept in a central cache directory as one structured `.npy`
+array per source file, next to a small JSON record of the header metadata,
+the `$ENDDATA` row and the source's size, mtime and sha1:
+
+    <cache>/<sha1 of absolute path>.npy
+    <cache>/<sha1 of absolute path>.json
+
+An entry is used without reading the source while its size and mtime are
+unchanged. Otherwise the source is hashed: identical content (a touched or
+copied file) revalidates the entry, anything else is parsed again and
+replaces it. Arrays are opened memory-mapped.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# store used when none is given on the command line
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cdgo', 'parsed')
+
+# layout version of entries; bump when the layout changes
+VERSION = 1
+
+# wavelength labels are kept as text so indices match a fresh parse exactly
+DTYPE = np.dtype([('X', 'S16'), ('CD_Signal', '<f8'), ('CD_Dynode', '<f8')])
+
+
+def content_hash(fname):
+    """sha1 of a file's contents
+
+    :fname: file name
+    :returns: hex digest
+
+    """
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def header(fname, lines=18):
+    """`key: value` metadata of an Aviv header
+
+    :fname: file name
+    :lines: header length
+    :returns: dict
+
+    """
+    out = {}
+    with open(fname) as fp:
+        for i, line in enumerate(fp):
+            if i >= lines:
+                break
+            key, sep, value = line.partition(':')
+            if sep:
+                out[key.strip()] = value.strip()
+    return out
+
+
+def to_table(df):
+    """Pack parsed rows into a structured array
+
+    :df: dataframe with X, CD_Signal and CD_Dynode columns
+    :returns: array with DTYPE fields
+
+    """
+    table = np.empty(len(df), dtype=DTYPE)
+    table['X'] = [str(x) for x in df['X']]
+    table['CD_Signal'] = np.asarray(df['CD_Signal'], dtype=float)
+    table['CD_Dynode'] = np.asarray(df['CD_Dynode'], dtype=float)
+    return table
+
+
+def to_frame(table):
+    """Rows of a cache entry as read_aviv parses them
+
+    :table: array with DTYPE fields
+    :returns: dataframe with X (text), CD_Signal and CD_Dynode columns
+
+    """
+    labels = [x.decode('ascii') if isinstance(x, bytes) and
+              not isinstance(x, str) else str(x) for x in table['X']]
+    return pd.DataFrame({'X': labels,
+                         'CD_Signal': np.array(table['CD_Signal']),
+                         'CD_Dynode': np.array(table['CD_Dynode'])},
+                        columns=['X', 'CD_Signal', 'CD_Dynode'])
+
+
+class ParseCache(object):
+    """Parsed Aviv rows keyed by source path, size, mtime and content"""
+
+    def __init__(self, cache_dir):
+        """
+        :cache_dir: cache directory; created if missing
+        """
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _base(self, fname):
+        key = hashlib.sha1(os.path.abspath(fname).encode('utf-8'))
+        return os.path.join(self.cache_dir, key.hexdigest())
+
+    def get(self, fname):
+        """Cached parse of a file, if still valid
+
+        :fname: source file name
+        :returns: (structured array with DTYPE fields, metadata dict), or
+                  None on a miss
+
+        """
+        base = self._base(fname)
+        try:
+            with open(base + '.json') as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            metrics.PARSE_CACHE.inc(result='miss')
+            return None
+        st = os.stat(fname)
+        if meta.get('version') != VERSION:
+            metrics.PARSE_CACHE.inc(result='miss')
+            return None
+        if (meta['size'], meta['mtime']) != (st.st_size, st.st_mtime):
+            if meta['size'] != st.st_size or \
+                    meta['sha1'] != content_hash(fname):
+                metrics.PARSE_CACHE.inc(result='stale')
+                return None
+            # same content under a new mtime
+            meta['mtime'] = st.st_mtime
+            self._write_meta(base, meta)
+        try:
+            rows = np.load(base + '.npy', mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            metrics.PARSE_CACHE.inc(result='miss')
+            return None
+        metrics.PARSE_CACHE.inc(result='hit')
+        return rows, meta
+
+    def put(self, fname, rows, meta):
+        """Store the parse of a file
+
+        :fname: source file name
+        :rows: structured array with DTYPE fields
+        :meta: JSON serialisable metadata (header, line_no, ...)
+        :returns: None
+
+        """
+        base = self._base(fname)
+        st = os.stat(fname)
+        meta = dict(meta, version=VERSION, source=os.path.abspath(fname),
+                    size=st.st_size, mtime=st.st_mtime,
+                    sha1=content_hash(fname))
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(rows, dtype=DTYPE))
+        os.rename(tmp, base + '.npy')
+        # the JSON record is written last: it is what makes an entry valid
+        self._write_meta(base, meta)
+
+    def _write_meta(self, base, meta):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f, sort_keys=True)
+        os.rename(tmp, base + '.json')
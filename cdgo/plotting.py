@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Headless rendering of CDPro fit figures.
+
+Figures are drawn from curves already parsed into memory, using the Agg
+canvas directly rather than pyplot, and independent figures are rendered
+in a process pool. Each figure is described by a picklable task
+(name, args) so the same code path serves serial and parallel rendering.
+"""
+
+import logging
+import multiprocessing
+import matplotlib
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.gridspec import GridSpec
+from matplotlib.gridspec import GridSpecFromSubplotSpec
+
+# CDGo only ever writes figures to file; the backend is fixed as soon as
+# pyplot (imported by seaborn and pandas plotting) or a backend is loaded
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: E402
+
+XLABEL = 'Wavelength (nm)'
+YLABEL = r'$\Delta\epsilon$ ($M^{-1}{\cdot}cm^{-1}$)'
+GRID_COLUMNS = 5
+
+
+def set_style():
+    """
+    Set the global style for seaborn plots
+    """
+    import seaborn as sns
+    sns.set(style="darkgrid")
+
+
+def curve_arrays(curve):
+    """Wavelength, experimental and calculated CD from a fit dataframe
+
+    :curve: dataframe indexed by wavelength from read_continll/read_cdsstr
+    :returns: tuple of numpy arrays sorted by wavelength
+
+    """
+    exp_col = 'ExpCD' if 'ExpCD' in curve.columns else 'Exptl'
+    wl = np.asarray(curve.index, dtype=float)
+    order = np.argsort(wl)
+    return (wl[order],
+            np.asarray(curve[exp_col], dtype=float)[order],
+            np.asarray(curve['CalcCD'], dtype=float)[order])
+
+
+def best_row(df, alg):
+    """Row with the lowest rmsd for an algorithm
+
+    :df: secondary structure summary dataframe indexed by ibasis
+    :alg: value of the 'alg' column to select
+    :returns: (ibasis, row) tuple
+
+    """
+    df = df.loc[df['alg'] == alg]
+    pos = int(np.argmin(df['rmsd'].values))
+    return df.index[pos], df.iloc[pos]
+
+
+def _save(fig, outfile):
+    FigureCanvasAgg(fig)
+    fig.savefig(outfile, bbox_inches='tight')
+
+
+def overlay_figure(lines, outfile):
+    """Overlay of experimental and fitted spectra on one axis
+
+    :lines: list of (fit label, exp label, wl, exp, calc) tuples
+    :outfile: output image file name
+    :returns: outfile
+
+    """
+    fig = Figure()
+    ax = fig.add_subplot(111)
+    for flab, elab, wl, exp, calc in lines:
+        ax.plot(wl, exp, '.', label=elab)
+        ax.plot(wl, calc, '-', label=flab)
+    ax.set_xlabel(XLABEL)
+    ax.set_ylabel(YLABEL)
+    ax.legend()
+    _save(fig, outfile)
+    return outfile
+
+
+def grid_figure(title, panels, outfile, ncols=GRID_COLUMNS):
+    """Grid of fits, one per ibasis, each with a residual panel below
+
+    :title: figure title
+    :panels: list of (panel title, wl, exp, calc) tuples
+    :outfile: output image file name
+    :ncols: panels per row
+    :returns: outfile
+
+    """
+    ncols = min(ncols, len(panels))
+    nrows = int(np.ceil(len(panels) / float(ncols)))
+    fig = Figure(figsize=(3.2 * ncols, 3.6 * nrows))
+    outer = GridSpec(nrows, ncols, hspace=0.35, wspace=0.3)
+    for n, (ptitle, wl, exp, calc) in enumerate(panels):
+        r, c = divmod(n, ncols)
+        inner = GridSpecFromSubplotSpec(2, 1, subplot_spec=outer[r, c],
+                                        height_ratios=[3, 1], hspace=0.05)
+        ax = fig.add_subplot(inner[0])
+        ax.plot(wl, exp, '.', markersize=3)
+        ax.plot(wl, calc, '-')
+        ax.set_title(ptitle, fontsize='small')
+        ax.tick_params(labelbottom=False)
+        res = fig.add_subplot(inner[1], sharex=ax)
+        res.axhline(0, color='grey', linewidth=0.8)
+        res.plot(wl, calc - exp, '-', linewidth=0.8)
+        if r == nrows - 1:
+            res.set_xlabel(XLABEL)
+        if c == 0:
+            ax.set_ylabel(YLABEL)
+            res.set_ylabel('resid.')
+    fig.suptitle(title)
+    _save(fig, outfile)
+    return outfile
+
+
+FIGURES = {
+    'overlay': overlay_figure,
+    'grid': grid_figure,
+}
+
+
+def _render(task):
+    name, args = task
+    return FIGURES[name](*args)
+
+
+def plot_tasks(ss_assign, curves, algorithms, prefix):
+    """Describe the figures for a run
+
+    :ss_assign: secondary structure summary dataframe indexed by ibasis
+    :curves: dict of (algorithm, ibasis) to fit dataframe
+    :algorithms: list of algorithm names in plotting order; those without
+                 any successful fit are skipped
+    :prefix: output file name prefix
+    :returns: list of (name, args) tasks for render
+
+    """
+    fitted = [a for a in algorithms if (ss_assign['alg'] == a).any()]
+    for alg in algorithms:
+        if alg not in fitted:
+            logging.warning('No successful {} fits to plot'.format(alg))
+    tasks = []
+    lines = []
+    for alg in fitted:
+        ibasis, top = best_row(ss_assign, alg)
+        logging.info('best ibasis for {a}: {i}'.format(a=alg, i=ibasis))
+        flab = '{alg} ibasis {ib} (RMSD: {rmsd})'.format(
+            alg=alg, ib=ibasis, rmsd=top['rmsd'])
+        elab = '{} exp'.format(alg)
+        lines.append((flab, elab) + curve_arrays(curves[(alg, ibasis)]))
+    if lines:
+        tasks.append(('overlay', (lines, '{}-Overlay.png'.format(prefix))))
+
+    for alg in fitted:
+        panels = []
+        rows = ss_assign.loc[ss_assign['alg'] == alg]
+        for ibasis, row in rows.iterrows():
+            ptitle = 'ibasis {i} {db} (RMSD: {r})'.format(
+                i=ibasis, db=row['ibasis'], r=row['rmsd'])
+            panels.append((ptitle,) + curve_arrays(curves[(alg, ibasis)]))
+        tasks.append(('grid', (alg, panels,
+                               '{}-{}-Grid.png'.format(prefix, alg))))
+    return tasks
+
+
+def render(tasks, processes=None):
+    """Render figure tasks, in parallel when worthwhile
+
+    :tasks: list of (name, args) tuples from plot_tasks
+    :processes: worker processes; None for one per CPU (capped at the number
+                of tasks), 1 to render serially
+    :returns: list of output file names
+
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(tasks))
+    if processes <= 1:
+        return [_render(t) for t in tasks]
+    pool = multiprocessing.Pool(processes, initializer=set_style)
+    try:
+        return pool.map(_render, tasks)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replicate averaging, smoothing and resampling of raw CD spectra.
+
+Replicate scans, from separate files or from the scan blocks of one
+multi-scan file, are aligned on their common wavelength grid and averaged
+into a single spectrum with a per-point standard error. The averaged (blank
+subtracted) signal may then be smoothed with a Savitzky-Golay filter, and
+is finally resampled onto the 1 nm grid CDPro expects. Every step operates
+on whole arrays, and resampling accepts a stack of spectra at once.
+"""
+
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+import vendors
+
+# wavelengths are matched after rounding to this many decimals, so scans
+# exported with floating point jitter still align
+DECIMALS = 2
+
+# wavelength limits (nm) accepted by CDPro
+CDPRO_LIMITS = (178, 260)
+
+RESAMPLE_METHODS = ['interp', 'bin']
+
+
+def read_replicates(fnames):
+    """Every scan of every file, in order
+
+    :fnames: list of spectrum files in any format vendors.detect knows
+    :returns: list of dataframes indexed by wavelength with CD_Signal and
+              CD_Dynode columns
+    :raises: ValueError for a file in no known format
+
+    """
+    frames = []
+    for f in fnames:
+        for scan in vendors.read(f)[1]:
+            frames.append(scan.data)
+    return frames
+
+
+def align(frames, column='CD_Signal'):
+    """Stack one column of several spectra on their common wavelengths
+
+    :frames: list of dataframes indexed by wavelength
+    :column: column to stack
+    :returns: (wavelengths sorted long to short, (n, m) array)
+
+    """
+    index = [np.round(np.asarray(f.index, dtype=float), DECIMALS)
+             for f in frames]
+    common = index[0]
+    for ix in index[1:]:
+        common = np.intersect1d(common, ix)
+    common = np.sort(common)[::-1]
+    stack = np.empty((len(frames), common.size))
+    for i, (f, ix) in enumerate(zip(frames, index)):
+        s = pd.Series(np.asarray(f[column], dtype=float), index=ix)
+        s = s[~s.index.duplicated()]
+        stack[i] = s.reindex(common).values
+    return common, stack
+
+
+def average(frames):
+    """Average replicate spectra point by point
+
+    :frames: list of dataframes indexed by wavelength with CD_Signal and
+             CD_Dynode columns
+    :returns: dataframe indexed by wavelength (long to short) with the mean
+              CD_Signal, its standard error CD_SEM, the highest CD_Dynode
+              of any replicate and the number of replicates n
+
+    """
+    wl, signal = align(frames, 'CD_Signal')
+    wl, dynode = align(frames, 'CD_Dynode')
+    n = signal.shape[0]
+    if n > 1:
+        sem = signal.std(axis=0, ddof=1) / np.sqrt(n)
+    else:
+        sem = np.zeros(wl.size)
+    df = pd.DataFrame({'CD_Signal': signal.mean(axis=0), 'CD_SEM': sem,
+                       'CD_Dynode': dynode.max(axis=0), 'n': n},
+                      index=pd.Index(wl, name='X'),
+                      columns=['CD_Signal', 'CD_SEM', 'CD_Dynode', 'n'])
+    if len(df) < max(len(f) for f in frames):
+        logging.info('Replicates share {c} of up to {m} wavelengths'.format(
+            c=len(df), m=max(len(f) for f in frames)))
+    return df
+
+
+def subtract(sample, buffer):
+    """Blank subtract averaged spectra, combining their standard errors
+
+    :sample: dataframe from average
+    :buffer: dataframe from average, or None
+    :returns: dataframe with CD_Signal and CD_SEM
+
+    """
+    if buffer is None:
+        return sample[['CD_Signal', 'CD_SEM']]
+    s = sample[['CD_Signal', 'CD_SEM']]
+    b = buffer[['CD_Signal', 'CD_SEM']].reindex(s.index)
+    out = pd.DataFrame({'CD_Signal': s['CD_Signal'] - b['CD_Signal'],
+                        'CD_SEM': np.sqrt(s['CD_SEM'] ** 2 +
+                                          b['CD_SEM'] ** 2)},
+                       columns=['CD_Signal', 'CD_SEM'])
+    return out.dropna()
+
+
+def savgol_coeffs(window, order):
+    """Savitzky-Golay smoothing coefficients
+
+    :window: odd window length in points
+    :order: polynomial order, less than window
+    :returns: array of window weights
+
+    """
+    half = window // 2
+    x = np.arange(-half, half + 1, dtype=float)
+    A = np.vander(x, order + 1, increasing=True)
+    # row of the pseudo-inverse giving the fitted value at the centre
+    return np.linalg.pinv(A)[0]
+
+
+def savgol(y, window, order=2):
+    """Savitzky-Golay smooth along the last axis
+
+    Interior points use the convolution coefficients; the half windows at
+    each end are taken from a polynomial fitted to the first and last full
+    window.
+
+    :y: 1D array, or 2D array of spectra in rows, on an even grid
+    :window: odd window length in points
+    :order: polynomial order
+    :returns: array shaped like y
+
+    """
+    y = np.asarray(y, dtype=float)
+    if window % 2 == 0 or window <= order:
+        raise ValueError('window must be odd and larger than order')
+    m = y.shape[-1]
+    if m < window:
+        raise ValueError('spectrum has fewer points than the window')
+    half = window // 2
+    coeffs = savgol_coeffs(window, order)
+    strides = y.strides[:-1] + (y.strides[-1], y.strides[-1])
+    windows = np.lib.stride_tricks.as_strided(
+        y, shape=y.shape[:-1] + (m - window + 1, window), strides=strides)
+    out = np.empty_like(y)
+    out[..., half:m - half] = windows.dot(coeffs)
+
+    x = np.arange(window, dtype=float)
+    A = np.vander(x, order + 1, increasing=True)
+    fit = A.dot(np.linalg.pinv(A))
+    out[..., :half] = y[..., :window].dot(fit.T)[..., :half]
+    out[..., m - half:] = y[..., m - window:].dot(fit.T)[..., window - half:]
+    return out
+
+
+def parse_smooth(string):
+    """argparse type for a Savitzky-Golay window, e.g. '7' or '9:3'
+
+    :string: window[:order]
+    :returns: (window, order)
+
+    """
+    try:
+        parts = [int(x) for x in string.split(':')]
+        window, order = (parts + [2])[:2]
+        if len(parts) > 2 or window % 2 == 0 or window <= order:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'" + string + "' is not a smoothing window. Expected an odd "
+            "number of points, optionally with a polynomial order, "
+            "e.g. '7' or '9:3'.")
+    return window, order
+
+
+def smooth(df, window, order=2, column='CD_Signal'):
+    """Savitzky-Golay smooth a spectrum column
+
+    :df: dataframe indexed by wavelength, evenly spaced
+    :window: odd window length in points
+    :order: polynomial order
+    :column: column to smooth
+    :returns: copy of df with the column smoothed, or df unchanged if the
+              grid is uneven or too short
+
+    """
+    wl = np.asarray(df.index, dtype=float)
+    step = np.diff(wl)
+    if len(wl) < window or not np.allclose(step, step[0], atol=1e-3):
+        logging.warning('Not smoothing: spectrum is shorter than the window '
+                        'or unevenly spaced')
+        return df
+    df = df.copy()
+    df[column] = savgol(df[column].values, window, order)
+    return df
+
+
+def integer_grid(wl, limits=CDPRO_LIMITS):
+    """Integer wavelengths covered by a scan, within the CDPro limits
+
+    :wl: array of wavelengths
+    :limits: (shortest, longest) wavelength allowed
+    :returns: ascending array of floats
+
+    """
+    lo = max(np.ceil(np.min(wl) - 1e-6), limits[0])
+    hi = min(np.floor(np.max(wl) + 1e-6), limits[1])
+    return np.arange(lo, hi + 1)
+
+
+def check_grid(wl, min_points=2):
+    """Validate wavelengths for resampling
+
+    :wl: array of wavelengths in scan order
+    :min_points: fewest points accepted
+    :returns: ascending copy of wl and the permutation that sorts it
+    :raises: ValueError describing the problem
+
+    """
+    wl = np.asarray(wl, dtype=float)
+    if wl.size < min_points:
+        raise ValueError('only {} usable data points'.format(wl.size))
+    if not np.all(np.isfinite(wl)):
+        raise ValueError('non-numeric wavelengths')
+    step = np.diff(wl)
+    if not (np.all(step > 0) or np.all(step < 0)):
+        raise ValueError('wavelengths are not strictly increasing or '
+                         'decreasing (repeated scans in one block?)')
+    order = np.argsort(wl)
+    return wl[order], order
+
+
+def resample(wl, y, grid=None, method='interp', max_gap=2.0):
+    """Resample spectra onto a wavelength grid
+
+    Linear interpolation reproduces points already on the grid exactly;
+    binning averages every point within half a nanometre of each grid
+    point, points exactly half way counting half in both neighbouring bins
+    (falling back to interpolation for empty bins). Grid points outside the
+    scan or inside a gap wider than max_gap are NaN.
+
+    :wl: wavelengths of y, strictly monotonic
+    :y: 1D spectrum, or 2D array with one spectrum per row
+    :grid: target wavelengths; defaults to integer_grid(wl)
+    :method: 'interp' or 'bin'
+    :max_gap: widest gap between measured points (nm) to interpolate over
+    :returns: (ascending grid, resampled array shaped like y)
+
+    """
+    wl, order = check_grid(wl)
+    y = np.asarray(y, dtype=float)[..., order]
+    grid = integer_grid(wl) if grid is None else np.sort(grid)
+
+    idx = np.clip(np.searchsorted(wl, grid, side='right'), 1, wl.size - 1)
+    left, right = wl[idx - 1], wl[idx]
+    w = (grid - left) / (right - left)
+    out = y[..., idx - 1] * (1 - w) + y[..., idx] * w
+    if method == 'bin':
+        # a point half way between two grid points counts half in each
+        d = wl - grid[0]
+        half = np.abs(d - np.floor(d) - 0.5) < 1e-6
+        weights = np.zeros((wl.size, grid.size))
+        for bins, weight in [(np.floor(d + 0.5), np.where(half, .5, 1.)),
+                             (np.floor(d), np.where(half, .5, 0.))]:
+            bins = bins.astype(int)
+            inside = (bins >= 0) & (bins < grid.size) & (weight > 0)
+            weights[np.nonzero(inside)[0], bins[inside]] += weight[inside]
+        counts = weights.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            binned = y.dot(weights) / counts
+        out = np.where(counts > 0, binned, out)
+    elif method != 'interp':
+        raise ValueError('unknown resampling method {}'.format(method))
+
+    # points measured exactly on the grid are kept whatever their neighbours
+    exact = (np.abs(grid - left) < 1e-6) | (np.abs(grid - right) < 1e-6)
+    bad = (grid < wl[0] - 1e-6) | (grid > wl[-1] + 1e-6) | \
+        ((right - left > max_gap + 1e-6) & ~exact)
+    out[..., bad] = np.nan
+    return grid, out
+
+
+def to_grid(df, column='CD_Signal', method='interp'):
+    """Resample one spectrum column onto the CDPro grid
+
+    :df: dataframe indexed by wavelength (numbers or numeric strings)
+    :column: column to resample
+    :method: 'interp' or 'bin'
+    :returns: series indexed by integer wavelength, long to short, on a
+              contiguous 1 nm grid as CDPro input requires
+    :raises: ValueError if the spectrum cannot be resampled or has a gap
+             wider than resample's max_gap
+
+    """
+    grid, y = resample(np.asarray(df.index, dtype=float),
+                       df[column].values, method=method)
+    valid = np.nonzero(np.isfinite(y))[0]
+    if len(valid) < 2:
+        raise ValueError('no data within the CDPro limits of {}-{} '
+                         'nm'.format(*CDPRO_LIMITS))
+    # only the ends may be trimmed: CDPro reads values as a contiguous grid
+    s = pd.Series(y, index=grid).iloc[valid[0]:valid[-1] + 1]
+    missing = s.index[s.isnull().values]
+    if len(missing):
+        raise ValueError('gap in the spectrum between {lo:g} and {hi:g} '
+                         'nm'.format(lo=missing.min() - 1,
+                                     hi=missing.max() + 1))
+    return s.sort_index(ascending=False)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing, resource accounting and profiling for CDGo runs.
+
+Pipeline code wraps each stage in `stage(name, **tags)`. Every stage
+produces a record holding wall and CPU time (for CDGo itself and for child
+processes such as wine), bytes read and written, and the peak resident
+memory seen so far. Records are collected by the active `RunReport` and
+passed to any callbacks registered with `add_hook`, so an embedding
+application can gather the same metrics without parsing the JSON report.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+import functools
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import tracemalloc
+except ImportError:  # python < 3.4
+    tracemalloc = None
+
+_hooks = []
+_local = threading.local()
+_active = None
+
+
+def _stack():
+    # stages nest per thread, so fits run from a thread pool get their own
+    # stack of parent stages
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def add_hook(func):
+    """Register a callback for stage events
+
+    :func: callable taking (event, record) where event is 'start' or 'end'
+           and record is the stage dictionary
+    :returns: func, so this can be used as a decorator
+
+    """
+    _hooks.append(func)
+    return func
+
+
+def remove_hook(func):
+    """Unregister a callback added with add_hook
+
+    :func: previously registered callable
+    :returns: None
+
+    """
+    if func in _hooks:
+        _hooks.remove(func)
+
+
+def _fire(event, record):
+    for func in list(_hooks):
+        try:
+            func(event, record)
+        except Exception:
+            logging.exception('Profiling hook %r failed', func)
+
+
+def max_rss(who=resource.RUSAGE_SELF):
+    """Peak resident set size in bytes
+
+    :who: resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN
+    :returns: int
+
+    """
+    rss = resource.getrusage(who).ru_maxrss
+    # linux reports kilobytes, OSX bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def file_size(fname):
+    """Size of fname in bytes, or 0 if it does not exist
+
+    :fname: file name
+    :returns: int
+
+    """
+    try:
+        return os.path.getsize(fname)
+    except (OSError, TypeError):
+        return 0
+
+
+@contextmanager
+def stage(name, **tags):
+    """Time a pipeline stage
+
+    The yielded record may be updated inside the block, e.g. to add
+    'bytes_read' or 'bytes_written'.
+
+    :name: stage name
+    :tags: extra fields stored with the record (e.g. ibasis, algorithm)
+    :returns: context manager yielding the stage record
+
+    """
+    stack = _stack()
+    record = {
+        'stage': name,
+        'parent': stack[-1]['stage'] if stack else None,
+        'bytes_read': 0,
+        'bytes_written': 0,
+    }
+    record.update(tags)
+    _fire('start', record)
+    stack.append(record)
+    t0 = time.time()
+    c0 = os.times()
+    try:
+        yield record
+    finally:
+        c1 = os.times()
+        stack.pop()
+        record['start'] = t0
+        record['wall'] = time.time() - t0
+        record['cpu'] = (c1[0] - c0[0]) + (c1[1] - c0[1])
+        record['children_cpu'] = (c1[2] - c0[2]) + (c1[3] - c0[3])
+        record['max_rss'] = max_rss()
+        if _active is not None:
+            _active.add(record)
+        _fire('end', record)
+
+
+def timed(name, path_arg=None):
+    """Decorator running the wrapped function inside stage(name)
+
+    :name: stage name
+    :path_arg: optional positional index of a file name argument whose size
+               is recorded as bytes_read
+    :returns: decorator
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                if path_arg is not None and len(args) > path_arg:
+                    record['file'] = args[path_arg]
+                    record['bytes_read'] = file_size(args[path_arg])
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RunReport(object):
+    """Collects stage records for a single CDGo run"""
+
+    def __init__(self, **meta):
+        self.meta = meta
+        self.records = []
+        self.created = datetime.now()
+        self._t0 = time.time()
+        self._c0 = os.times()
+
+    def add(self, record):
+        self.records.append(record)
+
+    def summary(self):
+        """Aggregate records by stage name
+
+        :returns: dict of stage name to totals
+
+        """
+        out = {}
+        for r in self.records:
+            s = out.setdefault(r['stage'], {
+                'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0,
+                'bytes_read': 0, 'bytes_written': 0})
+            s['calls'] += 1
+            for k in ('wall', 'cpu', 'children_cpu', 'bytes_read',
+                      'bytes_written'):
+                s[k] += r[k]
+        return out
+
+    def to_dict(self):
+        c1 = os.times()
+        d = dict(self.meta)
+        d.update({
+            'created': self.created.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall': time.time() - self._t0,
+            'cpu': (c1[0] - self._c0[0]) + (c1[1] - self._c0[1]),
+            'children_cpu': (c1[2] - self._c0[2]) + (c1[3] - self._c0[3]),
+            'peak_rss': max_rss(),
+            'peak_rss_children': max_rss(resource.RUSAGE_CHILDREN),
+            'summary': self.summary(),
+            'stages': self.records,
+        })
+        return d
+
+    def write(self, fname):
+        """Write the report as JSON
+
+        :fname: output file name
+        :returns: None
+
+        """
+        with open(fname, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        logging.debug('Run report written to {}'.format(fname))
+
+
+def activate(report):
+    """Make report the collector for subsequent stage records
+
+    :report: RunReport instance, or None to stop collecting
+    :returns: previously active report
+
+    """
+    global _active
+    previous, _active = _active, report
+    return previous
+
+
+class Profile(object):
+    """cProfile (and tracemalloc where available) over a block of code"""
+
+    def __init__(self):
+        self.prof = cProfile.Profile()
+        self.snapshot = None
+
+    def start(self):
+        if tracemalloc is not None:
+            tracemalloc.start()
+        self.prof.enable()
+
+    def stop(self):
+        self.prof.disable()
+        if tracemalloc is not None:
+            self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+    def dump(self, out_dir, limit=50):
+        """Write profiler output into out_dir
+
+        cdgo.prof can be inspected with pstats or snakeviz.
+
+        :out_dir: output directory
+        :limit: number of allocation sites written from tracemalloc
+        :returns: None
+
+        """
+        self.prof.dump_stats(os.path.join(out_dir, 'cdgo.prof'))
+        if self.snapshot is None:
+            logging.debug('tracemalloc unavailable; skipping memory dump')
+            return
+        with open(os.path.join(out_dir, 'cdgo_tracemalloc.txt'), 'w') as f:
+            for stat in self.snapshot.statistics('lineno')[:limit]:
+                f.write('{}\n'.format(stat))
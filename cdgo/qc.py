@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Quality checks run on a spectrum before any CDPro fit.
+
+`assess` computes a handful of cheap, vectorised metrics of the blank
+subtracted signal and the detector (dynode) voltage: number of usable
+points, wavelength coverage, a robust signal-to-noise ratio and how close
+the high tension profile runs to saturation. Each metric is compared with a
+threshold; spectra failing any check are either rejected before fitting or
+fitted and flagged, and the reasons are recorded with the results.
+"""
+
+import json
+import argparse
+import numpy as np
+
+from aviv import MAX_DYNODE
+
+ACTIONS = ['reject', 'flag', 'off']
+
+# threshold name: (default, description used in the failure reason)
+THRESHOLDS = {
+    'min_points': (20, 'fewer than {} usable points'),
+    'max_low_wl': (200., 'spectrum stops above {} nm'),
+    'min_span': (30., 'wavelength range narrower than {} nm'),
+    'min_snr': (3., 'signal to noise below {}'),
+    'max_ht_fraction': (0.5, 'over {:.0%} of points near dynode saturation'),
+}
+
+# dynode voltage counted as near saturation
+HT_WARNING = 0.9 * MAX_DYNODE
+
+
+def parse_thresholds(string):
+    """argparse type for threshold overrides, e.g. 'min_snr=5,min_points=40'
+
+    :string: comma separated name=value pairs
+    :returns: dict
+
+    """
+    out = {}
+    for item in string.split(','):
+        name, sep, value = item.partition('=')
+        name = name.strip()
+        if not sep or name not in THRESHOLDS:
+            raise argparse.ArgumentTypeError(
+                "'{i}' is not a QC threshold. Known thresholds: {k}".format(
+                    i=item, k=', '.join(sorted(THRESHOLDS))))
+        try:
+            out[name] = float(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "'{}' is not a number".format(value))
+    return out
+
+
+def noise_level(y):
+    """Robust estimate of white noise from second differences
+
+    For white noise of standard deviation s, second differences have a
+    standard deviation of s * sqrt(6); the median absolute deviation keeps
+    the estimate insensitive to the (smooth) CD bands themselves.
+
+    :y: array ordered by wavelength
+    :returns: float
+
+    """
+    d2 = np.diff(y, 2)
+    if d2.size == 0:
+        return np.nan
+    return 1.4826 * np.median(np.abs(d2 - np.median(d2))) / np.sqrt(6)
+
+
+def assess(signal, dynode=None, thresholds=None):
+    """Quality metrics and verdict for one spectrum
+
+    :signal: blank subtracted CD signal (series indexed by wavelength)
+    :dynode: dynode voltage series for the same scan, if known
+    :thresholds: dict overriding THRESHOLDS defaults
+    :returns: dict of metrics plus 'passed' (bool) and 'reasons' (list)
+
+    """
+    limits = dict((k, v[0]) for k, v in THRESHOLDS.items())
+    limits.update(thresholds or {})
+
+    wl = np.asarray(signal.index, dtype=float)
+    y = np.asarray(signal, dtype=float)
+    ok = np.isfinite(wl) & np.isfinite(y)
+    wl, y = wl[ok], y[ok]
+    order = np.argsort(wl)
+    wl, y = wl[order], y[order]
+
+    m = {'points': int(wl.size)}
+    m['low_wl'] = float(wl[0]) if wl.size else np.nan
+    m['high_wl'] = float(wl[-1]) if wl.size else np.nan
+    m['span'] = m['high_wl'] - m['low_wl'] if wl.size else 0.
+    noise = noise_level(y)
+    m['noise'] = float(noise)
+    m['amplitude'] = float(np.percentile(np.abs(y), 98)) if y.size else 0.
+    m['snr'] = float(m['amplitude'] / noise) if noise > 0 else \
+        (np.inf if m['amplitude'] > 0 else 0.)
+    if dynode is not None and len(dynode):
+        hv = np.asarray(dynode, dtype=float)
+        m['ht_max'] = float(np.nanmax(hv))
+        m['ht_fraction'] = float(np.mean(hv > HT_WARNING))
+    else:
+        m['ht_max'] = None
+        m['ht_fraction'] = 0.
+
+    failed = [
+        ('min_points', m['points'] < limits['min_points']),
+        ('max_low_wl', not m['low_wl'] <= limits['max_low_wl']),
+        ('min_span', m['span'] < limits['min_span']),
+        ('min_snr', not m['snr'] >= limits['min_snr']),
+        ('max_ht_fraction', m['ht_fraction'] > limits['max_ht_fraction']),
+    ]
+    m['reasons'] = [THRESHOLDS[k][1].format(limits[k])
+                    for k, bad in failed if bad]
+    m['passed'] = not m['reasons']
+    return m
+
+
+def label(report, action):
+    """Short QC result for the summary table
+
+    :report: dict from assess
+    :action: one of ACTIONS
+    :returns: 'pass', or 'flagged: ...' / 'rejected: ...' with the reasons
+
+    """
+    if report['passed']:
+        return 'pass'
+    verb = 'rejected' if action == 'reject' else 'flagged'
+    return '{}: {}'.format(verb, '; '.join(report['reasons']))
+
+
+def write(report, fname):
+    """Write a QC report as JSON
+
+    :report: dict from assess (or a list of them)
+    :fname: output file name
+    :returns: None
+
+    """
+    def finite(v):
+        # NaN and inf are not valid JSON
+        if isinstance(v, float) and not np.isfinite(v):
+            return None
+        if isinstance(v, dict):
+            return dict((k, finite(x)) for k, x in v.items())
+        if isinstance(v, list):
+            return [finite(x) for x in v]
+        return v
+
+    with open(fname, 'w') as f:
+        json.dump(finite(report), f, indent=2, sort_keys=True)
@@ -4,6 +4,10 @@
 import re
 import numpy as np
 import pandas as pd
+import profiling
+
+# summary secondary structure fractions, in the order they are reported
+FRACTIONS = ['ahelix', 'bstrand', 'turn', 'unord']
 
 
 def format_val(v):
@@ -16,6 +20,22 @@ def format_val(v):
     return '{:.1f}%'.format(v)
 
 
+def parse_percent(v):
+    """Fraction formatted by format_val back to a float
+
+    :v: str such as '38.4%' (bytes, as read from HDF5 attributes, are
+        decoded), or a number
+    :returns: float
+
+    """
+    try:
+        return float(v)
+    except ValueError:
+        if isinstance(v, bytes) and not isinstance(v, str):
+            v = v.decode('utf-8')
+        return float(v.rstrip('%'))
+
+
 def split_string(s):
     """Docstring for split_string.
 
@@ -41,21 +61,23 @@ def dec_to_percent(n):
 
 def header():
     """Set column headers for reading in CDPro algorithm output files
-    :returns: python dict of continll/cdsstr headers
+    :returns: python dict of continll/cdsstr/selcon3 headers
 
     """
     d = {
         'continll': ['WaveL', 'ExpCD', 'CalcCD'],
-        'cdsstr': ['WaveL', 'Exptl', 'ReconCD', 'CalcCD']
+        'cdsstr': ['WaveL', 'Exptl', 'ReconCD', 'CalcCD'],
+        'selcon3': ['WaveL', 'ExpCD', 'CalcCD']
     }
 
     return d
 
 
+@profiling.timed('read_protss', path_arg=0)
 def read_protss(f):
     """TODO: Docstring for read_protss_new.
 
-    :f: protss assignment file output by CONTINLL or CDSSTR
+    :f: protss assignment file output by CONTINLL, CDSSTR or SELCON3
     :returns: pandas dataframe
 
     """
@@ -147,6 +169,7 @@ def read_protss(f):
     return dname, d_int, ss
 
 
+@profiling.timed('read_continll', path_arg=0)
 def read_continll(f):
     """TODO: Docstring for read_continll.
 
@@ -158,6 +181,7 @@ def read_continll(f):
     return df
 
 
+@profiling.timed('read_cdsstr', path_arg=0)
 def read_cdsstr(f):
     """TODO: Docstring for read_continll.
 
@@ -167,3 +191,15 @@ def read_cdsstr(f):
     """
     df = pd.read_csv(f, sep=r"\s*", engine='python', index_col='WaveL')
     return df
+
+
+@profiling.timed('read_selcon3', path_arg=0)
+def read_selcon3(f):
+    """Read the fitted spectrum written by SELCON3 (CalcCD.OUT)
+
+    :f: file name
+    :returns: pandas dataframe
+
+    """
+    df = pd.read_csv(f, sep=r"\s*", engine='python', index_col='WaveL')
+    return df
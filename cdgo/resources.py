@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Resource limits and adaptive concurrency for CDPro processes.
+
+A `Scheduler` hands out worker slots to the wine processes of a Runner.
+Each slot can be pinned to a CPU of a given list, and every process can be
+started at a lower priority (nice) and with a ceiling on its data segment.
+When a load average or free memory threshold is set, the number of slots
+in use is adapted to the host: concurrency is halved whenever the 1 minute
+load average rises above the threshold or available memory falls below
+it, and grows by one slot at a time while the host stays well below both.
+The host is sampled at most once per interval, and every change of
+concurrency is logged with its reason.
+"""
+
+import os
+import time
+import pipes
+import logging
+import argparse
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from distutils.spawn import find_executable
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+import metrics
+
+# seconds between samples of the load average and free memory
+INTERVAL = 5.
+# concurrency grows only while load and memory are within this fraction of
+# their thresholds
+IDLE = 0.75
+
+MEMINFO = '/proc/meminfo'
+
+
+def parse_cpus(string):
+    """argparse type for a CPU list, e.g. '0-3,6'
+
+    :string: comma separated CPU numbers and ranges
+    :returns: sorted list of int
+
+    """
+    cpus = set()
+    try:
+        for item in string.split(','):
+            first, sep, last = item.strip().partition('-')
+            cpus.update(range(int(first), int(last if sep else first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'{}' is not a CPU list, e.g. '0-3,6'".format(string))
+    if not cpus or min(cpus) < 0:
+        raise argparse.ArgumentTypeError(
+            "'{}' is not a CPU list, e.g. '0-3,6'".format(string))
+    return sorted(cpus)
+
+
+def load_average():
+    """1 minute load average of the host
+
+    :returns: float, or None where unavailable
+
+    """
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def available_memory(meminfo=MEMINFO):
+    """Memory available to new processes
+
+    :meminfo: /proc/meminfo or a file in its format
+    :returns: megabytes, or None where unavailable
+
+    """
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024.
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * \
+            os.sysconf('SC_PAGE_SIZE') / 2. ** 20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def host_state():
+    """Load average and available memory of the host
+
+    :returns: (load, megabytes); either may be None
+
+    """
+    return load_average(), available_memory()
+
+
+class Scheduler(object):
+    """Worker slots, limits and concurrency of CDPro processes"""
+
+    def __init__(self, workers, cpus=None, memory=None, nice=None,
+                 max_load=None, min_free=None, interval=INTERVAL,
+                 probe=host_state):
+        """
+        :workers: largest number of processes run at once
+        :cpus: list of CPUs; slot k is pinned to cpus[k % len(cpus)]
+        :memory: data segment ceiling per process (megabytes)
+        :nice: niceness added to every process
+        :max_load: back off while the 1 minute load average is above this
+        :min_free: back off while available memory (megabytes) is below
+                   this
+        :interval: seconds between samples of the host
+        :probe: function returning (load, megabytes), e.g. host_state
+        """
+        self.workers = max(1, workers or 1)
+        if cpus:
+            missing = [c for c in cpus if c >= multiprocessing.cpu_count()]
+            if missing:
+                logging.warning('CPUs {} do not exist and are not '
+                                'used'.format(missing))
+            cpus = [c for c in cpus if c not in missing]
+        self.cpus = cpus
+        self.memory = memory
+        self.nice = nice
+        self.max_load = max_load
+        self.min_free = min_free
+        self.interval = interval
+        self.probe = probe
+        self.limit = self.workers
+        self.running = 0
+        # (time, old limit, new limit, reason) of every change
+        self.decisions = []
+        self._slots = list(range(self.workers))
+        self._sampled = None
+        self._cond = threading.Condition()
+        self._taskset = None
+        if cpus and not hasattr(os, 'sched_setaffinity'):
+            self._taskset = find_executable('taskset')
+            if self._taskset is None:
+                logging.warning('CPU pinning needs taskset, which was not '
+                                'found; processes are not pinned')
+        metrics.WORKER_LIMIT.set(self.limit)
+
+    @property
+    def adaptive(self):
+        return self.max_load is not None or self.min_free is not None
+
+    def adjust(self, now=None):
+        """Sample the host, if due, and adapt the concurrency limit
+
+        :now: current time; default time.time()
+        :returns: concurrency limit
+
+        """
+        now = time.time() if now is None else now
+        if not self.adaptive or (self._sampled is not None and
+                                 now - self._sampled < self.interval):
+            return self.limit
+        self._sampled = now
+        load, free = self.probe()
+        busy = []
+        idle = True
+        if self.max_load is not None and load is not None:
+            if load > self.max_load:
+                busy.append('load {l:.2f} > {m}'.format(l=load,
+                                                        m=self.max_load))
+            idle &= load <= IDLE * self.max_load
+        if self.min_free is not None and free is not None:
+            if free < self.min_free:
+                busy.append('free memory {f:.0f} MB < {m} MB'.format(
+                    f=free, m=self.min_free))
+            idle &= free >= self.min_free / IDLE
+        if busy:
+            self._set(max(1, self.limit // 2), ', '.join(busy), now)
+        elif idle and self.limit < self.workers:
+            self._set(self.limit + 1, 'idle (load {l}, free memory {f} '
+                      'MB)'.format(l=_fmt(load), f=_fmt(free, '.0f')), now)
+        return self.limit
+
+    def _set(self, limit, reason, now):
+        if limit == self.limit:
+            return
+        logging.info('Concurrency {o} -> {n}: {r}'.format(o=self.limit,
+                                                          n=limit, r=reason))
+        self.decisions.append((now, self.limit, limit, reason))
+        self.limit = limit
+        metrics.WORKER_LIMIT.set(limit)
+
+    @contextmanager
+    def slot(self):
+        """Wait for a free slot within the concurrency limit
+
+        :returns: context manager yielding the slot number
+
+        """
+        with self._cond:
+            while self.running >= self.adjust() or not self._slots:
+                self._cond.wait(self.interval)
+            slot = self._slots.pop(0)
+            self.running += 1
+        try:
+            yield slot
+        finally:
+            with self._cond:
+                self._slots.append(slot)
+                self._slots.sort()
+                self.running -= 1
+                self._cond.notify_all()
+
+    def slot_cpus(self, slot):
+        """CPUs a slot is pinned to
+
+        :slot: slot number
+        :returns: list of int, or None if processes are not pinned
+
+        """
+        if not self.cpus:
+            return None
+        return [self.cpus[slot % len(self.cpus)]]
+
+    def command(self, cmd, slot):
+        """Shell command of a process in a slot
+
+        Pinning falls back to taskset where the process cannot pin itself.
+
+        :cmd: shell command
+        :slot: slot number
+        :returns: shell command
+
+        """
+        cpus = self.slot_cpus(slot)
+        if cpus is None or self._taskset is None:
+            return cmd
+        return '{t} -c {c} sh -c {q}'.format(
+            t=self._taskset, c=','.join(str(c) for c in cpus),
+            q=pipes.quote(cmd))
+
+    def preexec(self, slot):
+        """Function applying the limits of a slot in a new process
+
+        :slot: slot number
+        :returns: function for subprocess.Popen's preexec_fn, or None
+
+        """
+        cpus = self.slot_cpus(slot)
+        if not (self.nice or self.memory or
+                (cpus and hasattr(os, 'sched_setaffinity'))):
+            return None
+
+        def setup():
+            if self.nice:
+                os.nice(self.nice)
+            if self.memory and resource is not None:
+                ceiling = int(self.memory * 2 ** 20)
+                resource.setrlimit(resource.RLIMIT_DATA, (ceiling, ceiling))
+            if cpus and hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cpus)
+        return setup
+
+
+def _fmt(value, spec='.2f'):
+    return 'n/a' if value is None else format(value, spec)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process self-consistent (SELCON-style) secondary structure solver.
+
+The unknown spectrum y is appended to the (m, n) matrix A of reference
+protein spectra and a guess g of its fractions to the (k, n) matrix F of
+reference fractions. With the singular value decomposition of [A | y]
+truncated to r components, the fractions are re-estimated as
+
+    g' = [F | g] V_r S_r^-1 U_r^T y
+
+and g' replaces the guess until the estimate no longer changes. The first
+guess is the fractions of the closest reference protein. Solutions for
+every number of components r are kept if they satisfy the selection rules
+(fractions summing to 1 +/- 0.05, none below -0.025, reconstructed
+spectrum within 0.25 delta epsilon RMSD of y); the rules are relaxed in
+turn when no solution passes, and the passing solutions are averaged.
+This follows SELCON3 without its reference set reduction and helix rule.
+
+The augmented matrix does not change between iterations, so each spectrum
+is decomposed once. The basis restricted to the wavelength window of the
+input and its class spectra are kept in a factorcache.FactorCache.
+Decompositions, the iteration and the selection run on
+stacked arrays, so many spectra (or bootstrap replicates) against the same
+basis converge together.
+"""
+
+import numpy as np
+
+import factorcache
+from readers import FRACTIONS
+from readers import format_val
+
+# summary fraction of each structure class label, grouped as in read_protss
+CLASSES = {
+    'H(r)': 'ahelix', 'H(d)': 'ahelix', 'H': 'ahelix', '3/10': 'ahelix',
+    'S(r)': 'bstrand', 'S(d)': 'bstrand', 'S': 'bstrand',
+    'Trn': 'turn', 'Turn': 'turn',
+    'PP2': 'unord', 'Unrd': 'unord',
+}
+
+# convergence of the self-consistent iteration
+TOL = 1e-4
+MAX_ITER = 100
+# singular values below RCOND times the largest are not used
+RCOND = 1e-6
+
+# selection rules
+SUM_TOL = 0.05
+MIN_FRACTION = -0.025
+MAX_RMSD = 0.25
+
+# fewest wavelengths shared by spectrum and basis
+MIN_POINTS = 10
+
+
+def class_matrix(labels):
+    """Matrix summing structure classes into the four summary fractions
+
+    :labels: structure class labels of a basis
+    :returns: (4, k) array
+    :raises: ValueError for a label with no summary fraction
+
+    """
+    M = np.zeros((len(FRACTIONS), len(labels)))
+    for j, label in enumerate(labels):
+        if label not in CLASSES:
+            raise ValueError('Unknown structure class {}'.format(label))
+        M[FRACTIONS.index(CLASSES[label]), j] = 1.
+    return M
+
+
+def restrict(basis, wavelengths):
+    """Restrict a basis to the wavelengths it shares with spectra
+
+    :basis: basis.Basis
+    :wavelengths: (m,) wavelengths of the spectra
+    :returns: (wavelengths long to short, their (m',) indices in
+              wavelengths, (m', n) reference spectra)
+    :raises: ValueError if fewer than MIN_POINTS wavelengths are shared
+
+    """
+    bw = np.round(np.asarray(basis.wavelengths, dtype=float), 2)
+    w = np.round(np.asarray(wavelengths, dtype=float), 2)
+    common = np.intersect1d(bw, w)[::-1]
+    if common.size < MIN_POINTS:
+        raise ValueError('spectrum and {r} share only {n} wavelengths'.format(
+            r=basis.refset, n=common.size))
+    ib = [np.nonzero(bw == x)[0][0] for x in common]
+    return common, positions(common, w), np.asarray(basis.spectra,
+                                                    dtype=float)[ib]
+
+
+def positions(common, wavelengths):
+    """Indices of wavelengths in the grid of some spectra
+
+    :common: wavelengths to look up
+    :wavelengths: (m,) wavelengths of the spectra, in any order
+    :returns: array of indices into wavelengths
+
+    """
+    w = np.round(np.asarray(wavelengths, dtype=float), 2)
+    return np.array([np.nonzero(w == x)[0][0] for x in common])
+
+
+def prepare(basis, wavelengths, cache=None):
+    """Basis restricted to a wavelength window, with its class spectra
+
+    :basis: basis.Basis
+    :wavelengths: (m,) wavelengths of the spectra
+    :cache: factorcache.FactorCache, or None
+    :returns: (wavelengths long to short, their indices in wavelengths,
+              (m', n) reference spectra, (k, n) reference fractions,
+              (m', k) class spectra)
+    :raises: ValueError if fewer than MIN_POINTS wavelengths are shared
+
+    """
+    def compute():
+        common, _, A = restrict(basis, wavelengths)
+        F = np.asarray(basis.fractions, dtype=float)
+        return common, A, F, class_spectra(A, F)
+    # the cached window is order independent; the indices are not
+    common, A, F, P = factorcache.lookup(
+        cache, factorcache.make_key('selcon', basis, wavelengths), compute)
+    return common, positions(common, wavelengths), A, F, P
+
+
+def initial_guess(A, F, Y):
+    """Fractions of the reference protein closest to each spectrum
+
+    :A: (m, n) reference spectra
+    :F: (k, n) reference fractions
+    :Y: (b, m) spectra
+    :returns: (b, k) array
+
+    """
+    d2 = (Y * Y).sum(axis=1)[:, None] + (A * A).sum(axis=0)[None, :] - \
+        2. * Y.dot(A)
+    return F[:, np.argmin(d2, axis=1)].T
+
+
+def solve(A, F, Y, ranks=None, tol=TOL, max_iter=MAX_ITER, rcond=RCOND):
+    """Self-consistent fractions of spectra for each number of components
+
+    :A: (m, n) reference spectra
+    :F: (k, n) reference fractions
+    :Y: (b, m) spectra
+    :ranks: numbers of singular values to try; default 2 up to all
+    :tol: largest change of any fraction at convergence
+    :max_iter: iterations before giving up
+    :rcond: relative cutoff for small singular values
+    :returns: ((b, r, k) fractions, (b, r) boolean of converged solutions
+              using only significant singular values, ranks)
+
+    """
+    b, m = Y.shape
+    n = A.shape[1]
+    aug = np.empty((b, m, n + 1))
+    aug[:, :, :n] = A
+    aug[:, :, n] = Y
+    U, s, Vt = np.linalg.svd(aug, full_matrices=False)
+    p = s.shape[1]
+    if ranks is None:
+        ranks = np.arange(2, p + 1)
+    ranks = np.asarray([r for r in ranks if 1 <= r <= p])
+    significant = s > rcond * s[:, :1]
+    inv = np.where(significant, 1. / np.where(significant, s, 1.), 0.)
+    # W[:, r - 1] = V_r S_r^-1 U_r^T y, for every r at once
+    coef = np.einsum('bmp,bm->bp', U, Y) * inv
+    W = np.cumsum(Vt * coef[:, :, None], axis=1)[:, ranks - 1]
+    # g' = F w + g w_y, w_y being the weight of the spectrum's own column.
+    # With w_y near 1 the spectrum is its own component and any guess is
+    # self-consistent, so those solutions are not used.
+    fixed = np.einsum('kn,brn->brk', F, W[:, :, :n])
+    own = W[:, :, n:]
+    usable = significant[:, ranks - 1] & (np.abs(1. - own[:, :, 0]) > 1e-3)
+    g = np.repeat(initial_guess(A, F, Y)[:, None, :], len(ranks), axis=1)
+    converged = np.zeros(g.shape[:2], dtype=bool)
+    with np.errstate(over='ignore', invalid='ignore'):
+        for _ in range(max_iter):
+            new = fixed + own * g
+            step = np.abs(new - g).max(axis=2)
+            g = np.where(converged[:, :, None], g, new)
+            converged |= step < tol
+            if converged.all():
+                break
+    ok = converged & usable & np.isfinite(g).all(axis=2)
+    return g, ok, ranks
+
+
+def class_spectra(A, F):
+    """Spectrum of each structure class, by least squares over the basis
+
+    :A: (m, n) reference spectra
+    :F: (k, n) reference fractions
+    :returns: (m, k) array
+
+    """
+    return A.dot(np.linalg.pinv(F))
+
+
+def select(G, ok, P, Y, max_rmsd=MAX_RMSD):
+    """Average the solutions passing the selection rules
+
+    Rules are relaxed in turn for spectra with no passing solution: first
+    the spectral rule is dropped, then the sum and fraction rules instead,
+    and finally the converged solution closest to the spectrum is used.
+
+    :G: (b, r, k) fractions from solve
+    :ok: (b, r) converged solutions from solve
+    :P: (m, k) class spectra
+    :Y: (b, m) spectra
+    :max_rmsd: spectral rule (delta epsilon)
+    :returns: ((b, k) fractions, (b,) number of solutions averaged); spectra
+              without any converged solution get NaN fractions
+
+    """
+    # diverged solutions are excluded by ok
+    G = np.where(ok[:, :, None], G, 0.)
+    calc = np.einsum('mk,brk->brm', P, G)
+    rmsd = np.sqrt(((calc - Y[:, None, :]) ** 2).mean(axis=2))
+    rules = ok & (np.abs(G.sum(axis=2) - 1.) <= SUM_TOL) & \
+        (G.min(axis=2) >= MIN_FRACTION)
+    spectral = ok & (rmsd <= max_rmsd)
+    best = ok & (rmsd == np.where(ok, rmsd, np.inf).min(axis=1)[:, None])
+    chosen = rules & spectral
+    for relaxed in (rules, spectral, best):
+        chosen = np.where(chosen.any(axis=1)[:, None], chosen, relaxed)
+    count = chosen.sum(axis=1)
+    weights = chosen / np.maximum(count, 1)[:, None].astype(float)
+    f = np.einsum('br,brk->bk', weights, G)
+    f[count == 0] = np.nan
+    return f, count
+
+
+def fit(basis, wavelengths, Y, ranks=None, cache=None):
+    """Fit spectra against one basis
+
+    :basis: basis.Basis
+    :wavelengths: (m,) wavelengths of the spectra
+    :Y: (b, m) delta epsilon spectra
+    :ranks: numbers of singular values to try; default all
+    :cache: factorcache.FactorCache for the basis on the wavelength
+            window, or None
+    :returns: (wavelengths long to short, (b, m') spectra on them,
+              (b, k) fractions of the basis classes, (b, m') calculated
+              spectra, (b,) number of solutions averaged)
+    :raises: ValueError if the spectra and basis share too few wavelengths
+
+    """
+    wl, iy, A, F, P = prepare(basis, wavelengths, cache)
+    Yc = np.asarray(np.atleast_2d(Y), dtype=float)[:, iy]
+    G, ok, ranks = solve(A, F, Yc, ranks=ranks)
+    f, count = select(G, ok, P, Yc)
+    return wl, Yc, f, f.dot(P.T), count
+
+
+def summary(labels, f):
+    """Four summary fractions of a solution, formatted as in read_protss
+
+    :labels: structure class labels of the basis
+    :f: (k,) fractions of the basis classes
+    :returns: dict of fraction name to percentage string
+
+    """
+    four = class_matrix(labels).dot(f)
+    four = 100. * four / four.sum()
+    return dict((name, format_val(v)) for name, v in zip(FRACTIONS, four))
+
+
+def write_output(directory, basis, f, wl, y, calc, program='SELCON'):
+    """Write a solution in the layout of CDPro output
+
+    ProtSS.out is written as read by read_protss and CalcCD.out as read by
+    read_selcon3.
+
+    :directory: directory to write into; must exist
+    :basis: basis.Basis
+    :f: (k,) fractions of the basis classes
+    :wl: wavelengths long to short
+    :y: spectrum
+    :calc: calculated spectrum
+    :program: solver named in the header
+    :returns: list of file names written
+
+    """
+    protss = '{}/ProtSS.out'.format(directory)
+    with open(protss, 'w') as fp:
+        fp.write('#  CDGo native {}\n#\n#  Input: input\n#\n'.format(
+            program))
+        fp.write('   Ref. Prot. Set  {r}  (IBasis {i})\n'.format(
+            r=basis.refset, i=basis.ibasis))
+        fp.write('#            ' + '  '.join(basis.labels) + '\n')
+        fp.write('   Fractions  input  ' +
+                 '  '.join('{:.4f}'.format(x) for x in f) + '  \n')
+    curve = '{}/CalcCD.out'.format(directory)
+    with open(curve, 'w') as fp:
+        fp.write('WaveL  ExpCD  CalcCD\n')
+        for x, e, c in zip(wl, y, calc):
+            fp.write('{:.1f}  {:.3f}  {:.3f}\n'.format(x, e, c))
+    return [protss, curve]
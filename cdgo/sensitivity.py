@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sensitivity of the fitted fractions to the sample parameters.
+
+The mean residue conversion factor, and so the whole epsilon spectrum,
+scales with molecular weight / ((residues - 1) * concentration). Each point
+of a grid of relative changes to these inputs therefore corresponds to a
+single scale factor. The scaled spectra of all grid points are built as one
+array, grid points sharing a factor are fitted once, and every distinct
+spectrum is submitted to the runner in one batch so the fits share its
+workers and result cache. The report gives the fractions and RMSD at each
+grid point and how fast they change with each parameter.
+"""
+
+import argparse
+import itertools
+import logging
+import numpy as np
+import pandas as pd
+
+from cdpro import input_text
+from jobs import FitJob
+from readers import FRACTIONS
+from readers import parse_percent
+
+PARAMETERS = ['concentration', 'mol_weight', 'number_residues']
+COLUMNS = PARAMETERS + ['factor', 'ibasis', 'refset', 'alg'] + FRACTIONS + \
+    ['rmsd', 'ss_res', 'r2']
+
+
+def parse_axis(string):
+    """argparse type for one parameter of the grid
+
+    :string: e.g. 'concentration=-10,-5,5,10' (percentage changes)
+    :returns: (parameter, sorted list of changes including 0)
+
+    """
+    name, sep, values = string.partition('=')
+    try:
+        if not sep or name not in PARAMETERS:
+            raise ValueError
+        changes = sorted(set([0.] + [float(x) for x in values.split(',')
+                                     if x]))
+        if min(changes) <= -100:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'" + string + "' is not a sensitivity axis. Expected "
+            "<parameter>=<percent>,... with parameter one of " +
+            ', '.join(PARAMETERS) + ", e.g. 'concentration=-10,-5,5,10'.")
+    return name, changes
+
+
+def grid(axes, residues):
+    """Every combination of parameter changes and its scale factor
+
+    :axes: list of (parameter, changes) from parse_axis
+    :residues: nominal number of residues
+    :returns: dataframe with a column of percentage changes per parameter
+              and the factor scaling the nominal epsilon spectrum
+
+    """
+    changes = dict((p, [0.]) for p in PARAMETERS)
+    changes.update(dict(axes))
+    rows = list(itertools.product(*[changes[p] for p in PARAMETERS]))
+    df = pd.DataFrame(rows, columns=PARAMETERS)
+    conc = 1 + df['concentration'] / 100.
+    mw = 1 + df['mol_weight'] / 100.
+    bonds = (residues * (1 + df['number_residues'] / 100.) - 1) / \
+        (residues - 1.)
+    df['factor'] = (mw / (bonds * conc)).round(9)
+    return df
+
+
+def scaled(epsilon, factors):
+    """Scaled copies of an epsilon spectrum
+
+    :epsilon: epsilon series indexed by wavelength
+    :factors: array of scale factors
+    :returns: (k, m) array, one scaled spectrum per factor
+
+    """
+    e = np.asarray(epsilon, dtype=float)
+    return np.asarray(factors, dtype=float)[:, None] * e[None, :]
+
+
+def jobs(epsilon, head, factors, algorithms, ibases):
+    """FitJobs for every distinct factor, ibasis and algorithm
+
+    :epsilon: epsilon series indexed by wavelength, long to short
+    :head: CDPro input header
+    :factors: distinct scale factors
+    :algorithms: list of algorithm names
+    :ibases: list of ibasis integers
+    :returns: list of FitJob tagged with their factor
+
+    """
+    spectra = scaled(epsilon, factors)
+    out = []
+    for factor, values in zip(factors, spectra):
+        eps = pd.Series(values, index=epsilon.index).map(
+            lambda x: '%1.3f' % x)
+        for ibasis in ibases:
+            for alg in algorithms:
+                out.append(FitJob(alg, ibasis, input_text(eps, head, ibasis),
+                                  tag=factor))
+    return out
+
+
+def slopes(df):
+    """Response of each fraction and the RMSD to each parameter
+
+    Slopes are fitted by least squares over the grid points where only
+    that parameter changes, and averaged over ibases.
+
+    :df: dataframe as returned by run
+    :returns: dataframe indexed by (parameter, alg) with the change of each
+              fraction (percentage points) and of the rmsd per 1% change
+
+    """
+    d = df.copy()
+    for frac in FRACTIONS:
+        d[frac] = d[frac].map(parse_percent)
+    cols = FRACTIONS + ['rmsd']
+    out = []
+    for p in PARAMETERS:
+        others = [q for q in PARAMETERS if q != p]
+        line = d[(d[others] == 0).all(axis=1)]
+        if line[p].nunique() < 2:
+            continue
+        for alg, g in line.groupby('alg', sort=False):
+            x = g[p].values
+            row = [np.polyfit(x, g[c].values, 1)[0] for c in cols]
+            out.append([p, alg] + row)
+    table = pd.DataFrame(out, columns=['parameter', 'alg'] + cols)
+    return table.set_index(['parameter', 'alg']).round(4)
+
+
+def run(runner, epsilon, head, axes, residues, algorithms, ibases):
+    """Fit every grid point, ibasis and algorithm
+
+    :runner: jobs.Runner
+    :epsilon: epsilon series indexed by wavelength, long to short
+    :head: CDPro input header
+    :axes: list of (parameter, changes) from parse_axis
+    :residues: nominal number of residues
+    :algorithms: list of algorithm names
+    :ibases: list of ibasis integers
+    :returns: dataframe with COLUMNS, one row per grid point, ibasis and
+              algorithm
+
+    """
+    points = grid(axes, residues)
+    factors = np.unique(points['factor'].values)
+    batch = jobs(epsilon.astype(float), head, factors, algorithms, ibases)
+    logging.info('Sensitivity grid of {g} points, {f} distinct spectra: '
+                 '{n} fits'.format(g=len(points), f=len(factors),
+                                   n=len(batch)))
+    fits = []
+    for r in runner.run(batch):
+        if r.ok:
+            fits.append([r.job.tag, r.job.ibasis] + r.row())
+    fits = pd.DataFrame(fits, columns=COLUMNS[len(PARAMETERS):])
+    df = points.merge(fits, on='factor')
+    df['order'] = df['alg'].map(algorithms.index)
+    df = df.sort_values(PARAMETERS + ['ibasis', 'order'])
+    return df.drop('order', axis=1)[COLUMNS].reset_index(drop=True)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental output of secondary structure assignments.
+
+Rows are appended to `<prefix>.csv` and `<prefix>.jsonl` as each fit
+completes and are flushed to disk immediately, so results can be consumed
+while a sweep is still running and survive a crash part way through.
+"""
+
+import os
+import csv
+import json
+import time
+import logging
+from datetime import timedelta
+
+SUMMARY_COLUMNS = ['ibasis', 'alg', 'ahelix', 'bstrand', 'turn', 'unord',
+                   'rmsd', 'ss_res', 'r2', 'qc']
+# rows of a multi-scan run, indexed by scan number
+SERIES_COLUMNS = ['temperature', 'ibasis', 'refset', 'alg', 'ahelix',
+                  'bstrand', 'turn', 'unord', 'rmsd', 'ss_res', 'r2', 'qc']
+
+
+class SummaryStream(object):
+    """Append-only CSV and JSONL writer for fit results"""
+
+    def __init__(self, prefix, columns=SUMMARY_COLUMNS, fsync=True):
+        """
+        :prefix: output file name without extension
+        :columns: column names following the index column
+        :fsync: force each row to disk, not just to the OS buffers
+        """
+        self.columns = list(columns)
+        self.fsync = fsync
+        self.csv_name = prefix + '.csv'
+        self.jsonl_name = prefix + '.jsonl'
+        new = (not os.path.exists(self.csv_name) or
+               os.path.getsize(self.csv_name) == 0)
+        self._csv = open(self.csv_name, 'a')
+        self._writer = csv.writer(self._csv, lineterminator='\n')
+        if new:
+            # match the layout of DataFrame.to_csv with an unnamed index
+            self._writer.writerow([''] + self.columns)
+            self._flush(self._csv)
+        self._jsonl = open(self.jsonl_name, 'a')
+        self.rows = 0
+
+    def _flush(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def write(self, index, row, **extra):
+        """Append a single result row to both files
+
+        :index: row index (the ibasis number)
+        :row: list of values in the order of columns
+        :extra: additional fields written to the JSONL record only
+        :returns: None
+
+        """
+        self._writer.writerow([index] + list(row))
+        self._flush(self._csv)
+        record = dict(zip(self.columns, row))
+        record['index'] = index
+        record['time'] = time.time()
+        record.update(extra)
+        self._jsonl.write(json.dumps(record, sort_keys=True) + '\n')
+        self._flush(self._jsonl)
+        self.rows += 1
+
+    def close(self):
+        self._csv.close()
+        self._jsonl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Progress(object):
+    """Log a progress line with an ETA as work items complete"""
+
+    def __init__(self, total, label='fits'):
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.t0 = time.time()
+
+    def eta(self):
+        """Estimated seconds remaining, or None before the first item
+
+        :returns: float or None
+
+        """
+        if self.done == 0:
+            return None
+        elapsed = time.time() - self.t0
+        return elapsed / self.done * (self.total - self.done)
+
+    def line(self, msg=''):
+        elapsed = timedelta(seconds=int(time.time() - self.t0))
+        eta = self.eta()
+        eta = '?' if eta is None else timedelta(seconds=int(round(eta)))
+        return '[{d}/{t} {l}] {m}elapsed {e}, ETA {eta}'.format(
+            d=self.done, t=self.total, l=self.label,
+            m=msg + '; ' if msg else '', e=elapsed, eta=eta)
+
+    def update(self, n=1, msg=''):
+        self.done += n
+        logging.info(self.line(msg))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Readers for the spectrum exports of different CD spectrometers.
+
+Every reader turns a file into a list of `aviv.Scan`: a dataframe indexed
+by wavelength with CD_Signal (millidegrees) and CD_Dynode (detector
+voltage; NaN where the export has none) columns, plus the file's metadata.
+Scans from any instrument therefore go through the same averaging, blank
+subtraction, conversion and CDPro input steps as Aviv scans.
+
+Formats are kept in a registry. Each has a `sniff` function that
+recognises the first lines of a file, and `detect` tries them in
+FORMAT_ORDER; fallback formats such as generic CSV are tried last.
+`register` adds a format, so support for another instrument is one reader
+and one sniffer:
+
+    vendors.register('myvendor', sniff_myvendor, read_myvendor)
+
+Built in are Aviv text exports, Jasco (JWS / Spectra Manager) text and CSV
+exports with an XYDATA block, Chirascan (Pro-Data) CSV exports with
+CircularDichroism and HV sections, and plain CSV or tab separated tables
+with a wavelength column followed by one column per scan.
+"""
+
+import re
+import csv
+
+import numpy as np
+import pandas as pd
+
+import aviv
+
+# bytes of a file passed to the sniffers
+SNIFF_BYTES = 8192
+
+FORMATS = {}
+FORMAT_ORDER = []
+
+# words in a column or section name marking detector voltage, absorbance
+# and other columns that are not CD
+HV_WORDS = set(['hv', 'ht', 'dynode', 'voltage'])
+SKIP_WORDS = set(['abs', 'absorbance', 'od', 'temperature', 'temp', 'time',
+                  'sem', 'error', 'sd'])
+
+
+def register(name, sniff, read, fallback=False):
+    """Add a file format to the registry
+
+    :name: format name, e.g. 'jasco'
+    :sniff: function taking the first lines of a file (list of str) and
+            returning True if it is in this format
+    :read: function taking a file name and returning a list of aviv.Scan
+    :fallback: try this format only after all others
+    :returns: None
+
+    """
+    FORMATS[name] = {'sniff': sniff, 'read': read, 'fallback': fallback}
+    if name in FORMAT_ORDER:
+        FORMAT_ORDER.remove(name)
+    if fallback:
+        FORMAT_ORDER.append(name)
+    else:
+        first = [n for n in FORMAT_ORDER if FORMATS[n]['fallback']]
+        pos = FORMAT_ORDER.index(first[0]) if first else len(FORMAT_ORDER)
+        FORMAT_ORDER.insert(pos, name)
+
+
+def head(fname, size=SNIFF_BYTES):
+    """First lines of a file
+
+    :fname: file name
+    :size: bytes to read
+    :returns: list of str
+
+    """
+    with open(fname) as f:
+        return f.read(size).splitlines()
+
+
+def detect(fname):
+    """Format of a spectrum file
+
+    :fname: file name
+    :returns: format name
+    :raises: ValueError if no registered format recognises the file
+
+    """
+    lines = head(fname)
+    for name in FORMAT_ORDER:
+        if FORMATS[name]['sniff'](lines):
+            return name
+    raise ValueError('{f} is not in a known spectrum format ({k})'.format(
+        f=fname, k=', '.join(FORMAT_ORDER)))
+
+
+def read(fname, fmt=None):
+    """Scans of a spectrum file
+
+    :fname: file name
+    :fmt: format name; None detects it
+    :returns: (format name, list of aviv.Scan)
+    :raises: ValueError if the format is unknown or the file holds no
+             scans
+
+    """
+    if fmt is None:
+        fmt = detect(fname)
+    elif fmt not in FORMATS:
+        raise ValueError('Unknown spectrum format {}'.format(fmt))
+    scans = list(FORMATS[fmt]['read'](fname))
+    if not scans:
+        raise ValueError('{f} holds no {t} scans'.format(f=fname, t=fmt))
+    return fmt, scans
+
+
+def make_scan(number, meta, wavelengths, signal, dynode=None):
+    """Scan in the common representation
+
+    Points at or above aviv.MAX_DYNODE volts are discarded, as for Aviv
+    files.
+
+    :number: scan number, from 1
+    :meta: dict of metadata
+    :wavelengths: wavelengths (nm)
+    :signal: CD (millidegrees)
+    :dynode: detector voltage, or None
+    :returns: aviv.Scan
+
+    """
+    wl = np.asarray(wavelengths, dtype=float)
+    data = pd.DataFrame(
+        {'CD_Signal': np.asarray(signal, dtype=float),
+         'CD_Dynode': (np.nan if dynode is None else
+                       np.asarray(dynode, dtype=float))},
+        index=pd.Index(wl, name='X'), columns=['CD_Signal', 'CD_Dynode'])
+    data = data[np.isfinite(data['CD_Signal'].values)]
+    if dynode is not None:
+        data = data[~(data['CD_Dynode'] >= aviv.MAX_DYNODE)]
+    temperature = None
+    for k, v in meta.items():
+        if 'temp' in k.lower():
+            try:
+                temperature = float(re.findall(r'[-+]?\d*\.?\d+', v)[0])
+                break
+            except IndexError:
+                pass
+    return aviv.Scan(number, temperature, dict(meta), data)
+
+
+def _numbers(fields):
+    try:
+        return [float(x) for x in fields]
+    except ValueError:
+        return None
+
+
+def _split(line):
+    for sep in ('\t', ',', ';'):
+        if sep in line:
+            return next(csv.reader([line], delimiter=sep))
+    return line.split()
+
+
+# Aviv
+
+def sniff_aviv(lines):
+    return any(line.startswith('$ENDDATA') or
+               line.startswith('Experiment Type') or
+               (line.split()[:2] == ['X', 'CD_Signal'] if line else False)
+               for line in lines)
+
+
+# Jasco
+
+def sniff_jasco(lines):
+    keys = set(_split(line)[0].strip().upper() for line in lines
+               if line.strip())
+    return 'XYDATA' in keys and bool(keys & set(['XUNITS', 'NPOINTS',
+                                                 'SPECTROMETER/DATA SYSTEM',
+                                                 'ORIGIN']))
+
+
+def read_jasco(fname):
+    """Read a Jasco text or CSV export
+
+    The header holds `KEY<tab>value` lines; data follow the XYDATA line as
+    wavelength, CD and optionally HT voltage columns.
+
+    :fname: file name
+    :returns: list of one aviv.Scan
+
+    """
+    meta = {}
+    rows = []
+    data = False
+    with open(fname) as f:
+        for line in f:
+            fields = [x.strip() for x in _split(line.strip())]
+            if not data:
+                if fields and fields[0].upper() == 'XYDATA':
+                    data = True
+                elif len(fields) >= 2 and fields[0]:
+                    meta[fields[0]] = fields[1]
+                continue
+            values = _numbers([x for x in fields if x])
+            if not values:
+                if rows:
+                    # end of data, e.g. '##### Extended Information'
+                    break
+                continue
+            rows.append(values)
+    if not rows:
+        return []
+    n = min(len(r) for r in rows)
+    rows = np.array([r[:n] for r in rows])
+    if n < 2:
+        raise ValueError('{} has no CD column'.format(fname))
+    units = meta.get('Y2UNITS', 'HT').upper()
+    dynode = rows[:, 2] if n > 2 and ('HT' in units or 'V' in units) \
+        else None
+    return [make_scan(1, meta, rows[:, 0], rows[:, 1], dynode)]
+
+
+# Chirascan and generic CSV
+
+def sniff_chirascan(lines):
+    text = '\n'.join(lines)
+    return 'Chirascan' in text or 'CircularDichroism' in text
+
+
+def sniff_csv(lines):
+    rows = 0
+    for line in lines:
+        values = _numbers([x for x in _split(line.strip()) if x.strip()])
+        if values and len(values) >= 2 and 100 <= values[0] <= 400:
+            rows += 1
+    return rows >= 3
+
+
+def _kind(name):
+    words = set(re.findall('[a-z]+', name.lower()))
+    if words & HV_WORDS:
+        return 'dynode'
+    if words & SKIP_WORDS:
+        return None
+    return 'cd'
+
+
+def tables(fname):
+    """Numeric tables of a delimited text file
+
+    :fname: file name
+    :returns: (metadata dict, list of (section, header, rows)); section is
+              the last single-field line before the table, header the last
+              line of several fields, rows a (n, k) array
+
+    """
+    meta = {}
+    out = []
+    section = ''
+    header = []
+    rows = []
+    with open(fname) as f:
+        for line in f:
+            fields = [x.strip() for x in _split(line.strip())]
+            values = _numbers([x for x in fields if x])
+            if values is not None and len(values) >= 2:
+                rows.append(values)
+                continue
+            if rows:
+                out.append((section, header, rows))
+                rows = []
+                header = []
+            named = [x for x in fields if x]
+            if len(named) == 1:
+                section = named[0]
+            elif len(named) >= 2:
+                if len(named) == 2:
+                    meta[named[0].rstrip(':')] = named[1]
+                header = fields
+    if rows:
+        out.append((section, header, rows))
+    result = []
+    for section, header, rows in out:
+        n = min(len(r) for r in rows)
+        result.append((section, header, np.array([r[:n] for r in rows])))
+    return meta, result
+
+
+def read_csv(fname):
+    """Read a CSV or tab separated table of scans
+
+    The first column of each table is the wavelength. Other columns are
+    scans, or detector voltages when they (or the section holding them)
+    are named HV, HT, Dynode or Voltage; absorbance, temperature and error
+    columns are ignored. Chirascan exports hold a CircularDichroism section
+    and an HV section with one column per repeat.
+
+    :fname: file name
+    :returns: list of aviv.Scan
+
+    """
+    meta, found = tables(fname)
+    cd, hv = [], []
+    for section, header, rows in found:
+        for j in range(1, rows.shape[1]):
+            name = header[j] if j < len(header) else ''
+            kind = _kind(section) if _kind(section) != 'cd' else \
+                _kind(name)
+            if kind == 'cd':
+                cd.append(pd.Series(rows[:, j], index=rows[:, 0]))
+            elif kind == 'dynode':
+                hv.append(pd.Series(rows[:, j], index=rows[:, 0]))
+    scans = []
+    for k, s in enumerate(cd):
+        s = s[~s.index.duplicated()]
+        dynode = None
+        if hv:
+            d = hv[k] if k < len(hv) else hv[0]
+            dynode = d[~d.index.duplicated()].reindex(s.index).values
+        scans.append(make_scan(k + 1, meta, s.index, s.values, dynode))
+    return scans
+
+
+register('aviv', sniff_aviv, aviv.iter_scans)
+register('jasco', sniff_jasco, read_jasco)
+register('chirascan', sniff_chirascan, read_csv)
+register('csv', sniff_csv, read_csv, fallback=True)
@@ -19,6 +19,11 @@ requirements = [
     "seaborn"
 ]
 
+extras_requirements = {
+    # consolidated HDF5 output (--archive, cdgo extract)
+    'archive': ["h5py"],
+}
+
 test_requirements = [
     # TODO: put package test requirements here
 ]
@@ -43,6 +48,7 @@ setup(
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     zip_safe=False,
     keywords='cdgo',
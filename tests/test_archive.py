@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_archive
+----------------------------------
+
+Tests for `cdgo.archive` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from cdgo import archive
+
+
+@unittest.skipIf(archive.h5py is None, "h5py not installed")
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'fits.h5')
+        self.fit_dir = os.path.join(self.tmp, 'cdsstr-ibasis4')
+        os.makedirs(self.fit_dir)
+        for name, text in [('ProtSS.out', 'fractions\n'), ('stdout', '')]:
+            with open(os.path.join(self.fit_dir, name), 'w') as f:
+                f.write(text)
+        self.curve = pd.DataFrame({'Exptl': [1.0, 2.0], 'CalcCD': [1.1, 1.9]},
+                                  index=pd.Index([200.0, 199.0],
+                                                 name='WaveL'))
+        self.fields = {'refset': 'SP43', 'ahelix': '40.0%',
+                       'bstrand': '20.0%', 'turn': '15.0%', 'unord': '25.0%',
+                       'rmsd': 0.1, 'ss_res': 0.02, 'r2': 0.99}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_roundtrip_and_extract(self):
+        with archive.Archive(self.fname) as a:
+            a.start_run('s.dat', input='s.dat')
+            a.add_fit('s.dat', 'cdsstr', 4, self.curve, self.fields,
+                      fit_dir=self.fit_dir)
+        with archive.Archive(self.fname, 'r') as a:
+            self.assertEqual(a.samples(), ['s.dat'])
+            self.assertEqual(a.fits('s.dat'), [('cdsstr', 4)])
+            fit = a.fit('s.dat', 'cdsstr', 4)
+            self.assertEqual(fit['refset'], 'SP43')
+            self.assertAlmostEqual(fit['ahelix'], 40.0)
+            self.assertEqual(list(fit['curve'].index), [200.0, 199.0])
+            self.assertEqual(fit['files']['ProtSS.out'], b'fractions\n')
+            self.assertEqual(fit['files']['stdout'], b'')
+            out = a.extract(os.path.join(self.tmp, 'restored'))
+        with open(os.path.join(out[0], 'cdsstr-ibasis4', 'ProtSS.out')) as f:
+            self.assertEqual(f.read(), 'fractions\n')
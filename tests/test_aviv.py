@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_aviv
+----------------------------------
+
+Tests for `cdgo.aviv` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cdgo import aviv
+
+
+def block(temp, signal, dynode=300.):
+    lines = ['Temperature (C): {:.2f}'.format(temp), '$DATA',
+             'X  CD_Signal  CD_Dynode  CD_Temp']
+    for wl in (202., 201., 200.):
+        lines.append('{:.2f}  {:.4f}  {:.2f}  {:.2f}'.format(
+            wl, signal, dynode if wl == 200. else 300., temp))
+    lines.append('$ENDDATA')
+    return lines
+
+
+class TestIterScans(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, 'melt.dat')
+        lines = ['Aviv Biomedical Model 420',
+                 'Experiment Type: Wavelength/Temperature']
+        lines += block(20., -1.) + block(50., -0.5, dynode=700.) + \
+            block(80., 0.)
+        lines.append('Instrument: Aviv 420')
+        with open(self.fname, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_scans(self):
+        scans = list(aviv.iter_scans(self.fname))
+        self.assertEqual(aviv.count_scans(self.fname), 3)
+        self.assertEqual([s.number for s in scans], [1, 2, 3])
+        self.assertEqual([s.temperature for s in scans], [20., 50., 80.])
+        self.assertEqual(list(scans[0].data.columns),
+                         ['CD_Signal', 'CD_Dynode'])
+        self.assertEqual(list(scans[0].data.index), [202., 201., 200.])
+        # points with the dynode above 600 V are dropped
+        self.assertEqual(len(scans[1].data), 2)
+
+    def test_is_lazy(self):
+        scans = aviv.iter_scans(self.fname)
+        self.assertEqual(next(scans).number, 1)
+
+    def test_check_spectra(self):
+        self.assertEqual(aviv.check_spectra(self.fname),
+                         'Wavelength/Temperature')
+
+    def test_paired_single_buffer(self):
+        scans = list(aviv.iter_scans(self.fname))
+        pairs = list(aviv.paired(scans, scans[:1]))
+        self.assertEqual([b.number for s, b in pairs], [1, 1, 1])
+
+    def test_paired_series_buffer(self):
+        scans = list(aviv.iter_scans(self.fname))
+        pairs = list(aviv.paired(scans, scans[:2]))
+        # stops when the buffer runs out of scans
+        self.assertEqual([(s.number, b.number) for s, b in pairs],
+                         [(1, 1), (2, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
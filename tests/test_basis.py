@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_basis
+----------------------------------
+
+Tests for `cdgo.basis` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cdgo import basis
+
+TABLE = """# cdgo reference table: toy set
+WL  A  B  C
+240  -0.1  0.0  0.2
+239  -0.2  0.1  0.3
+178  5.0  -1.0  2.0
+H  0.6  0.1  0.3
+S  0.1  0.5  0.2
+Unrd  0.3  0.4  0.5
+"""
+
+
+# the same set as CDPro reference files: spectra, and fractions in percent
+CDPRO_SPECTRA = """ SP29 reference protein CD spectra
+    3    3
+  WL     A     B     C
+ 240.0  -0.1   0.0   0.2
+ 239.0  -0.2   0.1   0.3
+ 178.0   5.0  -1.0   2.0
+"""
+
+CDPRO_FRACTIONS = """#         H     S  Unrd
+   A   60.0  10.0  30.0
+   B   10.0  50.0  40.0
+   C   30.0  20.0  50.0
+"""
+
+
+class TestBasisStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cdpro = os.path.join(self.tmp, 'CDPro')
+        os.makedirs(self.cdpro)
+        self.ref = os.path.join(self.cdpro, 'sp29.TXT')
+        with open(self.ref, 'w') as f:
+            f.write(TABLE)
+        self.store = basis.BasisStore(os.path.join(self.tmp, 'store'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_reference(self):
+        wl, spectra, fractions, labels, proteins = \
+            basis.read_reference(self.ref)
+        np.testing.assert_allclose(wl, [240., 239., 178.])
+        self.assertEqual(spectra.shape, (3, 3))
+        self.assertEqual(fractions.shape, (3, 3))
+        self.assertEqual(labels, ['H', 'S', 'Unrd'])
+        self.assertEqual(proteins, ['A', 'B', 'C'])
+
+    def test_bad_row(self):
+        with open(self.ref, 'a') as f:
+            f.write('177  1.0  2.0\n')
+        with self.assertRaises(ValueError):
+            basis.read_reference(self.ref)
+
+    def test_foreign_files_are_skipped(self):
+        # a CDPro file named after a set is not read as a table
+        sp22 = os.path.join(self.cdpro, 'SP22X.txt')
+        with open(sp22, 'w') as f:
+            f.write('  22  83\n 240.0  -0.1  0.2\n')
+        self.assertIsNone(basis.find_reference(self.cdpro, 'SP22X'))
+        self.assertEqual(self.store.compile(self.cdpro, [2]), [])
+        with self.assertRaises(ValueError):
+            basis.read_reference(sp22)
+
+    def write_cdpro(self, spectra, fractions):
+        cdpro = os.path.join(self.tmp, 'CDProRef')
+        if not os.path.isdir(cdpro):
+            os.makedirs(cdpro)
+        for name, text in [(spectra, CDPRO_SPECTRA),
+                           (fractions, CDPRO_FRACTIONS)]:
+            with open(os.path.join(cdpro, name), 'w') as f:
+                f.write(text)
+        return cdpro
+
+    def test_convert_cdpro(self):
+        cdpro = self.write_cdpro('SP29.CD', 'sp29ss.txt')
+        self.assertEqual(
+            basis.find_cdpro_reference(cdpro, 'SP29'),
+            (os.path.join(cdpro, 'SP29.CD'),
+             os.path.join(cdpro, 'sp29ss.txt')))
+        tables = os.path.join(self.tmp, 'tables')
+        fname, = basis.convert_cdpro(cdpro, tables, [1, 2])
+        converted = self.store.open(self.store.compile(tables)[0])
+        expected = basis.read_reference(self.ref)
+        for got, want in zip(converted[3:6], expected[:3]):
+            np.testing.assert_allclose(got, want)
+        self.assertEqual(converted.labels, expected[3])
+        self.assertEqual(converted.proteins, expected[4])
+        # unchanged reference files leave the table untouched
+        os.utime(fname, (1e9, 1e9))
+        basis.convert_cdpro(cdpro, tables, [1])
+        self.assertEqual(os.path.getmtime(fname), 1e9)
+
+    def test_cdpro_set_names(self):
+        # files of SP37A do not belong to SP37
+        cdpro = self.write_cdpro('SP37A.cd', 'SP37A.ss')
+        self.assertEqual(basis.find_cdpro_reference(cdpro, 'SP37'),
+                         (None, None))
+        self.assertEqual(basis.find_cdpro_reference(cdpro, 'SP37A')[1],
+                         os.path.join(cdpro, 'SP37A.ss'))
+
+    def test_cdpro_bad_row(self):
+        cdpro = self.write_cdpro('SP29.cd', 'SP29.ss')
+        with open(os.path.join(cdpro, 'SP29.cd'), 'a') as f:
+            f.write(' 177.0  1.0  2.0\n')
+        with self.assertRaises(ValueError):
+            basis.read_cdpro_reference(*basis.find_cdpro_reference(
+                cdpro, 'SP29'))
+
+    def test_compile_and_load_mmap(self):
+        paths = self.store.compile(self.cdpro)
+        self.assertEqual(len(paths), 1)
+        b = self.store.load(1)
+        self.assertEqual(b.refset, 'SP29')
+        self.assertEqual(b.checksum, basis.checksum(self.ref))
+        self.assertIsInstance(b.spectra, np.memmap)
+        np.testing.assert_allclose(b.spectra[-1], [5., -1., 2.])
+        with self.assertRaises(KeyError):
+            self.store.load(2)
+
+    def test_changed_source_is_recompiled(self):
+        old = self.store.load(1, self.cdpro)
+        mtime = os.path.getmtime(self.ref)
+        with open(self.ref, 'w') as f:
+            f.write(TABLE.replace('5.0', '6.0'))
+        # same size; make sure the edit shows in the modification time
+        os.utime(self.ref, (mtime + 10, mtime + 10))
+        new = self.store.load(1, self.cdpro)
+        self.assertNotEqual(old.checksum, new.checksum)
+        self.assertEqual(new.spectra[-1, 0], 6.)
+        self.assertEqual(len(self.store.entries()), 2)
+        # compiling identical files again adds nothing
+        self.store.compile(self.cdpro)
+        self.assertEqual(len(self.store.entries()), 2)
+
+    def test_unchanged_source_is_not_hashed(self):
+        hashed = []
+
+        def checksum(fname):
+            hashed.append(fname)
+            return real(fname)
+        real, basis.checksum = basis.checksum, checksum
+        try:
+            first = self.store.load(1, self.cdpro)
+            self.assertEqual(len(hashed), 1)
+            self.assertEqual(self.store.load(1, self.cdpro).checksum,
+                             first.checksum)
+            self.assertEqual(len(hashed), 1)
+            # a touched but identical file is hashed once, then recognised
+            mtime = os.path.getmtime(self.ref)
+            os.utime(self.ref, (mtime + 10, mtime + 10))
+            self.store.load(1, self.cdpro)
+            self.store.load(1, self.cdpro)
+            self.assertEqual(len(hashed), 2)
+            self.assertEqual(len(self.store.entries()), 1)
+        finally:
+            basis.checksum = real
+
+    def test_refset_name(self):
+        self.assertEqual(basis.refset_name(10), 'SMP56')
+        with self.assertRaises(ValueError):
+            basis.refset_name(11)
+
+
+if __name__ == '__main__':
+    unittest.main()
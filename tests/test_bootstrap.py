@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_bootstrap
+----------------------------------
+
+Tests for `cdgo.bootstrap` module.
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import bootstrap
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def setUp(self):
+        self.wl = np.array([200., 199., 198., 197.])
+        self.curve = pd.DataFrame({'ExpCD': [1., 2., 3., 5.],
+                                   'CalcCD': [1., 2., 4., 4.]},
+                                  index=pd.Index([197., 198., 199., 200.],
+                                                 name='WaveL'))
+
+    def test_residuals_on_grid(self):
+        calc, resid = bootstrap.residuals(self.curve, 'ExpCD', self.wl)
+        np.testing.assert_allclose(calc, [4., 4., 2., 1.])
+        self.assertAlmostEqual(resid.mean(), 0.0)
+
+    def test_residual_replicates(self):
+        calc, resid = bootstrap.residuals(self.curve, 'ExpCD', self.wl)
+        rng = np.random.RandomState(0)
+        eps = np.array([5., 3., 2., 1.])
+        reps = bootstrap.replicates(eps, 50, rng, calc=calc, resid=resid)
+        self.assertEqual(reps.shape, (50, 4))
+        # every replicate is the fit plus one of the residuals
+        for col in range(4):
+            self.assertTrue(np.all(np.isin(
+                np.round(reps[:, col] - calc[col], 6), np.round(resid, 6))))
+
+    def test_missing_fit_points_fall_back_to_eps(self):
+        calc = np.array([np.nan, 1.])
+        reps = bootstrap.replicates(np.array([7., 1.]), 3,
+                                    np.random.RandomState(0), calc=calc,
+                                    resid=np.zeros(2))
+        np.testing.assert_allclose(reps[:, 0], 7.)
+
+    def test_gaussian_replicates(self):
+        reps = bootstrap.replicates(np.zeros(100), 200,
+                                    np.random.RandomState(0), sigma=2.0)
+        self.assertAlmostEqual(reps.std(), 2.0, places=1)
+
+    def test_summarise(self):
+        ss = [{'ahelix': '{}%'.format(v), 'bstrand': '10.0%',
+               'turn': '10.0%', 'unord': '40.0%'} for v in (30, 40, 50)]
+        df = bootstrap.summarise({('cdsstr', 2): ss})
+        row = df.loc[2]
+        self.assertEqual(row['n'], 3)
+        self.assertEqual(row['ahelix_mean'], 40.0)
+        self.assertEqual(row['ahelix_sd'], 10.0)
+        self.assertEqual(row['bstrand_sd'], 0.0)
+        self.assertTrue(30 < row['ahelix_lo'] < row['ahelix_hi'] < 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cluster
+----------------------------------
+
+Tests for `cdgo.cluster` module.
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import cluster
+
+
+class TestDistances(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.normal(size=(7, 20))
+
+    def test_rmsd_matches_direct(self):
+        D = cluster.distances(self.X, 'rmsd', chunk=3)
+        direct = np.sqrt(((self.X[:, None] - self.X[None]) ** 2).mean(-1))
+        np.testing.assert_allclose(D, direct, atol=1e-10)
+
+    def test_correlation(self):
+        D = cluster.distances(self.X, 'correlation', chunk=2)
+        np.testing.assert_allclose(D, 1 - np.corrcoef(self.X), atol=1e-10)
+        self.assertTrue(np.all(np.diag(D) == 0))
+
+    def test_stack_common_grid(self):
+        a = pd.Series([1., 2., 3.], index=[200., 199., 198.])
+        b = pd.Series([4., 5.], index=[199.0000001, 198.])
+        wl, X = cluster.stack([a, b])
+        np.testing.assert_allclose(wl, [199., 198.])
+        np.testing.assert_allclose(X, [[2., 3.], [4., 5.]])
+
+
+class TestClustering(unittest.TestCase):
+
+    def setUp(self):
+        # two tight groups and a stray point on a line
+        self.x = np.array([0., 0.1, 0.2, 5., 5.1, 5.3, 20.])
+        self.D = np.abs(self.x[:, None] - self.x[None])
+
+    def test_linkage_merges(self):
+        Z = cluster.linkage(self.D, 'single')
+        self.assertEqual(Z.shape, (6, 4))
+        np.testing.assert_allclose(Z[:2, 2], [0.1, 0.1])
+        self.assertEqual(Z[-1, 3], 7)
+        # average linkage distance of the last merge
+        Z = cluster.linkage(self.D, 'average')
+        self.assertAlmostEqual(Z[-1, 2], np.mean(20. - self.x[:6]))
+
+    def test_assign(self):
+        Z = cluster.linkage(self.D, 'average')
+        np.testing.assert_array_equal(cluster.assign(Z, 7, clusters=3),
+                                      [1, 1, 1, 2, 2, 2, 3])
+        np.testing.assert_array_equal(cluster.assign(Z, 7, threshold=1.),
+                                      [1, 1, 1, 2, 2, 2, 3])
+        self.assertEqual(len(set(cluster.assign(Z, 7, threshold=0.))), 7)
+
+    def test_medoids_and_outliers(self):
+        labels = np.array([1, 1, 1, 2, 2, 2, 3])
+        centres = cluster.medoids(self.D, labels)
+        self.assertEqual(centres, {1: 1, 2: 4, 3: 6})
+        dist, flagged = cluster.outliers(self.D, labels, centres)
+        self.assertEqual(list(flagged), [False] * 6 + [True])
+        self.assertAlmostEqual(dist[5], 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
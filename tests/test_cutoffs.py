@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cutoffs
+----------------------------------
+
+Tests for `cdgo.cutoffs` module.
+"""
+
+import argparse
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import cutoffs
+
+
+class TestCutoffs(unittest.TestCase):
+
+    def setUp(self):
+        wl = np.arange(260., 177., -1.)
+        self.epsilon = pd.Series(['%1.3f' % x for x in np.sin(wl)],
+                                 index=wl)
+
+    def test_parse_cutoffs(self):
+        self.assertEqual(cutoffs.parse_cutoffs('190,178,185,178'),
+                         [178., 185., 190.])
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cutoffs.parse_cutoffs('178,low')
+
+    def test_jobs(self):
+        jobs = cutoffs.jobs(self.epsilon, [178., 190., 255.],
+                            ['continll', 'cdsstr'], [1, 2])
+        # 255 nm leaves too few points and is skipped
+        self.assertEqual(len(jobs), 8)
+        self.assertEqual(sorted(set(j.tag for j in jobs)), [178., 190.])
+        text = [j.text for j in jobs if j.tag == 190.][0]
+        self.assertIn('260.0000      190.0000', text)
+
+    def test_truncate(self):
+        self.assertEqual(len(cutoffs.truncate(self.epsilon, 190.)), 71)
+
+    def test_spread(self):
+        df = pd.DataFrame(
+            [[178., 1, 'SP29', 'cdsstr', '30.0%', '20.0%', '10.0%', '40.0%',
+              0.2, 0, 0],
+             [190., 1, 'SP29', 'cdsstr', '35.0%', '20.0%', '5.0%', '40.0%',
+              0.1, 0, 0]], columns=cutoffs.COLUMNS)
+        out = cutoffs.spread(df).loc[('cdsstr', 1)]
+        self.assertEqual(out['ahelix'], 5.0)
+        self.assertEqual(out['turn'], 5.0)
+        self.assertEqual(out['unord'], 0.0)
+        self.assertEqual(out['best_cutoff'], 190.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_factorcache
+----------------------------------
+
+Tests for `cdgo.factorcache` module.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cdgo import factorcache
+from cdgo import lsq
+from cdgo import metrics
+from cdgo import selcon
+from tests.test_selcon import class_spectra
+from tests.test_selcon import make_basis
+
+
+class TestKeys(unittest.TestCase):
+
+    def test_window(self):
+        self.assertEqual(factorcache.window(np.arange(240., 177., -1.)),
+                         (240., 178., 1., 63))
+        self.assertEqual(factorcache.window([200., 199.5, 198.])[2], None)
+
+    def test_make_key(self):
+        b = make_basis()
+        wl = np.arange(240., 177., -1.)
+        key = factorcache.make_key('selcon', b, wl)
+        self.assertNotEqual(key, factorcache.make_key('lsq', b, wl))
+        self.assertNotEqual(key, factorcache.make_key('selcon', b, wl[::2]))
+        self.assertNotEqual(key, factorcache.make_key(
+            'selcon', b._replace(checksum='y'), wl))
+        # irregular grids over the same range differ
+        a = np.r_[np.arange(240., 200., -1.), np.arange(200., 177., -2.)]
+        c = np.r_[np.arange(240., 218., -2.), np.arange(218., 177., -1.)]
+        self.assertNotEqual(factorcache.make_key('selcon', b, a),
+                            factorcache.make_key('selcon', b, c))
+
+
+class TestFactorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def compute(self, n):
+        def f():
+            self.calls.append(n)
+            return (np.zeros(n), [np.ones(n)])
+        return f
+
+    def test_lru_eviction(self):
+        cache = factorcache.FactorCache(max_bytes=3 * 160)
+        for key in 'abc':
+            cache.get(key, self.compute(10))
+        self.assertEqual(cache.stats()['bytes'], 480)
+        # touching 'a' makes 'b' the least recently used
+        cache.get('a', self.compute(10))
+        cache.get('d', self.compute(10))
+        self.assertEqual(list(cache._entries), ['c', 'a', 'd'])
+        cache.get('b', self.compute(10))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'],
+                          stats['evictions'], stats['entries']),
+                         (1, 5, 2, 3))
+        self.assertEqual(stats['hit_rate'], round(1 / 6., 4))
+        self.assertEqual(metrics.FACTOR_CACHE_BYTES.value(), 480)
+        # an entry larger than the limit is still kept
+        cache.get('big', self.compute(100))
+        self.assertEqual(list(cache._entries), ['big'])
+        cache.clear()
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_disk(self):
+        cache = factorcache.FactorCache(cache_dir=self.tmp)
+        self.assertIsNone(cache.stats()['hit_rate'])
+        first = cache.get(('selcon', 1), self.compute(5))
+        warm = factorcache.FactorCache(cache_dir=self.tmp)
+        again = warm.get(('selcon', 1), self.compute(5))
+        self.assertEqual(self.calls, [5])
+        np.testing.assert_array_equal(again[1][0], first[1][0])
+        self.assertEqual(warm.stats()['disk_hits'], 1)
+        warm.get(('selcon', 1), self.compute(5))
+        self.assertEqual(warm.stats()['hits'], 1)
+        # a damaged entry is recomputed
+        with open(warm.path(('lsq', 2)), 'w') as f:
+            f.write('not a pickle')
+        warm.get(('lsq', 2), self.compute(3))
+        self.assertEqual(self.calls, [5, 3])
+
+    def test_solvers_reuse_factorisations(self):
+        b = make_basis()
+        wl = np.arange(250., 177., -1.)
+        rng = np.random.RandomState(5)
+        Y = rng.dirichlet([2, 1.5, 1, 1, 2], 4).dot(class_spectra(wl).T)
+        cache = factorcache.FactorCache()
+        for fit in (selcon.fit, lsq.fit):
+            plain = fit(b, wl, Y)
+            for k in range(3):
+                out = fit(b, wl, Y[k], cache=cache)
+                np.testing.assert_allclose(out[2][0], plain[2][k],
+                                           atol=1e-10)
+        # lsq reuses the restricted basis cached by selcon
+        stats = cache.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (2, 7))
+
+    def test_shared_fit_skips_factorisations(self):
+        b = make_basis()
+        wl = np.arange(250., 177., -1.)
+        Y = np.ones((2, 5)).dot(class_spectra(wl).T) / 5.
+        cache = factorcache.FactorCache()
+        lsq.fit(b, wl, Y, shared=['ahelix'], cache=cache)
+        self.assertEqual([key[0] for key in cache._entries], ['selcon'])
+
+    def test_wavelength_order(self):
+        b = make_basis()
+        wl = np.arange(250., 177., -1.)
+        rng = np.random.RandomState(6)
+        Y = rng.dirichlet([2, 1.5, 1, 1, 2], 3).dot(class_spectra(wl).T)
+        cache = factorcache.FactorCache()
+        for fit in (selcon.fit, lsq.fit):
+            plain = fit(b, wl, Y)
+            fit(b, wl, Y, cache=cache)
+            # a warm entry must not carry the indices of the other order
+            out = fit(b, wl[::-1], Y[:, ::-1], cache=cache)
+            np.testing.assert_allclose(out[2], plain[2], atol=1e-10)
+            np.testing.assert_allclose(out[1], plain[1])
+        self.assertEqual(cache.stats()['hits'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_fairqueue
+----------------------------------
+
+Tests for `cdgo.fairqueue` module.
+"""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import pandas as pd
+
+from cdgo import fairqueue
+from cdgo import jobs
+
+
+def ticket(id, owner, priority, enqueued):
+    return {'id': id, 'owner': owner, 'priority': priority,
+            'enqueued': enqueued}
+
+
+class TestPick(unittest.TestCase):
+
+    def test_class_then_fair_share_then_age(self):
+        waiting = [ticket('a1', 'alice', 'bulk', 0.),
+                   ticket('a2', 'alice', 'normal', 1.),
+                   ticket('b1', 'bob', 'normal', 2.)]
+        running = [ticket('a0', 'alice', 'bulk', 0.)]
+        # bob has nothing running, so his later ticket goes first
+        self.assertEqual(fairqueue.pick(waiting, running, 10.)['id'], 'b1')
+        self.assertEqual(fairqueue.pick(waiting, [], 10.)['id'], 'a2')
+        waiting.append(ticket('c1', 'carol', 'interactive', 9.))
+        self.assertEqual(fairqueue.pick(waiting, running, 10.)['id'], 'c1')
+        self.assertIsNone(fairqueue.pick([], running, 10.))
+
+    def test_starvation(self):
+        waiting = [ticket('a1', 'alice', 'bulk', 0.),
+                   ticket('c1', 'carol', 'interactive', 400.)]
+        self.assertEqual(fairqueue.pick(waiting, [], 200.)['id'], 'c1')
+        self.assertEqual(fairqueue.pick(waiting, [], 401.)['id'], 'a1')
+        self.assertEqual(fairqueue.pick(waiting, [], 401., max_wait=500.)
+                         ['id'], 'c1')
+
+
+class TestSharedQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.queue = fairqueue.SharedQueue(self.tmp, slots=1, owner='alice',
+                                           poll=0.01)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def wait_for(self, state, n):
+        for _ in range(500):
+            if len(self.queue.tickets(state)) == n:
+                return
+            time.sleep(0.01)
+        self.fail('{} tickets never {}'.format(n, state))
+
+    def test_grants_by_class(self):
+        order = []
+        release = threading.Event()
+
+        def fit(job, hold=None):
+            with self.queue.slot(job):
+                order.append(job.tag)
+                if hold is not None:
+                    hold.wait()
+
+        first = threading.Thread(target=fit, args=(
+            jobs.FitJob('cdsstr', 1, '', tag='first'), release))
+        first.start()
+        self.wait_for('running', 1)
+        threads = []
+        for tag, priority, owner in [('bulk', 'bulk', None),
+                                     ('normal', None, None),
+                                     ('urgent', 'interactive', 'bob')]:
+            threads.append(threading.Thread(target=fit, args=(
+                jobs.FitJob('cdsstr', 1, '', tag=tag, priority=priority,
+                            owner=owner),)))
+            threads[-1].start()
+            self.wait_for('waiting', len(threads))
+        release.set()
+        for t in [first] + threads:
+            t.join()
+        self.assertEqual(order, ['first', 'urgent', 'normal', 'bulk'])
+        self.assertEqual(self.queue.tickets('waiting'), [])
+        self.assertEqual(self.queue.tickets('running'), [])
+
+        waits = self.queue.waits()
+        self.assertEqual(len(waits), 4)
+        self.assertEqual(list(waits['owner']),
+                         ['alice', 'bob', 'alice', 'alice'])
+        table = fairqueue.latency(waits)
+        self.assertEqual(list(table.index),
+                         ['interactive', 'normal', 'bulk'])
+        self.assertEqual(list(table['fits']), [1, 2, 1])
+        self.assertTrue((table['max_s'] >= table['p50_s']).all())
+
+    def test_stale_tickets_are_removed(self):
+        p = subprocess.Popen(['true'])
+        p.wait()
+        dead = dict(ticket('x', 'zed', 'interactive', 0.),
+                    host=socket.gethostname(), pid=p.pid)
+        with open(os.path.join(self.tmp, 'running', 'x.json'), 'w') as f:
+            json.dump(dead, f)
+        with self.queue.slot() as wait:
+            self.assertLess(wait, 1.)
+            self.assertEqual(list(fairqueue.status(self.queue)['running']),
+                             [1])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp, 'running', 'x.json')))
+        self.assertEqual(len(fairqueue.status(self.queue)), 0)
+
+    def test_unknown_class(self):
+        with self.assertRaises(ValueError):
+            fairqueue.SharedQueue(self.tmp, priority='urgent')
+        with self.assertRaises(ValueError):
+            self.queue.ticket(jobs.FitJob('cdsstr', 1, '', priority='x'))
+
+    def test_runner_takes_queue_slot(self):
+        runner = jobs.Runner(self.tmp, queue=self.queue)
+        with runner.slot(jobs.FitJob('cdsstr', 1, ''), 'wine') as (cmd, pre):
+            self.assertEqual((cmd, pre), ('wine', None))
+            self.assertEqual(len(self.queue.tickets('running')), 1)
+        self.assertEqual(len(self.queue.waits()), 1)
+
+    def test_latency_empty(self):
+        table = fairqueue.latency(pd.DataFrame(
+            columns=fairqueue.WAIT_COLUMNS))
+        self.assertEqual(len(table), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_jobs
+----------------------------------
+
+Tests for `cdgo.jobs` and `cdgo.cdpro` modules.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cdgo import cdpro
+from cdgo import jobs
+
+
+class TestInputText(unittest.TestCase):
+
+    def test_set_ibasis(self):
+        head = cdpro.cdpro_input_header(190, 260, 1)
+        text = cdpro.input_text(['1.000'] * 12, head, ibasis=7)
+        self.assertIn('# PRINT    IBasis\n      0         7\n', text)
+        # ten values per line
+        self.assertIn('  ' + '  '.join(['1.000'] * 10) + '\n', text)
+        self.assertIn('  1.000  1.000\n', text)
+
+    def test_header_is_long_to_short(self):
+        head = cdpro.cdpro_input_header(190, 260, 1)
+        self.assertIn('260.0000      190.0000', head)
+
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cdpro_dir = os.path.join(self.tmp, 'CDPro')
+        os.makedirs(self.cdpro_dir)
+        for f in ['CDSSTR.EXE', 'SP29.dat', 'ProtSS.out']:
+            with open(os.path.join(self.cdpro_dir, f), 'w') as fp:
+                fp.write(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_workspace_links_inputs_but_not_outputs(self):
+        runner = jobs.Runner(self.cdpro_dir)
+        job = jobs.FitJob('cdsstr', 1, 'text')
+        ws = runner.workspace(job)
+        try:
+            self.assertTrue(os.path.islink(os.path.join(ws, 'SP29.dat')))
+            self.assertFalse(os.path.exists(os.path.join(ws, 'ProtSS.out')))
+            with open(os.path.join(ws, 'input')) as f:
+                self.assertEqual(f.read(), 'text')
+        finally:
+            shutil.rmtree(ws)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            jobs.FitJob('selcon9', 1, 'text')
+
+    def test_parse_selcon3(self):
+        with open(os.path.join(self.tmp, 'ProtSS.out'), 'w') as f:
+            f.write('#\n#\n#\n#\n   Ref. Prot. Set  SP29  (IBasis 1)\n'
+                    '#   H(r)  H(d)  S(r)  S(d)  Trn  Unrd\n'
+                    '   Fractions  input  0.2  0.1  0.1  0.1  0.2  0.3  \n')
+        with open(os.path.join(self.tmp, 'CalcCD.OUT'), 'w') as f:
+            f.write('WaveL  ExpCD  CalcCD\n200.0  1.0  1.5\n'
+                    '199.0  2.0  2.0\n198.0  3.0  2.5\n')
+        result = jobs.FitResult(jobs.FitJob('selcon3', 1, 'text'), 'ok')
+        jobs.parse_fit(result, self.tmp)
+        row = result.row()
+        self.assertEqual(row[:3], ['SP29', 'selcon3', '30.0%'])
+        self.assertEqual(row[5], '30.0%')
+        self.assertAlmostEqual(result.ss_res, 0.5)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = jobs.ResultCache(os.path.join(self.tmp, 'cache'))
+        self.out = os.path.join(self.tmp, 'ProtSS.out')
+        with open(self.out, 'w') as f:
+            f.write('fractions')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_key_depends_on_input(self):
+        a = self.cache.key(jobs.FitJob('cdsstr', 1, 'a'), self.tmp)
+        b = self.cache.key(jobs.FitJob('cdsstr', 1, 'b'), self.tmp)
+        c = self.cache.key(jobs.FitJob('cdsstr', 2, 'a'), self.tmp)
+        self.assertEqual(len(set([a, b, c])), 3)
+        self.assertEqual(
+            a, self.cache.key(jobs.FitJob('cdsstr', 1, 'a'), self.tmp))
+
+    def test_put_get(self):
+        key = self.cache.key(jobs.FitJob('cdsstr', 1, 'a'), self.tmp)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, [self.out])
+        # a second put of the same fit is harmless
+        self.cache.put(key, [self.out])
+        path = self.cache.get(key)
+        self.assertEqual(os.listdir(path), ['ProtSS.out'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_lsq
+----------------------------------
+
+Tests for `cdgo.lsq` module and stacked native fits in `cdgo.jobs`.
+"""
+
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cdgo import basis
+from cdgo import cdpro
+from cdgo import jobs
+from cdgo import lsq
+from tests.test_selcon import class_spectra
+from tests.test_selcon import make_basis
+
+
+class TestSolver(unittest.TestCase):
+
+    def setUp(self):
+        self.basis = make_basis()
+        rng = np.random.RandomState(3)
+        self.truth = rng.dirichlet([2, 1.5, 1, 1, 2], 8)
+        self.wl = np.arange(250., 177., -1.)
+        self.Y = self.truth.dot(class_spectra(self.wl).T) + \
+            rng.normal(0, 0.05, (8, self.wl.size))
+
+    def test_recovers_fractions(self):
+        wl, Y, f, calc, count = lsq.fit(self.basis, self.wl, self.Y)
+        self.assertEqual(wl[0], 240.)
+        self.assertEqual(Y.shape, calc.shape)
+        self.assertTrue(np.all(f >= 0))
+        np.testing.assert_allclose(f.sum(axis=1), 1., atol=1e-9)
+        np.testing.assert_allclose(f, self.truth, atol=0.03)
+        self.assertEqual(list(count), [1] * 8)
+
+    def test_batch_matches_single(self):
+        f_all = lsq.fit(self.basis, self.wl, self.Y)[2]
+        f_one = lsq.fit(self.basis, self.wl, self.Y[5])[2]
+        np.testing.assert_allclose(f_one[0], f_all[5], atol=1e-10)
+
+    def test_active_constraints(self):
+        # a spectrum outside the simplex is fitted on its boundary, as the
+        # penalised non-negative solution agrees
+        P = class_spectra(self.wl)
+        Y = np.array([2.5 * P[:, 0] - P[:, 1], P[:, 2] + 0.3])
+        f = lsq.solve(P, Y)
+        self.assertTrue(np.all(f >= 0))
+        self.assertGreater((f == 0).sum(), 0)
+        np.testing.assert_allclose(f.sum(axis=1), 1., atol=1e-9)
+        for y, fy in zip(Y, f):
+            np.testing.assert_allclose(
+                lsq.solve_shared(P, y[None, :], np.zeros(5, bool))[0], fy,
+                atol=1e-4)
+
+    def test_shared_fractions(self):
+        wl, Y, f, calc, count = lsq.fit(self.basis, self.wl, self.Y,
+                                        shared=['ahelix'])
+        # helix is class H of SP37A
+        np.testing.assert_allclose(f[:, 0], f[0, 0], atol=1e-12)
+        self.assertAlmostEqual(f[0, 0], self.truth[:, 0].mean(), delta=0.05)
+        self.assertTrue(np.all(f >= 0))
+        np.testing.assert_allclose(f.sum(axis=1), 1., atol=1e-4)
+        free = lsq.fit(self.basis, self.wl, self.Y)[2]
+        self.assertGreater(np.abs(f - free).max(), 0.01)
+
+    def test_nnls(self):
+        rng = np.random.RandomState(4)
+        A = rng.normal(size=(12, 4))
+        b = rng.normal(size=12)
+        x = lsq.nnls(A.T.dot(A), A.T.dot(b))
+        # the best solution over every support
+        best = np.inf
+        for size in range(5):
+            for idx in itertools.combinations(range(4), size):
+                z = np.zeros(4)
+                if idx:
+                    z[list(idx)] = np.linalg.lstsq(A[:, idx], b,
+                                                   rcond=None)[0]
+                if z.min() >= 0:
+                    best = min(best, ((A.dot(z) - b) ** 2).sum())
+        self.assertAlmostEqual(((A.dot(x) - b) ** 2).sum(), best)
+        self.assertTrue(np.all(x >= 0))
+
+
+class TestStackedRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cdpro_dir = os.path.join(self.tmp, 'CDPro')
+        os.makedirs(self.cdpro_dir)
+        b = make_basis()
+        with open(os.path.join(self.cdpro_dir, 'SP37A.txt'), 'w') as f:
+            f.write(basis.TABLE_HEADER + '\n')
+            f.write('WL  ' + '  '.join(b.proteins) + '\n')
+            for x, row in zip(b.wavelengths, b.spectra):
+                f.write('{:.0f}  '.format(x) +
+                        '  '.join('{:.4f}'.format(v) for v in row) + '\n')
+            for label, row in zip(b.labels, b.fractions):
+                f.write(label + '  ' +
+                        '  '.join('{:.4f}'.format(v) for v in row) + '\n')
+        self.store = basis.BasisStore(os.path.join(self.tmp, 'store'))
+        self.store.compile(self.cdpro_dir, [5])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def job(self, helix, low, tag, out_dir=None):
+        wl = np.arange(240., low - 1., -1.)
+        f = [helix, .2, .1, .1, .6 - helix]
+        values = ['%1.3f' % v for v in class_spectra(wl).dot(f)]
+        return jobs.FitJob('lsq', 5, cdpro.input_text(
+            values, cdpro.cdpro_input_header(low, 240., 1), 5),
+            out_dir=out_dir, tag=tag)
+
+    def test_series_in_one_solve(self):
+        out_dir = os.path.join(self.tmp, 'lsq-ibasis5')
+        # the third scan stops at 182 nm; all are fitted down to 182 nm
+        batch = [self.job(.3, 178., 0, out_dir), self.job(.4, 178., 1),
+                 self.job(.5, 182., 2)]
+        runner = jobs.Runner(self.cdpro_dir, basis_store=self.store)
+        results = sorted(runner.run(batch), key=lambda r: r.job.tag)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual([len(r.curve) for r in results], [59] * 3)
+        for r, helix in zip(results, [30., 40., 50.]):
+            self.assertAlmostEqual(float(r.ss['ahelix'].rstrip('%')),
+                                   helix, delta=1.)
+        with open(os.path.join(out_dir, 'ProtSS.out')) as f:
+            self.assertIn('CDGo native LSQ', f.readline())
+
+        runner = jobs.Runner(self.cdpro_dir, basis_store=self.store,
+                             native_options={'lsq': {'shared': ['ahelix']}})
+        shared = [r.ss['ahelix'] for r in runner.run(batch)]
+        self.assertEqual(len(set(shared)), 1)
+        self.assertAlmostEqual(float(shared[0].rstrip('%')), 40., delta=1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
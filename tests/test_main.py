@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_main
+----------------------------------
+
+Tests for the `cdgo.__main__` pipeline.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import __main__ as pipeline
+from cdgo import basis
+from tests.test_selcon import class_spectra
+from tests.test_selcon import make_basis
+
+WL = np.arange(240., 177., -1.)
+
+
+# read_aviv expects the full instrument header before $DATA
+AVIV_HEADER = ['Aviv Biomedical Model 420 Circular Dichroism Spectrometer',
+               'Experiment Type: Wavelength', 'Software Version: 3.30',
+               'Date: 2016-11-09 10:00:00', 'Operator: test',
+               'Cell Pathlength (cm): 0.1', 'Wavelength Start (nm): 240.00',
+               'Wavelength End (nm): 178.00', 'Wavelength Step (nm): 1.00',
+               'Averaging Time (s): 1.000', 'Settling Time (s): 0.333',
+               'Bandwidth (nm): 1.000', 'Temperature (C): 25.00',
+               'Scans: 1', 'Channels: 2', 'Comment: test', '', '$DATA',
+               'X  CD_Signal  CD_Dynode']
+
+
+def aviv_lines(signal):
+    return (AVIV_HEADER + ['{:.2f}  {:.4f}  300.00'.format(w, v)
+                           for w, v in zip(WL, signal)] +
+            ['$ENDDATA', 'Instrument: Aviv 420'])
+
+
+class TestRunVendors(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        cdpro_dir = os.path.join(self.tmp, 'CDPro')
+        os.makedirs(cdpro_dir)
+        b = make_basis()
+        with open(os.path.join(cdpro_dir, 'SP37A.txt'), 'w') as f:
+            f.write(basis.TABLE_HEADER + '\n')
+            f.write('WL  ' + '  '.join(b.proteins) + '\n')
+            for x, row in zip(b.wavelengths, b.spectra):
+                f.write('{:.0f}  '.format(x) +
+                        '  '.join('{:.4f}'.format(v) for v in row) + '\n')
+            for label, row in zip(b.labels, b.fractions):
+                f.write(label + '  ' +
+                        '  '.join('{:.4f}'.format(v) for v in row) + '\n')
+        store = os.path.join(self.tmp, 'store')
+        basis.BasisStore(store).compile(cdpro_dir, [5])
+        self.argv = ['-C', cdpro_dir, '--mol_weight', '14300',
+                     '--number_residues', '129', '--concentration', '0.5',
+                     '--lsq', '--db_range', '5', '--basis_store', store,
+                     '--parse_cache', 'off']
+        sample = class_spectra(WL).dot([.4, .2, .1, .1, .2]) * 10. + 0.5
+        self.write('sample.dat', aviv_lines(sample))
+        self.write('buffer.dat', aviv_lines(np.full(WL.size, 0.5)))
+        self.write('buffer.csv', ['wavelength,cd'] +
+                   ['{:.1f},0.5000'.format(w) for w in WL])
+        self.write('sample.csv', ['wavelength,cd'] +
+                   ['{:.1f},{:.4f}'.format(w, v)
+                    for w, v in zip(WL, sample)])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, lines):
+        with open(os.path.join(self.tmp, name), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def fractions(self, sample, buffer=None):
+        argv = self.argv + ['-i', sample]
+        if buffer is not None:
+            argv += ['--buffer', buffer]
+        # run() leaves the working directory in its output directory
+        os.chdir(self.tmp)
+        out_dir = pipeline.run(pipeline.parser.parse_args(argv))
+        summary = pd.read_csv(os.path.join(
+            out_dir, 'secondary_structure_summary.csv'), index_col=0)
+        self.assertEqual(list(summary['alg']), ['lsq'])
+        return summary[['ahelix', 'bstrand', 'turn', 'unord']].iloc[0]
+
+    def test_mixed_vendor_pairs(self):
+        aviv = self.fractions('sample.dat', 'buffer.dat')
+        # either file of another vendor sends the pair through averaging
+        for sample, buffer in [('sample.dat', 'buffer.csv'),
+                               ('sample.csv', 'buffer.dat')]:
+            self.assertEqual(list(self.fractions(sample, buffer)),
+                             list(aviv))
+
+    def test_aviv_without_buffer(self):
+        self.assertEqual(len(self.fractions('sample.dat')), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `cdgo.metrics` module.
+"""
+
+import unittest
+
+from cdgo import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.fits = self.registry.register(metrics.Counter(
+            'fits_total', 'Fits.', ['algorithm']))
+        self.latency = self.registry.register(metrics.Histogram(
+            'fit_seconds', 'Latency.', ['algorithm'], buckets=(1, 5)))
+
+    def test_counter(self):
+        self.fits.inc(algorithm='cdsstr')
+        self.fits.inc(2, algorithm='cdsstr')
+        self.assertEqual(self.fits.value(algorithm='cdsstr'), 3)
+        self.assertIn('fits_total{algorithm="cdsstr"} 3.0',
+                      self.registry.render())
+
+    def test_missing_label(self):
+        with self.assertRaises(ValueError):
+            self.fits.inc()
+
+    def test_histogram_buckets_are_cumulative(self):
+        for v in (0.5, 2, 10):
+            self.latency.observe(v, algorithm='continll')
+        text = self.registry.render()
+        self.assertIn('fit_seconds_bucket{algorithm="continll",le="1.0"} 1',
+                      text)
+        self.assertIn('fit_seconds_bucket{algorithm="continll",le="5.0"} 2',
+                      text)
+        self.assertIn('fit_seconds_bucket{algorithm="continll",le="+Inf"} 3',
+                      text)
+        self.assertIn('fit_seconds_count{algorithm="continll"} 3', text)
+        self.assertEqual(self.latency.count(algorithm='continll'), 3)
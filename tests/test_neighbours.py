@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_neighbours
+----------------------------------
+
+Tests for `cdgo.neighbours` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import basis
+from cdgo import neighbours
+
+WL = np.arange(240., 177., -1.)
+
+
+def shape(centre):
+    return np.exp(-((WL - centre) / 8.) ** 2)
+
+
+def fake_basis(ibasis, centres):
+    spectra = np.array([shape(c) for c in centres]).T
+    return basis.Basis(ibasis, basis.refset_name(ibasis), str(ibasis) * 40,
+                       WL, spectra, np.ones((1, len(centres))), ['H'],
+                       ['P{}'.format(i) for i in range(len(centres))])
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.bases = [fake_basis(1, [190., 192., 194.]),
+                      fake_basis(2, [220., 222.]),
+                      fake_basis(3, [200., 221., 223., 225.])]
+
+    def test_parse_auto(self):
+        self.assertEqual(neighbours.parse_auto('auto:4'), neighbours.Auto(4))
+        self.assertEqual(neighbours.parse_auto('auto'), neighbours.Auto(3))
+        self.assertIsNone(neighbours.parse_auto('1-5'))
+        with self.assertRaises(ValueError):
+            neighbours.parse_auto('auto:0')
+
+    def test_rank_by_neighbourhood(self):
+        index = neighbours.SpectrumIndex.build(self.bases)
+        query = pd.Series(shape(222.), index=WL)
+        ranks = index.rank(query, neighbours=4)
+        self.assertEqual([r[0] for r in ranks], [3, 2, 1])
+        self.assertEqual(ranks[0][2], 2)
+        self.assertAlmostEqual(ranks[1][3], 1.)
+
+    def test_partial_overlap_and_pca(self):
+        index = neighbours.SpectrumIndex.build(self.bases, n_components=3)
+        full = pd.Series(shape(191.), index=WL)
+        self.assertEqual(index.rank(full, neighbours=2)[0][0], 1)
+        part = full[full.index >= 185.]
+        self.assertEqual(index.rank(part, neighbours=2)[0][0], 1)
+        with self.assertRaises(ValueError):
+            index.similarity(pd.Series([1.], index=[300.]))
+
+    def test_load_index_is_saved(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            cdpro = os.path.join(tmp, 'CDPro')
+            os.makedirs(cdpro)
+            for b in self.bases:
+                with open(os.path.join(cdpro, b.refset + '.txt'), 'w') as f:
+                    f.write(basis.TABLE_HEADER + '\n')
+                    f.write('WL  ' + '  '.join(b.proteins) + '\n')
+                    for w, row in zip(WL, b.spectra):
+                        f.write('{}  {}\n'.format(w, '  '.join(
+                            str(v) for v in row)))
+                    f.write('H  ' + '  '.join(['1'] * len(b.proteins)) +
+                            '\n')
+            store = basis.BasisStore(os.path.join(tmp, 'store'))
+            store.compile(cdpro)
+            index = neighbours.load_index(store)
+            self.assertEqual(len(index.owners), 9)
+            saved = [n for n in os.listdir(store.root)
+                     if n.startswith('index-')]
+            self.assertEqual(len(saved), 1)
+            again = neighbours.load_index(store)
+            np.testing.assert_allclose(again.vectors, index.vectors)
+        finally:
+            shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    unittest.main()
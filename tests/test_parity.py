@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_parity
+----------------------------------
+
+Tests for `cdgo.parity` module.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import basis
+from cdgo import cdpro
+from cdgo import jobs
+from cdgo import parity
+from cdgo import selcon
+
+
+def fit_result(alg, ibasis, fractions, rmsd, name='a/input'):
+    job = jobs.FitJob(alg, ibasis, '', tag=name)
+    r = jobs.FitResult(job, 'ok')
+    r.refset = 'SP29'
+    r.ss = dict((k, '{:.1f}%'.format(v))
+                for k, v in zip(parity.FRACTIONS, fractions))
+    r.rmsd = rmsd
+    return r
+
+
+class TestParity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_parse_tolerances(self):
+        self.assertEqual(parity.parse_tolerances('ahelix=3, rmsd=0.02'),
+                         {'ahelix': 3., 'rmsd': 0.02})
+        for bad in ['helix=3', 'ahelix', 'ahelix=x']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parity.parse_tolerances(bad)
+
+    def test_find_inputs(self):
+        run = os.path.join(self.tmp, 's.dat-CDPro')
+        os.makedirs(os.path.join(run, 'cdsstr-ibasis1'))
+        for d in [run, os.path.join(run, 'cdsstr-ibasis1')]:
+            open(os.path.join(d, 'input'), 'w').close()
+        other = os.path.join(self.tmp, 'other')
+        open(other, 'w').close()
+        # per-fit copies below a run directory are not separate inputs
+        self.assertEqual(parity.find_inputs([run, other]),
+                         [other, os.path.join(run, 'input')])
+
+    def test_compare(self):
+        results = {}
+        for ibasis, helix in [(1, 30.), (2, 36.)]:
+            results[('a/input', 'cdsstr', ibasis)] = fit_result(
+                'cdsstr', ibasis, [30., 20., 10., 40.], 0.10)
+            results[('a/input', 'selcon', ibasis)] = fit_result(
+                'selcon', ibasis, [helix, 18., 12., 40.], 0.12)
+        df = parity.compare(results, ['a/input'], ['cdsstr'], ['selcon'],
+                            [1, 2, 3])
+        self.assertEqual(list(df.columns), parity.COLUMNS)
+        self.assertEqual(list(df['passed']), [True, False, False])
+        self.assertEqual(list(df['status']),
+                         ['ok', 'ok', 'reference missing'])
+        self.assertAlmostEqual(df['ahelix_delta'].iloc[1], 6.)
+        self.assertAlmostEqual(df['rmsd_delta'].iloc[0], 0.02)
+        # looser tolerance
+        df = parity.compare(results, ['a/input'], ['cdsstr'], ['selcon'],
+                            [2], dict(parity.TOLERANCES, ahelix=10.))
+        self.assertTrue(df['passed'].all())
+
+        table = parity.by_basis(parity.compare(
+            results, ['a/input'], ['cdsstr'], ['selcon'], [1, 2]))
+        row = table.loc[(2, 'cdsstr', 'selcon')]
+        self.assertEqual(row['n'], 1)
+        self.assertEqual(row['passed'], 0.)
+        self.assertAlmostEqual(row['ahelix_mad'], 6.)
+        self.assertAlmostEqual(row['bstrand_mad'], 2.)
+
+    def test_speed(self):
+        timings = pd.DataFrame([['cdsstr', 1., 'live'], ['cdsstr', 3., 'live'],
+                                ['selcon', .01, 'live']],
+                               columns=['algorithm', 'duration', 'source'])
+        out = parity.speed(timings)
+        self.assertEqual(list(out.index), ['cdsstr', 'selcon'])
+        self.assertEqual(out.loc['cdsstr', 'fits'], 2)
+        self.assertAlmostEqual(out.loc['cdsstr', 'fits_per_s'], 0.5)
+        self.assertAlmostEqual(out.loc['cdsstr', 'p50_s'], 2.)
+        self.assertAlmostEqual(out.loc['selcon', 'fits_per_s'], 100.)
+
+    def test_fixture_round_trip(self):
+        fixtures = parity.Fixtures(os.path.join(self.tmp, 'fx'))
+        wl = np.arange(240., 177., -1.)
+        head = cdpro.cdpro_input_header(178., 240., 1)
+        name = os.path.join(self.tmp, 'input')
+        with open(name, 'w') as f:
+            f.write(cdpro.input_text(['%1.3f' % v for v in np.sin(wl)],
+                                     head, 1))
+        job = parity.jobs([name], ['selcon3'], [1], fixtures)[0]
+        self.assertEqual(job.out_dir, fixtures.path(job))
+        self.assertEqual(fixtures.load(job).status, 'failed')
+
+        # recorded output in the CDPro layout
+        os.makedirs(job.out_dir)
+        b = basis.Basis(1, 'SP37A', 'x', wl, np.ones((wl.size, 2)),
+                        np.ones((5, 2)), ['H', 'S', 'Turn', 'PP2', 'Unrd'],
+                        ['P1', 'P2'])
+        selcon.write_output(job.out_dir, b, np.array([.4, .2, .1, .1, .2]),
+                            wl, np.sin(wl), np.sin(wl) + 0.1)
+        fixtures.record(jobs.FitResult(job, 'ok', duration=2.5))
+
+        # the same input text replays without running anything
+        again = parity.jobs([name], ['selcon3'], [1])[0]
+        r = fixtures.load(again)
+        self.assertTrue(r.ok)
+        self.assertTrue(r.cached)
+        self.assertEqual(r.duration, 2.5)
+        self.assertEqual(r.refset, 'SP37A')
+        self.assertAlmostEqual(r.rmsd, 0.1, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
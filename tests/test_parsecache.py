@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_parsecache
+----------------------------------
+
+Tests for `cdgo.parsecache` module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import metrics
+from cdgo import parsecache
+
+ROWS = pd.DataFrame({'X': ['201.00', '200.00'], 'CD_Signal': [1.5, -2.],
+                     'CD_Dynode': [300., 310.]},
+                    columns=['X', 'CD_Signal', 'CD_Dynode'])
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'sample.dat')
+        with open(self.src, 'w') as f:
+            f.write('Instrument\nExperiment Type: Wavelength\n')
+        self.cache = parsecache.ParseCache(os.path.join(self.tmp, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_roundtrip(self):
+        self.assertIsNone(self.cache.get(self.src))
+        self.cache.put(self.src, parsecache.to_table(ROWS), {'line_no': 2})
+        table, meta = self.cache.get(self.src)
+        self.assertIsInstance(table, np.memmap)
+        self.assertEqual(meta['line_no'], 2)
+        df = parsecache.to_frame(table)
+        self.assertEqual(list(df['X']), ['201.00', '200.00'])
+        np.testing.assert_allclose(df['CD_Signal'], [1.5, -2.])
+
+    def test_touched_file_is_revalidated(self):
+        self.cache.put(self.src, parsecache.to_table(ROWS), {'line_no': 2})
+        st = os.stat(self.src)
+        os.utime(self.src, (st.st_atime, st.st_mtime + 10))
+        self.assertIsNotNone(self.cache.get(self.src))
+
+    def test_changed_file_is_stale(self):
+        self.cache.put(self.src, parsecache.to_table(ROWS), {'line_no': 2})
+        before = metrics.PARSE_CACHE.value(result='stale')
+        with open(self.src, 'w') as f:
+            f.write('Instrument\nExperiment Type: Wavelength (edited)\n')
+        self.assertIsNone(self.cache.get(self.src))
+        self.assertEqual(metrics.PARSE_CACHE.value(result='stale'),
+                         before + 1)
+
+    def test_header(self):
+        self.assertEqual(parsecache.header(self.src),
+                         {'Experiment Type': 'Wavelength'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_plotting
+----------------------------------
+
+Tests for `cdgo.plotting` module.
+"""
+
+import unittest
+
+import pandas as pd
+
+from cdgo import plotting
+
+
+def curve():
+    return pd.DataFrame({'ExpCD': [1., 2.], 'CalcCD': [1.1, 1.9]},
+                        index=pd.Index([200., 199.], name='WaveL'))
+
+
+class TestPlotTasks(unittest.TestCase):
+
+    def test_algorithm_without_fits_is_skipped(self):
+        ss_assign = pd.DataFrame({'alg': ['continll', 'continll'],
+                                  'ibasis': ['SP29', 'SP22X'],
+                                  'rmsd': [0.3, 0.1]}, index=[1, 2])
+        curves = {('continll', 1): curve(), ('continll', 2): curve()}
+        tasks = plotting.plot_tasks(ss_assign, curves,
+                                    ['continll', 'selcon'], 'x')
+        self.assertEqual([t[0] for t in tasks], ['overlay', 'grid'])
+        lines = tasks[0][1][0]
+        self.assertEqual(len(lines), 1)
+        self.assertIn('ibasis 2', lines[0][0])
+        self.assertEqual(tasks[1][1][0], 'continll')
+
+    def test_no_fits(self):
+        ss_assign = pd.DataFrame(columns=['alg', 'ibasis', 'rmsd'])
+        self.assertEqual(plotting.plot_tasks(ss_assign, {}, ['selcon'], 'x'),
+                         [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_preprocess
+----------------------------------
+
+Tests for `cdgo.preprocess` module.
+"""
+
+import argparse
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import preprocess
+
+
+def frame(wl, signal, dynode=300.):
+    return pd.DataFrame({'CD_Signal': signal,
+                         'CD_Dynode': np.full(len(wl), dynode)},
+                        index=pd.Index(wl, name='X'))
+
+
+class TestAverage(unittest.TestCase):
+
+    def test_align_tolerates_jitter(self):
+        a = frame([202., 201., 200.], [1., 2., 3.])
+        b = frame([202.0000001, 201.0000001], [3., 4.])
+        wl, stack = preprocess.align([a, b])
+        np.testing.assert_allclose(wl, [202., 201.])
+        np.testing.assert_allclose(stack, [[1., 2.], [3., 4.]])
+
+    def test_average_and_sem(self):
+        wl = [201., 200.]
+        df = preprocess.average([frame(wl, [1., 2.]), frame(wl, [3., 2.]),
+                                 frame(wl, [5., 2.], dynode=500.)])
+        np.testing.assert_allclose(df['CD_Signal'], [3., 2.])
+        np.testing.assert_allclose(df['CD_SEM'], [2. / np.sqrt(3), 0.])
+        np.testing.assert_allclose(df['CD_Dynode'], [500., 500.])
+        self.assertEqual(df['n'].iloc[0], 3)
+
+    def test_subtract_combines_errors(self):
+        wl = [201., 200.]
+        s = pd.DataFrame({'CD_Signal': [3., 2.], 'CD_SEM': [3., 0.]},
+                         index=wl)
+        b = pd.DataFrame({'CD_Signal': [1., 1.], 'CD_SEM': [4., 0.]},
+                         index=wl)
+        out = preprocess.subtract(s, b)
+        np.testing.assert_allclose(out['CD_Signal'], [2., 1.])
+        np.testing.assert_allclose(out['CD_SEM'], [5., 0.])
+
+
+class TestSavgol(unittest.TestCase):
+
+    def test_preserves_polynomials(self):
+        x = np.linspace(-3, 3, 40)
+        y = 2 * x ** 2 - x + 1
+        np.testing.assert_allclose(preprocess.savgol(y, 7, 2), y,
+                                   atol=1e-9)
+
+    def test_reduces_noise(self):
+        rng = np.random.RandomState(0)
+        x = np.linspace(0, 1, 200)
+        clean = np.sin(2 * np.pi * x)
+        noisy = clean + rng.normal(0, 0.1, x.size)
+        smoothed = preprocess.savgol(noisy, 11, 2)
+        self.assertLess(np.abs(smoothed - clean).mean(),
+                        np.abs(noisy - clean).mean() / 2)
+
+    def test_batch_matches_rows(self):
+        rng = np.random.RandomState(1)
+        y = rng.normal(size=(4, 30))
+        batch = preprocess.savgol(y, 5, 3)
+        for i in range(4):
+            np.testing.assert_allclose(batch[i],
+                                       preprocess.savgol(y[i], 5, 3))
+
+    def test_parse_smooth(self):
+        self.assertEqual(preprocess.parse_smooth('7'), (7, 2))
+        self.assertEqual(preprocess.parse_smooth('9:3'), (9, 3))
+        for bad in ('8', '3:3', 'x'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                preprocess.parse_smooth(bad)
+
+
+class TestResample(unittest.TestCase):
+
+    def test_half_nm_scan_keeps_integer_points(self):
+        wl = np.arange(260., 189.9, -0.5)
+        y = np.sin(wl)
+        grid, out = preprocess.resample(wl, y)
+        np.testing.assert_allclose(grid, np.arange(190., 261.))
+        np.testing.assert_allclose(out, np.sin(grid))
+
+    def test_jitter_and_odd_steps(self):
+        wl = np.arange(230., 199.9, -0.2) + 1e-9
+        grid, out = preprocess.resample(wl, 2 * wl)
+        np.testing.assert_allclose(grid, np.arange(200., 231.))
+        np.testing.assert_allclose(out, 2 * grid)
+
+    def test_clipped_to_cdpro_limits(self):
+        grid, out = preprocess.resample(np.arange(170., 271.), np.ones(101))
+        self.assertEqual((grid[0], grid[-1]), (178., 260.))
+
+    def test_bin_averages_neighbours(self):
+        wl = np.array([200., 200.25, 201., 201.25])
+        grid, out = preprocess.resample(wl, [1., 3., 5., 7.], method='bin')
+        np.testing.assert_allclose(out, [2., 6.])
+
+    def test_bin_half_nm_grid(self):
+        wl = np.arange(200., 206.01, 0.5)
+        grid, out = preprocess.resample(wl, wl, method='bin')
+        # inner bins are centred: g - 0.5 and g + 0.5 count half
+        np.testing.assert_allclose(out[1:-1], grid[1:-1])
+        grid, out = preprocess.resample(wl, (wl * 2) % 2, method='bin')
+        np.testing.assert_allclose(out[1:-1], 0.5)
+
+    def test_batch(self):
+        wl = np.arange(200., 211.) + 0.3
+        y = np.vstack([wl, 2 * wl, 3 * wl])
+        grid, out = preprocess.resample(wl, y)
+        self.assertEqual(out.shape, (3, 10))
+        np.testing.assert_allclose(out, np.vstack([grid, 2 * grid,
+                                                   3 * grid]))
+
+    def test_gaps_are_dropped(self):
+        wl = np.array([200., 201., 205., 206.])
+        grid, out = preprocess.resample(wl, wl)
+        self.assertTrue(np.all(np.isnan(out[2:5])))
+        np.testing.assert_allclose(out[[0, 1, 5, 6]], [200., 201., 205.,
+                                                       206.])
+
+    def test_to_grid_rejects_interior_gaps(self):
+        wl = [200., 199., 198., 197., 196., 192., 191., 190.]
+        df = pd.DataFrame({'CD_Signal': np.arange(8.)}, index=wl)
+        with self.assertRaises(ValueError) as e:
+            preprocess.to_grid(df)
+        self.assertIn('between 192 and 196 nm', str(e.exception))
+        # points missing at the ends are trimmed
+        df = pd.DataFrame({'CD_Signal': [1., 2., 3.]},
+                          index=[201., 200., 199.])
+        s = preprocess.to_grid(df)
+        self.assertEqual(list(s.index), [201., 200., 199.])
+
+    def test_rejects_repeated_wavelengths(self):
+        with self.assertRaises(ValueError):
+            preprocess.resample([200., 201., 200., 201.], np.ones(4))
+
+    def test_to_grid_string_index(self):
+        df = pd.DataFrame({'CD_Signal': [3., 2., 1.]},
+                          index=['202.00', '201.50', '201.00'])
+        s = preprocess.to_grid(df)
+        self.assertEqual(list(s.index), [202., 201.])
+        np.testing.assert_allclose(s.values, [3., 1.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_qc
+----------------------------------
+
+Tests for `cdgo.qc` module.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import qc
+
+
+def spectrum(lo=180., hi=260., step=0.5, amplitude=20., noise=0.2, seed=0):
+    wl = np.arange(hi, lo - step / 2, -step)
+    rng = np.random.RandomState(seed)
+    y = amplitude * np.exp(-((wl - 208.) / 12.) ** 2) + \
+        rng.normal(0, noise, wl.size)
+    return pd.Series(y, index=wl)
+
+
+class TestAssess(unittest.TestCase):
+
+    def test_good_spectrum_passes(self):
+        report = qc.assess(spectrum(), pd.Series(np.full(161, 300.)))
+        self.assertTrue(report['passed'])
+        self.assertEqual(report['reasons'], [])
+        self.assertEqual(report['points'], 161)
+        self.assertEqual(report['low_wl'], 180.)
+        self.assertEqual(qc.label(report, 'reject'), 'pass')
+
+    def test_noise_estimate(self):
+        rng = np.random.RandomState(1)
+        noise = qc.noise_level(rng.normal(0, 0.5, 5000))
+        self.assertAlmostEqual(noise, 0.5, delta=0.05)
+
+    def test_noise_only_fails_snr(self):
+        report = qc.assess(spectrum(amplitude=0.))
+        self.assertFalse(report['passed'])
+        self.assertIn('signal to noise below 3.0', report['reasons'])
+
+    def test_short_range(self):
+        report = qc.assess(spectrum(lo=210., hi=230.))
+        self.assertFalse(report['passed'])
+        self.assertEqual(len(report['reasons']), 2)
+        self.assertTrue(qc.label(report, 'reject').startswith('rejected: '))
+        self.assertTrue(qc.label(report, 'flag').startswith('flagged: '))
+
+    def test_few_points(self):
+        report = qc.assess(spectrum(step=5.))
+        self.assertIn('fewer than 20 usable points', report['reasons'])
+
+    def test_saturated_dynode(self):
+        s = spectrum()
+        dynode = np.where(s.index < 230., 580., 300.)
+        report = qc.assess(s, pd.Series(dynode, index=s.index))
+        self.assertFalse(report['passed'])
+        self.assertGreater(report['ht_fraction'], 0.5)
+
+    def test_thresholds_override(self):
+        report = qc.assess(spectrum(lo=190.), thresholds={'max_low_wl': 185.})
+        self.assertEqual(report['reasons'], ['spectrum stops above 185.0 nm'])
+
+    def test_empty(self):
+        report = qc.assess(pd.Series([], dtype=float))
+        self.assertFalse(report['passed'])
+        self.assertEqual(report['points'], 0)
+
+
+class TestIO(unittest.TestCase):
+
+    def test_parse_thresholds(self):
+        self.assertEqual(qc.parse_thresholds('min_snr=5,min_points=40'),
+                         {'min_snr': 5., 'min_points': 40.})
+        for bad in ['snr=5', 'min_snr', 'min_snr=x']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                qc.parse_thresholds(bad)
+
+    def test_write_is_valid_json(self):
+        d = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(d, 'quality.json')
+            qc.write(qc.assess(pd.Series([], dtype=float)), fname)
+            with open(fname) as f:
+                report = json.load(f)
+            self.assertIsNone(report['low_wl'])
+        finally:
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_resources
+----------------------------------
+
+Tests for `cdgo.resources` module.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from cdgo import resources
+
+
+class Host(object):
+    """Scripted (load, free memory) samples"""
+
+    def __init__(self, load=0., free=8000.):
+        self.load = load
+        self.free = free
+
+    def __call__(self):
+        return self.load, self.free
+
+
+class TestHost(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_parse_cpus(self):
+        self.assertEqual(resources.parse_cpus('6,0-2'), [0, 1, 2, 6])
+        for bad in ['', 'a', '1-x', '-1']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                resources.parse_cpus(bad)
+
+    def test_available_memory(self):
+        meminfo = os.path.join(self.tmp, 'meminfo')
+        with open(meminfo, 'w') as f:
+            f.write('MemTotal:       16384000 kB\n'
+                    'MemFree:          102400 kB\n'
+                    'MemAvailable:    2048000 kB\n')
+        self.assertEqual(resources.available_memory(meminfo), 2000.)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_backs_off_and_ramps_up(self):
+        host = Host()
+        s = resources.Scheduler(8, max_load=4., min_free=1000., interval=10.,
+                                probe=host)
+        self.assertEqual(s.adjust(now=0.), 8)
+        host.load = 6.
+        # not sampled again within the interval
+        self.assertEqual(s.adjust(now=5.), 8)
+        self.assertEqual(s.adjust(now=10.), 4)
+        host.load, host.free = 1., 500.
+        self.assertEqual(s.adjust(now=20.), 2)
+        # between the idle level and the thresholds nothing changes
+        host.free = 1200.
+        self.assertEqual(s.adjust(now=30.), 2)
+        host.free = 4000.
+        self.assertEqual(s.adjust(now=40.), 3)
+        self.assertEqual([d[1:3] for d in s.decisions],
+                         [(8, 4), (4, 2), (2, 3)])
+        self.assertIn('load 6.00 > 4.0', s.decisions[0][3])
+        self.assertIn('free memory 500 MB < 1000.0 MB', s.decisions[1][3])
+        host.load = 100.
+        for t in range(50, 100, 10):
+            s.adjust(now=t)
+        self.assertEqual(s.limit, 1)
+
+    def test_unknown_host_state(self):
+        s = resources.Scheduler(2, max_load=1., interval=0.,
+                                probe=lambda: (None, None))
+        s.limit = 1
+        self.assertEqual(s.adjust(), 2)
+
+    def test_slots_respect_limit(self):
+        host = Host(load=10.)
+        s = resources.Scheduler(4, max_load=4., interval=0.05, probe=host)
+        running = []
+        peak = [0]
+        lock = threading.Lock()
+
+        def work():
+            with s.slot() as slot:
+                with lock:
+                    running.append(slot)
+                    peak[0] = max(peak[0], len(running))
+                time.sleep(0.02)
+                with lock:
+                    running.remove(slot)
+        threads = [threading.Thread(target=work) for _ in range(12)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(peak[0], 2)
+        self.assertEqual(s.running, 0)
+        self.assertEqual(s._slots, [0, 1, 2, 3])
+
+    def test_pinning(self):
+        s = resources.Scheduler(3, cpus=[0, 4096])
+        # CPUs the host does not have are dropped
+        self.assertEqual(s.cpus, [0])
+        s.cpus = [2, 5]
+        self.assertEqual([s.slot_cpus(k) for k in range(3)],
+                         [[2], [5], [2]])
+        self.assertIsNone(resources.Scheduler(3).slot_cpus(0))
+        s._taskset = '/usr/bin/taskset'
+        self.assertEqual(s.command("echo 'a' || b", 1),
+                         "/usr/bin/taskset -c 5 sh -c 'echo '\"'\"'a'\"'\"' "
+                         "|| b'")
+
+    def test_preexec(self):
+        self.assertIsNone(resources.Scheduler(2).preexec(0))
+        self.assertTrue(callable(resources.Scheduler(2, nice=5).preexec(0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
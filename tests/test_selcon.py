@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_selcon
+----------------------------------
+
+Tests for `cdgo.selcon` module and native fits in `cdgo.jobs`.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cdgo import basis
+from cdgo import cdpro
+from cdgo import jobs
+from cdgo import selcon
+
+# structure classes of SP37A, as read_protss expects
+LABELS = ['H', 'S', 'Turn', 'PP2', 'Unrd']
+
+
+def class_spectra(wl):
+    """Helix, sheet, turn, PPII and coil spectra (delta epsilon)"""
+    def band(centre, width):
+        return np.exp(-((wl - centre) / width) ** 2)
+    return np.array([-10 * band(222, 8) - 12 * band(208, 6) +
+                     20 * band(192, 6),
+                     -6 * band(216, 8) + 8 * band(196, 6),
+                     -2 * band(225, 8) + 3 * band(205, 6),
+                     3 * band(218, 6) - 8 * band(200, 5),
+                     -5 * band(196, 6)]).T
+
+
+def make_basis(n=30, noise=0.05, seed=1):
+    rng = np.random.RandomState(seed)
+    wl = np.arange(240., 177., -1.)
+    F = rng.dirichlet([2, 1.5, 1, 1, 2], n).T
+    A = class_spectra(wl).dot(F) + rng.normal(0, noise, (wl.size, n))
+    return basis.Basis(5, 'SP37A', 'x', wl, A, F, LABELS,
+                       ['P{}'.format(i) for i in range(n)])
+
+
+class TestSolver(unittest.TestCase):
+
+    def setUp(self):
+        self.basis = make_basis()
+        rng = np.random.RandomState(2)
+        self.truth = rng.dirichlet([2, 1.5, 1, 1, 2], 6)
+        wl = np.arange(260., 177., -1.)
+        self.wl = wl
+        self.Y = self.truth.dot(class_spectra(wl).T) + \
+            rng.normal(0, 0.05, (6, wl.size))
+
+    def test_recovers_fractions(self):
+        wl, Y, f, calc, count = selcon.fit(self.basis, self.wl, self.Y)
+        # only the wavelengths of the basis are used
+        self.assertEqual(wl[0], 240.)
+        self.assertEqual(Y.shape, calc.shape)
+        np.testing.assert_allclose(f, self.truth, atol=0.02)
+        self.assertTrue(np.all(count > 0))
+        rmsd = np.sqrt(((calc - Y) ** 2).mean(axis=1))
+        self.assertTrue(np.all(rmsd < selcon.MAX_RMSD))
+
+    def test_batch_matches_single(self):
+        f_all = selcon.fit(self.basis, self.wl, self.Y)[2]
+        f_one = selcon.fit(self.basis, self.wl, self.Y[3])[2]
+        np.testing.assert_allclose(f_one[0], f_all[3], atol=1e-8)
+
+    def test_summary(self):
+        out = selcon.summary(['H(r)', 'H(d)', 'S(r)', 'S(d)', 'Trn', 'Unrd'],
+                             np.array([.2, .1, .1, .1, .2, .3]))
+        self.assertEqual(out, {'ahelix': '30.0%', 'bstrand': '20.0%',
+                               'turn': '20.0%', 'unord': '30.0%'})
+        with self.assertRaises(ValueError):
+            selcon.class_matrix(['Q'])
+
+    def test_too_few_wavelengths(self):
+        with self.assertRaises(ValueError):
+            selcon.fit(self.basis, np.arange(300., 280., -1.),
+                       np.ones((1, 20)))
+
+
+class TestNativeRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cdpro_dir = os.path.join(self.tmp, 'CDPro')
+        os.makedirs(self.cdpro_dir)
+        b = make_basis()
+        with open(os.path.join(self.cdpro_dir, 'SP37A.txt'), 'w') as f:
+            f.write(basis.TABLE_HEADER + '\n')
+            f.write('WL  ' + '  '.join(b.proteins) + '\n')
+            for x, row in zip(b.wavelengths, b.spectra):
+                f.write('{:.0f}  '.format(x) +
+                        '  '.join('{:.4f}'.format(v) for v in row) + '\n')
+            for label, row in zip(b.labels, b.fractions):
+                f.write(label + '  ' +
+                        '  '.join('{:.4f}'.format(v) for v in row) + '\n')
+        self.store = basis.BasisStore(os.path.join(self.tmp, 'store'))
+        self.store.compile(self.cdpro_dir, [5])
+        wl = np.arange(240., 177., -1.)
+        self.values = ['%1.3f' % v for v in
+                       class_spectra(wl).dot([.4, .2, .1, .1, .2])]
+        self.head = cdpro.cdpro_input_header(178., 240., 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_input_text(self):
+        ibasis, wl, values = cdpro.read_input_text(
+            cdpro.input_text(self.values, self.head, 5))
+        self.assertEqual(ibasis, 5)
+        self.assertEqual((wl[0], wl[-1]), (240., 178.))
+        np.testing.assert_allclose(values, [float(v) for v in self.values])
+
+    def test_native_jobs(self):
+        out_dir = os.path.join(self.tmp, 'selcon-ibasis5')
+        batch = [jobs.FitJob('selcon', 5, cdpro.input_text(self.values,
+                                                           self.head, 5),
+                             out_dir=out_dir if k == 0 else None, tag=k)
+                 for k in range(3)] + \
+            [jobs.FitJob('selcon', 2, cdpro.input_text(self.values,
+                                                       self.head, 2))]
+        runner = jobs.Runner(self.cdpro_dir, basis_store=self.store,
+                             batch=2)
+        results = list(runner.run(batch))
+        self.assertEqual(len(results), 4)
+        ok = [r for r in results if r.ok]
+        self.assertEqual(sorted(r.job.tag for r in ok), [0, 1, 2])
+        # no reference set for ibasis 2
+        self.assertEqual([r.status for r in results if not r.ok],
+                         ['failed'])
+        row = ok[0].row()
+        self.assertEqual(row[:2], ['SP37A', 'selcon'])
+        self.assertAlmostEqual(float(row[2].rstrip('%')), 40., delta=0.5)
+        self.assertLess(row[6], 0.05)
+        # the raw output reads back like CDPro output
+        parsed = jobs.parse_fit(jobs.FitResult(batch[0], 'ok'), out_dir)
+        self.assertEqual(parsed.refset, 'SP37A')
+        for name in selcon.FRACTIONS:
+            self.assertAlmostEqual(float(parsed.ss[name].rstrip('%')),
+                                   float(ok[0].ss[name].rstrip('%')),
+                                   delta=0.15)
+        self.assertAlmostEqual(parsed.rmsd, ok[0].rmsd, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
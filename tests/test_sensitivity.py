@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_sensitivity
+----------------------------------
+
+Tests for `cdgo.sensitivity` module.
+"""
+
+import argparse
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from cdgo import cdpro
+from cdgo import sensitivity
+
+
+class TestSensitivity(unittest.TestCase):
+
+    def setUp(self):
+        wl = np.arange(260., 177., -1.)
+        self.epsilon = pd.Series(['%1.3f' % x for x in np.sin(wl)],
+                                 index=wl)
+        self.head = cdpro.cdpro_input_header(178., 260., 1)
+
+    def test_parse_axis(self):
+        self.assertEqual(sensitivity.parse_axis('concentration=10,-5'),
+                         ('concentration', [-5., 0., 10.]))
+        for bad in ['conc=10', 'mol_weight', 'mol_weight=x',
+                    'concentration=-100']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                sensitivity.parse_axis(bad)
+
+    def test_grid_factors(self):
+        points = sensitivity.grid([('concentration', [-10., 0., 10.]),
+                                   ('mol_weight', [0., 5.])], 101)
+        self.assertEqual(len(points), 6)
+        nominal = points[(points[sensitivity.PARAMETERS] == 0).all(axis=1)]
+        self.assertEqual(list(nominal['factor']), [1.])
+        row = points[(points['concentration'] == 10.) &
+                     (points['mol_weight'] == 5.)]
+        self.assertAlmostEqual(row['factor'].iloc[0], 1.05 / 1.1)
+        # 10% more residues: 110.1 peptide bonds instead of 100
+        points = sensitivity.grid([('number_residues', [0., 10.])], 101)
+        self.assertAlmostEqual(points['factor'].iloc[1], 100. / 110.1)
+
+    def test_jobs_nominal_matches_main_fit(self):
+        jobs = sensitivity.jobs(self.epsilon.astype(float), self.head,
+                                np.array([0.5, 1.]), ['cdsstr'], [1, 2])
+        self.assertEqual(len(jobs), 4)
+        nominal = [j for j in jobs if j.tag == 1. and j.ibasis == 1][0]
+        self.assertEqual(nominal.text,
+                         cdpro.input_text(self.epsilon, self.head, 1))
+
+    def test_slopes(self):
+        rows = []
+        for c in [-10., 0., 10.]:
+            rows.append([c, 0., 0., 1., 1, 'SP29', 'cdsstr',
+                         '%.1f%%' % (30. + c / 2), '20.0%', '10.0%',
+                         '40.0%', 0.1 + c / 100., 0, 0])
+        df = pd.DataFrame(rows, columns=sensitivity.COLUMNS)
+        out = sensitivity.slopes(df).loc[('concentration', 'cdsstr')]
+        self.assertAlmostEqual(out['ahelix'], 0.5)
+        self.assertAlmostEqual(out['bstrand'], 0.)
+        self.assertAlmostEqual(out['rmsd'], 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_summary
+----------------------------------
+
+Tests for `cdgo.summary` module.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cdgo import summary
+
+
+class TestSummaryStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmp, 'summary')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_rows_visible_before_close(self):
+        s = summary.SummaryStream(self.prefix, fsync=False)
+        s.write(4, ['SP43', 'cdsstr', '40.0%', '20.0%', '15.0%', '25.0%',
+                    0.1, 0.2, 0.99])
+        with open(self.prefix + '.csv') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], ',' + ','.join(summary.SUMMARY_COLUMNS))
+        self.assertEqual(lines[1].split(',')[:3], ['4', 'SP43', 'cdsstr'])
+        with open(self.prefix + '.jsonl') as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['index'], 4)
+        self.assertEqual(record['rmsd'], 0.1)
+        s.close()
+
+    def test_append_does_not_repeat_header(self):
+        for _ in range(2):
+            with summary.SummaryStream(self.prefix, fsync=False) as s:
+                s.write(1, ['SP29', 'continll', '', '', '', '', 0, 0, 0])
+        with open(self.prefix + '.csv') as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_eta(self):
+        p = summary.Progress(4)
+        self.assertIsNone(p.eta())
+        p.done = 2
+        self.assertGreaterEqual(p.eta(), 0)
+        self.assertIn('[2/4 fits]', p.line())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_vendors
+----------------------------------
+
+Tests for `cdgo.vendors` and `cdgo.importer` modules.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cdgo import aviv
+from cdgo import importer
+from cdgo import vendors
+
+WL = [202., 201., 200.]
+
+AVIV = ['Aviv Biomedical Model 420', 'Experiment Type: Wavelength', '$DATA',
+        'X  CD_Signal  CD_Dynode', '202.00  -1.0000  300.00',
+        '201.00  -2.0000  300.00', '200.00  -3.0000  300.00', '$ENDDATA']
+
+JASCO = ['TITLE\tlysozyme', 'ORIGIN\tJASCO', 'SPECTROMETER/DATA SYSTEM\tJ-815',
+         'XUNITS\tNANOMETERS', 'YUNITS\tCD [mdeg]', 'Y2UNITS\tHT [V]',
+         'NPOINTS\t3', 'XYDATA', '202.0\t-1.0\t300.0', '201.0\t-2.0\t310.0',
+         '200.0\t-3.0\t650.0', '', '##### Extended Information',
+         '[Comments]', 'Sample temperature 20 C']
+
+CHIRASCAN = ['Chirascan Pro-Data export,', 'Temperature:,20.0 C', '',
+             'CircularDichroism', 'Wavelength,Repeat 1,Repeat 2',
+             '202,-1.0,-1.2', '201,-2.0,-2.2', '200,-3.0,-3.2', '',
+             'HV', 'Wavelength,Repeat 1,Repeat 2', '202,300,300',
+             '201,310,700', '200,320,320', '',
+             'Absorbance', 'Wavelength,Repeat 1,Repeat 2', '202,0.5,0.5',
+             '201,0.6,0.6', '200,0.7,0.7']
+
+PLAIN = ['wavelength,cd_a,cd_b,ht', '202,-1,-1.5,300', '201,-2,-2.5,300',
+         '200,-3,-3.5,300']
+
+
+class TestVendors(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.formats = list(vendors.FORMAT_ORDER)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        for name in set(vendors.FORMAT_ORDER) - set(self.formats):
+            del vendors.FORMATS[name]
+        vendors.FORMAT_ORDER[:] = self.formats
+
+    def write(self, name, lines):
+        fname = os.path.join(self.tmp, name)
+        with open(fname, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return fname
+
+    def test_detect(self):
+        for name, lines in [('aviv', AVIV), ('jasco', JASCO),
+                            ('chirascan', CHIRASCAN), ('csv', PLAIN)]:
+            self.assertEqual(vendors.detect(self.write(name, lines)), name)
+        with self.assertRaises(ValueError):
+            vendors.detect(self.write('notes', ['hello', 'world']))
+        # whitespace-only lines are skipped by every sniffer
+        with self.assertRaises(ValueError):
+            vendors.detect(self.write('blank', ['hello', '   ', 'world']))
+        self.assertEqual(vendors.detect(self.write(
+            'jb', JASCO[:1] + ['  '] + JASCO[1:])), 'jasco')
+        with self.assertRaises(ValueError):
+            vendors.read(self.write('x', AVIV), 'spc')
+
+    def test_aviv_matches_iter_scans(self):
+        fname = self.write('a.dat', AVIV)
+        fmt, scans = vendors.read(fname)
+        np.testing.assert_array_equal(
+            scans[0].data.values,
+            list(aviv.iter_scans(fname))[0].data.values)
+
+    def test_jasco(self):
+        fmt, scans = vendors.read(self.write('j.txt', JASCO))
+        self.assertEqual(len(scans), 1)
+        data = scans[0].data
+        self.assertEqual(list(data.columns), ['CD_Signal', 'CD_Dynode'])
+        # HT above 600 V is dropped, as for Aviv dynode voltages
+        self.assertEqual(list(data.index), [202., 201.])
+        self.assertEqual(list(data['CD_Signal']), [-1., -2.])
+        self.assertEqual(scans[0].meta['TITLE'], 'lysozyme')
+
+    def test_chirascan(self):
+        fmt, scans = vendors.read(self.write('c.csv', CHIRASCAN))
+        # one scan per repeat; absorbance is ignored
+        self.assertEqual(len(scans), 2)
+        self.assertEqual(scans[0].temperature, 20.)
+        self.assertEqual(list(scans[0].data['CD_Signal']), [-1., -2., -3.])
+        self.assertEqual(list(scans[0].data['CD_Dynode']), [300., 310., 320.])
+        self.assertEqual(list(scans[1].data.index), [202., 200.])
+
+    def test_plain_csv(self):
+        fmt, scans = vendors.read(self.write('p.csv', PLAIN))
+        self.assertEqual(fmt, 'csv')
+        self.assertEqual(len(scans), 2)
+        self.assertEqual(list(scans[1].data['CD_Signal']), [-1.5, -2.5,
+                                                            -3.5])
+        self.assertEqual(list(scans[1].data['CD_Dynode']), [300.] * 3)
+        # without a voltage column the dynode is unknown
+        fmt, scans = vendors.read(self.write('q.tsv', [
+            '202\t-1', '201\t-2', '200\t-3']))
+        self.assertTrue(scans[0].data['CD_Dynode'].isnull().all())
+
+    def test_register(self):
+        def read(fname):
+            return [vendors.make_scan(1, {}, WL, [1., 2., 3.])]
+        vendors.register('mine', lambda lines: lines[0] == 'MINE', read)
+        # tried before the csv fallback
+        self.assertEqual(vendors.FORMAT_ORDER[-2:], ['mine', 'csv'])
+        fname = self.write('m.txt', ['MINE'] + PLAIN[1:])
+        self.assertEqual(vendors.read(fname)[0], 'mine')
+
+
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_load_all(self):
+        files = []
+        for name, lines in [('a.dat', AVIV), ('c.csv', CHIRASCAN),
+                            ('bad.txt', ['nothing here'])]:
+            files.append(os.path.join(self.tmp, name))
+            with open(files[-1], 'w') as fp:
+                fp.write('\n'.join(lines) + '\n')
+        serial = importer.load_all(files, processes=1)
+        parallel = importer.load_all(files, processes=2)
+        self.assertEqual([r[:2] for r in parallel],
+                         [(files[0], 'aviv'), (files[1], 'chirascan'),
+                          (files[2], None)])
+        for s, p in zip(serial[:2], parallel[:2]):
+            np.testing.assert_array_equal(s[2].values, p[2].values)
+        # repeats are averaged on the wavelengths they share
+        self.assertEqual(list(parallel[1][2]['n']), [2, 2])
+        self.assertAlmostEqual(parallel[1][2]['CD_Signal'].iloc[0], -1.1)
+        self.assertIn('not in a known spectrum format', parallel[2][3])
+
+        rows = [importer.manifest_row(name, n, fmt, df, e)
+                for (name, fmt, df, e), n in
+                zip(parallel, importer.sample_names(files))]
+        self.assertEqual(rows[0][1:], ['a', 'aviv', 1, 3, 200., 202., 'ok',
+                                       None])
+        self.assertEqual(rows[2][7], 'failed')
+
+    def test_sample_names(self):
+        self.assertEqual(importer.sample_names(['x/a.dat', 'y/a.dat',
+                                                'b.csv']),
+                         ['a', 'a-2', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()